@@ -0,0 +1,84 @@
+# Time to connected: full 3 s discover (old path) versus callback scanning and a cached address, with a stand-in scanner
+# Usage: python -m benchmarks.connect_benchmark [first advertisement delay ms]
+import asyncio
+import contextlib
+import functools
+import io
+import os
+import sys
+import tempfile
+import time
+from utils.lwp3_definitions import *
+from utils.device_discovery import connect_hub, DeviceCache
+from utils.simulated_hub import SimulatedClient, SimulatedScanner
+
+HUB_ADDRESS = "90:84:2B:00:00:01"
+OTHER_ADDRESS = "90:84:2B:00:00:02"
+STALE_ADDRESSES = ("90:84:2B:00:00:03", "90:84:2B:00:00:04", "90:84:2B:00:00:05") # cached hubs that are out of range
+CONNECT_TIME = 0.3 # BLE connection setup
+
+class StandInClient(SimulatedClient):
+	# BleakClient(address or device) signature, direct connects only reach hubs that are in range
+	# and to a hub that is out of range only fail after the whole timeout
+	reachable = (HUB_ADDRESS, OTHER_ADDRESS)
+
+	def __init__(self, target):
+		super().__init__(address=getattr(target, 'address', target))
+
+	async def connect(self, timeout=None):
+		if self.address in STALE_ADDRESSES:
+			await asyncio.sleep(timeout)
+			raise OSError(f"Device with address {self.address} was not found")
+		await asyncio.sleep(CONNECT_TIME)
+		if self.address not in self.reachable:
+			raise OSError(f"Device with address {self.address} was not found")
+		return await super().connect(timeout)
+
+class NotCachedClient(StandInClient):
+	# first launch: a direct connect to an address that was never seen fails, the scan has to find it
+	reachable = ()
+
+	def __init__(self, target):
+		super().__init__(target)
+		if not isinstance(target, str):
+			self.reachable = (self.address,)
+
+async def first(connecting):
+	return (await connecting)[0]
+
+async def legacy_connect(scanner):
+	# the old connect_to_device: 3 s discover, then connect
+	devices = await scanner.discover(timeout=3)
+	for device in devices:
+		if device.name == DEVICE_NAME:
+			client = StandInClient(device)
+			await client.connect()
+			return client
+	return None
+
+async def measure(name, connect):
+	start = time.monotonic()
+	with contextlib.redirect_stdout(io.StringIO()):
+		client = await connect()
+	print(f"{name}: {time.monotonic() - start:.2f}s to connected ({client.address if client is not None else 'not connected'})")
+
+async def main():
+	delay = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.1
+	hubs = ((HUB_ADDRESS, DEVICE_NAME, delay), (OTHER_ADDRESS, DEVICE_NAME, delay / 2))
+	scanner_class = functools.partial(SimulatedScanner, hubs=hubs)
+	print(f"Two hubs in range, first advertisement after {delay * 1000:.0f}ms, connection setup {CONNECT_TIME * 1000:.0f}ms")
+	with tempfile.TemporaryDirectory() as directory:
+		cache = DeviceCache(os.path.join(directory, "devices.json"))
+		await measure("discover(timeout=3)", lambda: legacy_connect(scanner_class()))
+		await measure("callback scan", lambda: first(connect_hub(DEVICE_NAME, client_class=StandInClient, scanner_class=scanner_class)))
+		await measure("callback scan, -address", lambda: first(connect_hub(DEVICE_NAME, HUB_ADDRESS, cache, client_class=NotCachedClient, scanner_class=scanner_class)))
+		await measure("cached address", lambda: first(connect_hub(DEVICE_NAME, HUB_ADDRESS, DeviceCache(cache.path), client_class=StandInClient, scanner_class=scanner_class)))
+		stale = DeviceCache(os.path.join(directory, "stale.json"))
+		for stale_address in STALE_ADDRESSES:
+			stale.remember(stale_address, DEVICE_NAME)
+		await measure(f"{len(STALE_ADDRESSES)} cached hubs out of range", lambda: first(connect_hub(DEVICE_NAME, cache=DeviceCache(stale.path), client_class=StandInClient, scanner_class=scanner_class)))
+		await measure("next launch", lambda: first(connect_hub(DEVICE_NAME, cache=DeviceCache(stale.path), client_class=StandInClient, scanner_class=scanner_class)))
+		print(f"Cached after the failed direct connect: {', '.join(DeviceCache(stale.path).addresses())}")
+
+if __name__ == "__main__":
+	asyncio.run(main())
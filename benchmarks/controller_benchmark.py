@@ -0,0 +1,211 @@
+# Drives scripted joystick traces through the controller's handle_controller_events against the simulated hub
+# Reports startup time, writes/sec, input-to-write latency and CPU per update, -baseline fails on regressions
+# Usage: python -m benchmarks.controller_benchmark [-latency ms] [-jitter ms] [-loss p] [-json out.json] [-baseline out.json]
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import os
+import sys
+import time
+from utils.command_scheduler import CommandScheduler
+from utils.response_dispatcher import ResponseDispatcher
+from utils.input_shaping import InputShaper
+from utils.latency_stats import LatencyStats, STAGE_TOTAL, CATEGORY_DRIVE, CATEGORY_PLAYVM
+from utils.simulated_hub import SimulatedClient
+
+CONTROLLER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lego-porsche-controller.py")
+TRACE_DURATION = 2.0
+RELEASED = -1.0 # trigger axis at rest
+
+# Metrics compared with -baseline (lower is better) and the smallest difference that is not just noise
+REGRESSION_METRICS = {"cpu_us_per_update": 5.0, "latency_p95_ms": 1.0}
+
+def load_controller():
+	# The controller is a script, loaded by path; pygame needs no window for posted events
+	os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+	spec = importlib.util.spec_from_file_location("lego_porsche_controller", CONTROLLER_PATH)
+	controller = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(controller)
+	controller.load_pygame()
+	return controller
+
+class ScriptedJoystick:
+	# Replaces pygame's Joystick, axes 0 steering, 4 left trigger, 5 right trigger
+	def __init__(self, instance_id=0):
+		self.instance_id = instance_id
+		self.axes = [0.0, 0.0, 0.0, 0.0, RELEASED, RELEASED]
+		self.buttons = [0] * 12
+
+	def get_axis(self, axis):
+		return self.axes[axis]
+
+	def get_button(self, button):
+		return self.buttons[button]
+
+	def get_name(self):
+		return "Scripted joystick"
+
+	def get_instance_id(self):
+		return self.instance_id
+
+# Traces: time (s) -> (steering, left trigger, right trigger, pressed buttons)
+def throttle_steps(t):
+	return (0.0, RELEASED, 1.0 if int(t / 0.25) % 2 else RELEASED, ())
+
+def slalom(t):
+	return (math.sin(2 * math.pi * t), RELEASED, 0.4, ())
+
+def stop_and_go(t):
+	phase = int(t / 0.2) % 4
+	if phase == 0:
+		return (0.0, RELEASED, 1.0, ())
+	if phase == 1:
+		return (0.0, RELEASED, RELEASED, (5,)) # brake
+	if phase == 2:
+		return (0.0, 1.0, RELEASED, ())
+	return (0.0, RELEASED, RELEASED, ())
+
+def lights(t):
+	return (0.0, RELEASED, 0.2, (3,) if int(t / 0.1) % 4 == 0 else (1,) if int(t / 0.1) % 4 == 2 else ())
+
+TRACES = {"throttle steps": throttle_steps, "slalom": slalom, "stop and go": stop_and_go, "lights": lights}
+
+def post_changes(pygame, joystick, steering, left, right, buttons):
+	for axis, value in ((0, steering), (4, left), (5, right)):
+		if joystick.axes[axis] != value:
+			joystick.axes[axis] = value
+			pygame.event.post(pygame.event.Event(pygame.JOYAXISMOTION, joy=0, instance_id=0, axis=axis, value=value))
+	for button in range(len(joystick.buttons)):
+		pressed = 1 if button in buttons else 0
+		if joystick.buttons[button] != pressed:
+			joystick.buttons[button] = pressed
+			pygame.event.post(pygame.event.Event(pygame.JOYBUTTONDOWN if pressed else pygame.JOYBUTTONUP, joy=0, instance_id=0, button=button))
+
+async def connect(controller, args):
+	client = SimulatedClient(write_latency=args.latency / 1000, jitter=args.jitter / 1000, loss=args.loss, seed=args.seed)
+	controller.client = client
+	controller.metrics = LatencyStats()
+	controller.scheduler = CommandScheduler(controller.write_characteristic, metrics=controller.metrics)
+	controller.dispatcher = ResponseDispatcher(timeout=0.5)
+	controller.dispatcher.subscribe(controller.handle_notification)
+	await controller.dispatcher.start(client)
+	return client
+
+async def run_startup(controller, args):
+	await connect(controller, args)
+	stop_event = asyncio.Event()
+	task = asyncio.create_task(controller.scheduler.run(stop_event))
+	start = time.monotonic()
+	with contextlib.redirect_stdout(io.StringIO()):
+		await controller.initialize_hub()
+	startup = time.monotonic() - start
+	await controller.scheduler.flush()
+	stop_event.set()
+	await task
+	await controller.dispatcher.stop()
+	return startup
+
+async def run_trace(controller, args, name, trace):
+	client = await connect(controller, args)
+	stop_event = asyncio.Event()
+	task = asyncio.create_task(controller.scheduler.run(stop_event))
+	controller.drive_virtual_port = None
+	with contextlib.redirect_stdout(io.StringIO()):
+		await controller.setup_drive_virtual_port()
+	await controller.scheduler.flush()
+	joystick = ScriptedJoystick()
+	controller.joystick = joystick
+	writes_before = len(client.writes)
+	controller.pygame.event.clear()
+
+	interval = 1 / args.rate
+	updates = 0
+	cpu = 0.0
+	start = time.monotonic()
+	next_sample = start
+	while next_sample - start < TRACE_DURATION:
+		post_changes(controller.pygame, joystick, *trace(next_sample - start))
+		now = time.monotonic()
+		cpu_start = time.process_time()
+		await controller.handle_controller_events(batch=True, stamp=now)
+		cpu += time.process_time() - cpu_start
+		updates += 1
+		next_sample = max(next_sample + interval, time.monotonic())
+		await asyncio.sleep(next_sample - time.monotonic())
+	await controller.scheduler.flush()
+	elapsed = time.monotonic() - start
+	stop_event.set()
+	await task
+	await controller.dispatcher.stop()
+
+	latency = [controller.metrics.histograms[key] for key in ((STAGE_TOTAL, CATEGORY_DRIVE), (STAGE_TOTAL, CATEGORY_PLAYVM)) if key in controller.metrics.histograms]
+	p95 = max((histogram.milliseconds(95) for histogram in latency), default=0.0)
+	p50 = max((histogram.milliseconds(50) for histogram in latency), default=0.0)
+	p99 = max((histogram.milliseconds(99) for histogram in latency), default=0.0)
+	writes = len(client.writes) - writes_before
+	result = {
+		'updates': updates,
+		'writes': writes,
+		'writes_per_s': writes / elapsed,
+		'lost': len(client.lost),
+		'latency_p50_ms': p50,
+		'latency_p95_ms': p95,
+		'latency_p99_ms': p99,
+		'cpu_us_per_update': cpu / updates * 1000000,
+	}
+	print(f"{name}: {updates} updates, {writes} writes ({result['writes_per_s']:.0f}/s), input-to-write p50 {p50:.1f}ms p95 {p95:.1f}ms p99 {p99:.1f}ms, CPU {result['cpu_us_per_update']:.0f}us/update")
+	return result
+
+def compare(results, baseline, tolerance):
+	# True when no metric got worse than the baseline by more than tolerance
+	ok = True
+	if results['startup_s'] > baseline.get('startup_s', math.inf) * (1 + tolerance):
+		print(f"REGRESSION startup: {results['startup_s']:.3f}s vs {baseline['startup_s']:.3f}s")
+		ok = False
+	for name, result in results['traces'].items():
+		previous = baseline.get('traces', {}).get(name)
+		if previous is None:
+			continue
+		for metric, noise in REGRESSION_METRICS.items():
+			if result[metric] > previous[metric] * (1 + tolerance) and result[metric] - previous[metric] > noise:
+				print(f"REGRESSION {name} {metric}: {result[metric]:.1f} vs {previous[metric]:.1f}")
+				ok = False
+	return ok
+
+async def main(args):
+	controller = load_controller()
+	controller.pygame.init()
+	controller.create_drive(InputShaper(controller.powerlimit))
+	print(f"Simulated hub: latency {args.latency:.1f}ms, jitter {args.jitter:.1f}ms, loss {args.loss:.1%}, {args.rate}Hz input")
+	startup = await run_startup(controller, args)
+	print(f"Startup (initialize_hub): {startup * 1000:.0f}ms")
+	results = {'startup_s': startup, 'traces': {}}
+	for name, trace in TRACES.items():
+		results['traces'][name] = await run_trace(controller, args, name, trace)
+	return results
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Controller benchmark against the simulated hub")
+	parser.add_argument('-latency', type=float, default=7.5, help="Simulated write latency in ms (default 7.5)")
+	parser.add_argument('-jitter', type=float, default=0.0, help="Random extra latency per write, up to this many ms")
+	parser.add_argument('-loss', type=float, default=0.0, help="Probability that a frame is lost (0-1)")
+	parser.add_argument('-seed', type=int, default=1, help="Random seed for jitter and loss, runs are reproducible")
+	parser.add_argument('-rate', type=int, default=100, help="Joystick sample rate in Hz (default 100)")
+	parser.add_argument('-json', help="Save results to a JSON file")
+	parser.add_argument('-baseline', help="Compare with results saved by -json, exit code 1 on regressions")
+	parser.add_argument('-tolerance', type=float, default=0.2, help="Allowed relative slowdown against -baseline (default 0.2)")
+	args = parser.parse_args()
+
+	results = asyncio.run(main(args))
+	if args.json:
+		with open(args.json, 'w') as file:
+			json.dump(results, file, indent=2)
+	if args.baseline:
+		with open(args.baseline) as file:
+			if not compare(results, json.load(file), args.tolerance):
+				sys.exit(1)
+		print("No regressions")
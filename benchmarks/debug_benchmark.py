@@ -0,0 +1,107 @@
+# Control loop latency with debug off, debug printed synchronously (the old behaviour) and debug through the background ring log
+# The terminal is simulated by a writer that blocks for a fixed time per line, like a slow console or SSH session
+# Usage: python -m benchmarks.debug_benchmark [-terminal ms per line] [-rate Hz]
+import argparse
+import asyncio
+import time
+from utils.debug_log import DebugLog, format_line
+from utils.input_shaping import InputShaper
+from utils.latency_stats import LatencyHistogram, STAGE_TOTAL, CATEGORY_DRIVE, CATEGORY_PLAYVM
+from benchmarks.controller_benchmark import load_controller, connect, post_changes, ScriptedJoystick, slalom, lights
+
+DURATION = 2.0
+
+class SlowTerminal:
+	def __init__(self, line_time):
+		self.line_time = line_time
+		self.lines = 0
+
+	def write(self, text):
+		lines = text.count("\n")
+		self.lines += lines
+		time.sleep(self.line_time * lines)
+
+	def flush(self):
+		pass
+
+	def close(self):
+		pass
+
+class PrintLog:
+	# the old 'if debug: print(...)', formatted and written in the control loop
+	def __init__(self, output):
+		self.output = output
+		self.logged = 0
+		self.dropped = 0
+
+	def log(self, format, *args):
+		self.output.write(format_line(format, args) + "\n")
+		self.logged += 1
+
+	def close(self):
+		pass
+
+def slalom_lights(t):
+	# steering and throttle changes every sample plus light toggles, the busiest debug output
+	steering, left, right, buttons = slalom(t)
+	return steering, left, right, lights(t)[3]
+
+async def drive(controller, args, debug, log):
+	await connect(controller, args)
+	controller.debug = debug
+	controller.debug_log = log
+	stop_event = asyncio.Event()
+	task = asyncio.create_task(controller.scheduler.run(stop_event))
+	joystick = ScriptedJoystick()
+	controller.joystick = joystick
+	controller.pygame.event.clear()
+	loop_time = LatencyHistogram()
+	cpu = 0.0
+	updates = 0
+	start = time.monotonic()
+	next_sample = start
+	while next_sample - start < DURATION:
+		post_changes(controller.pygame, joystick, *slalom_lights(next_sample - start))
+		loop_start = time.perf_counter()
+		cpu_start = time.process_time()
+		await controller.handle_controller_events(batch=True, stamp=time.monotonic())
+		cpu += time.process_time() - cpu_start
+		loop_time.record(time.perf_counter() - loop_start)
+		updates += 1
+		next_sample = max(next_sample + 1 / args.rate, time.monotonic())
+		await asyncio.sleep(next_sample - time.monotonic())
+	await controller.scheduler.flush()
+	stop_event.set()
+	await task
+	await controller.dispatcher.stop()
+	log.close()
+	controller.debug = False
+	histograms = [controller.metrics.histograms[key] for key in ((STAGE_TOTAL, CATEGORY_DRIVE), (STAGE_TOTAL, CATEGORY_PLAYVM)) if key in controller.metrics.histograms]
+	p95 = max((histogram.milliseconds(95) for histogram in histograms), default=0.0)
+	return loop_time, cpu / updates * 1000000, p95, log
+
+async def main(args):
+	controller = load_controller()
+	controller.pygame.init()
+	controller.create_drive(InputShaper(controller.powerlimit))
+	line_time = args.terminal / 1000
+	print(f"Simulated hub: write latency {args.latency:.1f}ms, {args.rate}Hz input, terminal {args.terminal:.2f}ms per line, slalom with light toggles for {DURATION:g}s")
+	runs = (
+		("debug off", False, DebugLog(SlowTerminal(line_time))),
+		("debug, print", True, PrintLog(SlowTerminal(line_time))),
+		("debug, ring log", True, DebugLog(SlowTerminal(line_time))),
+		("debug, ring log overloaded", True, DebugLog(SlowTerminal(line_time * 20), capacity=64)),
+	)
+	results = []
+	for name, debug, log in runs:
+		results.append((name,) + await drive(controller, args, debug, log))
+	for name, loop_time, cpu, p95, log in results:
+		print(f"{name:27}: loop p50 {loop_time.milliseconds(50):.2f}ms p95 {loop_time.milliseconds(95):.2f}ms max {loop_time.maximum / 1000:.2f}ms, CPU {cpu:.0f}us/update, input-to-write p95 {p95:.1f}ms, {log.logged} lines logged, {log.dropped} dropped")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Debug logging cost in the control loop against the simulated hub")
+	parser.add_argument('-terminal', type=float, default=0.2, help="Simulated terminal time per printed line in ms (default 0.2)")
+	parser.add_argument('-rate', type=int, default=100, help="Joystick sample rate in Hz (default 100)")
+	args = parser.parse_args()
+	args.latency, args.jitter, args.loss, args.seed = 7.5, 0.0, 0.0, 1
+	asyncio.run(main(args))
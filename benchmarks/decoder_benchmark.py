@@ -0,0 +1,114 @@
+# Frames/sec of the table-driven text formatter and decoder versus the original if/elif process_read_data (printing removed)
+# Usage: python -m benchmarks.decoder_benchmark
+import timeit
+from struct import unpack
+from utils.lwp3_definitions import *
+from utils.lwp3_decoder import decode_frame, decode_frames, format_record, format_frame
+
+FRAMES = [
+	bytes([0x08, 0x00, 0x45, PORT_STEERING_MOTOR, 0x2c, 0x01, 0x00, 0x00]),
+	bytes([0x06, 0x00, 0x45, PORT_TEMPERATURE, 0x16, 0x01]),
+	bytes([0x06, 0x00, 0x45, PORT_VOLTAGE, 0x45, 0x0e]),
+	bytes([0x05, 0x00, 0x82, PORT_PLAYVM, 0x0a]),
+	bytes([0x05, 0x00, 0x05, PORT_OUTPUT_COMMAND, ERROR_INVALID_USE]),
+	bytes([0x0a, 0x00, 0x47, PORT_GYRO, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01]),
+] * 200
+
+# Original implementation from lego-porsche-controller.py, returning the text instead of printing it
+def bytes_to_angle(byte_array):
+	angle = (byte_array[3] << 24) | (byte_array[2] << 16) | (byte_array[1] << 8) | byte_array[0]
+	if angle >= 0x80000000:
+		angle -= 0x100000000
+	return angle
+
+def process_voltage_or_temperature(data):
+	if len(data) != 2:
+		return 0
+	return unpack('<H', data[:2])[0]
+
+def legacy_process_read_data(data):
+	buffer = ""
+	if len(data) >= 5:
+		data_length = data[0]
+		message_type = data[2]
+		if message_type == MESSAGE_TYPE_ERROR:
+			buffer = buffer + "[Error]"
+			commandtype = data[3]
+			errortype = data[4]
+			if commandtype == PORT_OUTPUT_COMMAND:
+				buffer = buffer + " Port Output Command"                
+				if errortype == ERROR_COMMAND_NOT_RECOGNIZED:
+					buffer = buffer + "->Command NOT recognized"
+				elif errortype == ERROR_INVALID_USE:
+					buffer = buffer + "->Invalid use (e.g. parameter error(s))"
+			elif commandtype == PORT_INPUT_COMMAND:
+				buffer = buffer + " Port Input Command" 
+				if errortype == ERROR_COMMAND_NOT_RECOGNIZED:
+					buffer = buffer + "->Command NOT recognized"
+				elif errortype == ERROR_INVALID_USE:
+					buffer = buffer + "->Invalid use (e.g. parameter error(s))"
+			elif commandtype == ERROR_GENERIC:
+				buffer = buffer + " Generic (wrong size??)"
+		elif message_type == MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK:        
+			port = data[3]
+			status = data[4]
+			buffer = buffer + "[Port Output Command Feedback] Port " + str(int(port))
+			if status == 0x0a:
+				buffer = buffer + " OK"
+			else:
+				buffer = buffer + " ??"
+		elif message_type == MESSAGE_TYPE_PORT_VALUE:
+			port = data[3]
+			buffer = buffer + "[Port Value] Port " + str(int(port))
+			if port == PORT_STEERING_MOTOR and len(data) == 8:# For our script, we assume we're getting steering angle here
+				angle = data[4:8]
+				angle = bytes_to_angle(angle)
+				buffer = buffer + " angle: " + str(angle) + "deg"
+			if port == PORT_TEMPERATURE:
+				databytes = data[4:6]
+				value = process_voltage_or_temperature(databytes)/10
+				buffer = buffer + " temperature bytes: " + str(databytes.hex()) + f" [{value:.1f}C]"
+			if port == PORT_VOLTAGE:
+				databytes = data[4:6]
+				value = process_voltage_or_temperature(databytes)/1000
+				buffer = buffer + " voltage bytes: " + str(databytes.hex()) + f" [{value:.3f}V]"
+		elif message_type == 0x47:
+			port = data[3]
+			buffer = buffer + "[Port Input subscribtion changed] Port " + str(int(port))
+	return f"Read data: {data.hex()} {buffer}"
+
+def decode_and_format(data):
+	record = decode_frame(data)
+	return f"Read data: {data.hex()} {format_record(record) if record is not None else ''}"
+
+def format_read_data(data):
+	# the controller's text path
+	return f"Read data: {data.hex()} {format_frame(data)}"
+
+def measure(runs, frames, rounds=100):
+	# the variants take turns, so a slow phase of the machine hits all of them and the ratios stay comparable
+	best = {name: float('inf') for name in runs}
+	for round in range(rounds):
+		for name, run in runs.items():
+			best[name] = min(best[name], timeit.timeit(run, number=5) / 5)
+	rates = {name: frames / seconds for name, seconds in best.items()}
+	for name, rate in rates.items():
+		print(f"{name}: {rate:,.0f} frames/s")
+	return rates
+
+if __name__ == "__main__":
+	for frame in FRAMES[:6]:
+		assert legacy_process_read_data(frame) == decode_and_format(frame) == format_read_data(frame), (legacy_process_read_data(frame), decode_and_format(frame), format_read_data(frame))
+	batch = b"".join(FRAMES)
+	rates = measure({
+		"process_read_data (text)": lambda: [legacy_process_read_data(frame) for frame in FRAMES],
+		"format_frame (text)": lambda: [format_read_data(frame) for frame in FRAMES],
+		"decode_frame + format_record (text)": lambda: [decode_and_format(frame) for frame in FRAMES],
+		"decode_frame (records)": lambda: [decode_frame(frame) for frame in FRAMES],
+		"decode_frames (batch records)": lambda: decode_frames(batch),
+	}, len(FRAMES))
+	legacy = rates["process_read_data (text)"]
+	print(f"Text vs original: {rates['format_frame (text)'] / legacy:.1f}x format_frame, {rates['decode_frame + format_record (text)'] / legacy:.1f}x decode_frame + format_record")
+	single = rates["decode_frame (records)"]
+	batched = rates["decode_frames (batch records)"]
+	print(f"Records vs original: {single / legacy:.1f}x single, {batched / legacy:.1f}x batch, batch {batched / single:.2f}x single frames")
@@ -0,0 +1,76 @@
+# Port capability discovery against the simulated hub: first connect discovers and fills the port cache, later connects load it
+# Reports startup time and requests sent for each case and what the decoder and telemetry get from the discovered formats
+# Usage: python -m benchmarks.discovery_benchmark [-latency ms]
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+from utils.lwp3_definitions import *
+from utils.lwp3_decoder import decode_frame, format_record
+from utils.lwp3_frames import create_command
+from utils.input_shaping import InputShaper
+from benchmarks.controller_benchmark import load_controller, connect
+
+DISCOVERY_REQUESTS = (PORT_INPUT_INFORMATION_REQUEST, PORT_MODE_INFORMATION_REQUEST)
+TILT_VALUE = create_command(MESSAGE_TYPE_PORT_VALUE, PORT_TILT, 0x0A, 0x00, 0xFB, 0xFF, 0x5A, 0x00) # 10, -5, 90
+
+async def startup(controller, args, mode):
+	# initialize_hub plus port capabilities, returns (seconds, discovery requests sent)
+	client = await connect(controller, args)
+	stop_event = asyncio.Event()
+	task = asyncio.create_task(controller.scheduler.run(stop_event))
+	controller.discovery_mode = mode
+	controller.port_capabilities = None
+	start = time.monotonic()
+	with contextlib.redirect_stdout(io.StringIO()):
+		await controller.initialize_hub()
+		await controller.load_port_capabilities()
+	elapsed = time.monotonic() - start
+	await controller.scheduler.flush()
+	stop_event.set()
+	await task
+	await controller.dispatcher.stop()
+	requests = sum(1 for stamp, frame, response in client.writes if frame[2] in DISCOVERY_REQUESTS and not (frame[2] == PORT_INPUT_INFORMATION_REQUEST and frame[4] == PORT_INFORMATION_VALUE))
+	return elapsed, requests
+
+async def main(args):
+	controller = load_controller()
+	controller.create_drive(InputShaper(controller.powerlimit))
+	print(f"Simulated hub: write latency {args.latency:.1f}ms")
+	before = format_record(decode_frame(TILT_VALUE))
+	with tempfile.TemporaryDirectory() as directory:
+		controller.port_cache_path = os.path.join(directory, "ports.json")
+		results = [
+			("discovery off", await startup(controller, args, "off")),
+			("first connect, discovery", await startup(controller, args, "cache")),
+			("later connect, cache", await startup(controller, args, "cache")),
+			("refresh every connect", await startup(controller, args, "refresh")),
+		]
+		cache_size = os.path.getsize(controller.port_cache_path)
+	for name, (elapsed, requests) in results:
+		print(f"{name:25}: startup {elapsed * 1000:6.0f}ms, {requests:3} discovery requests")
+	print(f"Port cache: {cache_size} bytes, {len(controller.port_capabilities.ports)} ports")
+	controller.port_capabilities.print_summary()
+	print(f"Tilt value decoded with built-in formats: {before}")
+	print(f"Tilt value decoded with discovered formats: {format_record(decode_frame(TILT_VALUE))}")
+	try:
+		from utils.telemetry import TELEMETRY_FORMATS, TELEMETRY_PORT_NAMES, telemetry_formats
+	except ImportError:
+		print("numpy not installed, telemetry formats not compared")
+		return
+	ports = list(TELEMETRY_PORT_NAMES.values())
+	discovered = telemetry_formats(controller.port_capabilities, ports)
+	for name, port in TELEMETRY_PORT_NAMES.items():
+		mode, values, dtype = discovered[port]
+		assumed = TELEMETRY_FORMATS[port]
+		print(f"Telemetry {name:11}: assumed {assumed[1]} x {assumed[2].__name__}, hub reports {values} x {dtype.__name__}")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Port capability discovery and port cache against the simulated hub")
+	parser.add_argument('-latency', type=float, default=7.5, help="Simulated write latency in ms (default 7.5)")
+	args = parser.parse_args()
+	args.jitter, args.loss, args.seed = 0.0, 0.0, 1
+	asyncio.run(main(args))
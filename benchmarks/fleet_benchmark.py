@@ -0,0 +1,70 @@
+# Per-car input-to-write latency as cars are added, one joystick driving the group
+# cars are found and connected by connect_fleet on simulated hubs that share one simulated radio: writes to different
+# hubs queue behind each other for the adapter's airtime, so the numbers show how latency grows with the fleet
+# Usage: python -m benchmarks.fleet_benchmark [write latency ms] [max cars] [airtime ms]
+import asyncio
+import contextlib
+import io
+import sys
+import time
+from utils.fleet import connect_fleet
+from utils.latency_stats import STAGE_TOTAL, CATEGORY_DRIVE, CATEGORY_PLAYVM
+from utils.simulated_hub import SimulatedAdapter, SimulatedClient, SimulatedScanner
+from benchmarks.controller_benchmark import ScriptedJoystick, slalom
+
+DURATION = 2.0
+RATE = 100 # joystick samples per second
+SCAN_TIMEOUT = 0.3 # the last scan finds no new hub, keeps the setup short
+
+def car_p95(car):
+	histograms = [car.metrics.histograms[key] for key in ((STAGE_TOTAL, CATEGORY_DRIVE), (STAGE_TOTAL, CATEGORY_PLAYVM)) if key in car.metrics.histograms]
+	return max((histogram.milliseconds(95) for histogram in histograms), default=0.0)
+
+async def run(cars, latency, airtime):
+	adapter = SimulatedAdapter(airtime)
+	hubs = [(f"00:00:00:00:00:{index:02X}", "Technic Move", 0.0) for index in range(cars)]
+	def client_class(target):
+		address = getattr(target, 'address', target)
+		return SimulatedClient(write_latency=latency, seed=int(address[-2:], 16), address=address, adapter=adapter)
+	def scanner_class(detection_callback=None):
+		return SimulatedScanner(detection_callback, hubs, interval=0.01)
+	with contextlib.redirect_stdout(io.StringIO()):
+		fleet = await connect_fleet("Technic Move", scan_timeout=SCAN_TIMEOUT, client_class=client_class, scanner_class=scanner_class)
+	stop_event = asyncio.Event()
+	task = asyncio.create_task(fleet.run(stop_event))
+	with contextlib.redirect_stdout(io.StringIO()):
+		await fleet.initialize()
+	await fleet.schedulers.flush()
+	joystick = ScriptedJoystick()
+	fleet.assign([joystick], group=True)
+
+	interval = 1 / RATE
+	start = time.monotonic()
+	next_sample = start
+	while next_sample - start < DURATION:
+		steering, left, right, buttons = slalom(next_sample - start)
+		joystick.axes[0], joystick.axes[4], joystick.axes[5] = steering, left, right
+		await fleet.handle_input({joystick.get_instance_id(): set()}, time.monotonic())
+		next_sample = max(next_sample + interval, time.monotonic())
+		await asyncio.sleep(next_sample - time.monotonic())
+	await fleet.schedulers.flush()
+	stop_event.set()
+	await task
+	await fleet.disconnect()
+
+	p95 = sorted(car_p95(car) for car in fleet.cars)
+	writes = sum(len(car.client.writes) for car in fleet.cars) / DURATION
+	print(f"{len(fleet.cars):2d} cars: per-car input-to-write p95 median {p95[len(p95) // 2]:.1f}ms, worst {p95[-1]:.1f}ms, {writes:.0f} writes/s in total, radio busy {adapter.writes * airtime / DURATION:.0%}")
+	return p95[-1]
+
+async def main():
+	latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0075
+	max_cars = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+	airtime = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.001
+	print(f"Simulated write latency {latency * 1000:.1f}ms, {airtime * 1000:.1f}ms airtime per write on a shared radio, slalom trace at {RATE}Hz")
+	counts = sorted({1, 2, 4, 8, max_cars})
+	worst = [await run(cars, latency, airtime) for cars in counts]
+	print(f"Worst per-car p95 from 1 to {counts[-1]} cars: {worst[0]:.1f}ms -> {worst[-1]:.1f}ms")
+
+if __name__ == "__main__":
+	asyncio.run(main())
@@ -0,0 +1,36 @@
+# Frames/sec of create_command versus the precomputed frame tables for one drive update (PLAYVM + 2 motor frames)
+# Usage: python -m benchmarks.frame_benchmark
+import timeit
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import *
+
+ITERATIONS = 200000
+
+def drive_update_create_command(steering, power):
+	create_command(PORT_OUTPUT_COMMAND, PORT_PLAYVM, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0x03, 0x00, 0x00, steering&0xFF, PLAYVM_LIGHTS_OFF_OFF, 0x00)
+	create_command(PORT_OUTPUT_COMMAND, PORT_DRIVE_MOTOR_1, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, -power&0xFF)
+	create_command(PORT_OUTPUT_COMMAND, PORT_DRIVE_MOTOR_2, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, power&0xFF)
+
+def drive_update_cached(steering, power):
+	playvm_drive_frame(steering, PLAYVM_LIGHTS_OFF_OFF)
+	drive_motor_frame(PORT_DRIVE_MOTOR_1, -power)
+	drive_motor_frame(PORT_DRIVE_MOTOR_2, power)
+
+def measure(name, function):
+	inputs = [((step * 3) % 176 - 88, (step * 7) % 200 - 100) for step in range(1000)]
+	def run():
+		for steering, power in inputs:
+			function(steering, power)
+	seconds = min(timeit.repeat(run, number=ITERATIONS // len(inputs), repeat=5))
+	frames_per_second = ITERATIONS * 3 / seconds
+	print(f"{name}: {frames_per_second:,.0f} frames/s ({seconds / ITERATIONS * 1e6:.2f}us per drive update)")
+	return frames_per_second
+
+if __name__ == "__main__":
+	# both paths must produce identical frames
+	for steering in range(-100, 101):
+		for lights in PLAYVM_LIGHTS_STATES:
+			assert playvm_drive_frame(steering, lights) == create_command(PORT_OUTPUT_COMMAND, PORT_PLAYVM, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0x03, 0x00, 0x00, steering&0xFF, lights, 0x00)
+	baseline = measure("create_command", drive_update_create_command)
+	cached = measure("frame tables", drive_update_cached)
+	print(f"Speedup: {cached / baseline:.1f}x")
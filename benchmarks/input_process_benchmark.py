@@ -0,0 +1,123 @@
+# Input-to-write jitter with the joystick sampled in the controller's event loop versus in a separate sampling process
+# Synthetic load blocks the controller's loop for a few ms at random intervals, like GC pauses, terminal output or bleak callbacks
+# Latency is measured from the scripted steering change to the PLAYVM write that carries it on the simulated hub
+# Usage: python -m benchmarks.input_process_benchmark [-rate Hz] [-poll Hz] [-load ms] [-latency ms] [-duration s]
+import argparse
+import asyncio
+import random
+import time
+from utils.lwp3_definitions import *
+from utils.input_process import InputProcess
+from utils.input_shaping import InputShaper
+from utils.latency_stats import LatencyHistogram
+from benchmarks.controller_benchmark import load_controller, connect, post_changes, ScriptedJoystick, RELEASED
+
+STEP_PERIOD = 0.0517 # steering flips between +-STEER, not a multiple of any sample interval
+STEER = 50
+START_DELAY = 2.0 # s, the sampling process is spawned and imports pygame before the trace starts
+STEERING_BYTE = 10 # in the PLAYVM frame
+
+def steering_at(t):
+	return STEER if t >= 0 and int(t / STEP_PERIOD) % 2 else -STEER
+
+class StepSource:
+	# scripted joystick for the sampling process, start is a monotonic time, the same clock in both processes
+	def __init__(self, start):
+		self.start = start
+		self.name = "Scripted steering steps"
+
+	def read(self):
+		return 0, steering_at(time.monotonic() - self.start), 0
+
+async def load(stop_event, maximum, seed):
+	# busy loop of up to maximum seconds every 5-30 ms, the event loop can't run meanwhile
+	generator = random.Random(seed)
+	while not stop_event.is_set():
+		await asyncio.sleep(generator.uniform(0.005, 0.03))
+		end = time.perf_counter() + generator.uniform(0.2, 1.0) * maximum
+		while time.perf_counter() < end:
+			pass
+
+async def sample_in_loop(controller, args, start, stop_event):
+	# -input event: pygame events and joystick reads in the controller's loop
+	joystick = ScriptedJoystick()
+	controller.joystick = joystick
+	controller.pygame.event.clear()
+	next_sample = time.monotonic()
+	while not stop_event.is_set():
+		post_changes(controller.pygame, joystick, steering_at(time.monotonic() - start) / 100, RELEASED, RELEASED, ())
+		await controller.handle_controller_events(batch=True, stamp=time.monotonic())
+		next_sample = max(next_sample + 1 / args.rate, time.monotonic())
+		await asyncio.sleep(next_sample - time.monotonic())
+
+def step_latencies(client, start, end):
+	# PLAYVM writes that changed the steering, each against the step time it follows
+	latency = LatencyHistogram()
+	steps = 0
+	last = None
+	for stamp, frame, response in client.writes:
+		if frame[2] != PORT_OUTPUT_COMMAND or frame[3] != PORT_PLAYVM or len(frame) <= STEERING_BYTE:
+			continue
+		steering = frame[STEERING_BYTE]
+		if steering != last and start <= stamp < end:
+			latency.record(stamp - (start + int((stamp - start) / STEP_PERIOD) * STEP_PERIOD))
+			steps += 1
+		last = steering
+	return latency, steps
+
+async def run(controller, args, process, loaded):
+	client = await connect(controller, args)
+	controller.create_drive(InputShaper(controller.powerlimit))
+	stop_event = asyncio.Event()
+	tasks = [asyncio.create_task(controller.scheduler.run(stop_event))]
+	input_stop = asyncio.Event()
+	start = time.monotonic() + START_DELAY
+	sampler = None
+	if process:
+		sampler = InputProcess(args.rate, args.poll, source_class=StepSource, source_args=(start,))
+		if not await sampler.start():
+			return None
+		inputs = asyncio.create_task(sampler.run(controller.handle_remote_input, input_stop, controller.settle_input))
+	else:
+		inputs = asyncio.create_task(sample_in_loop(controller, args, start, input_stop))
+	await asyncio.sleep(start - time.monotonic())
+	if loaded:
+		tasks.append(asyncio.create_task(load(input_stop, args.load / 1000, args.seed)))
+	cpu_start = time.process_time()
+	await asyncio.sleep(args.duration)
+	cpu = time.process_time() - cpu_start
+	input_stop.set()
+	await inputs
+	await controller.scheduler.flush()
+	stop_event.set()
+	await asyncio.gather(*tasks)
+	await controller.dispatcher.stop()
+	if sampler is not None:
+		sampler.close()
+	latency, steps = step_latencies(client, start, start + args.duration)
+	return latency, steps, int(args.duration / STEP_PERIOD), cpu / args.duration
+
+async def main(args):
+	controller = load_controller()
+	controller.pygame.init()
+	print(f"Simulated hub: write latency {args.latency:.1f}ms, joystick sampled at {args.rate}Hz, steering step every {STEP_PERIOD * 1000:.1f}ms for {args.duration:g}s, load: busy loop up to {args.load:g}ms every 5-30ms")
+	results = []
+	for name, process, loaded in (("in-loop sampling", False, False), ("in-loop sampling, loaded", False, True), ("input process", True, False), ("input process, loaded", True, True)):
+		results.append((name, await run(controller, args, process, loaded)))
+	for name, result in results:
+		if result is None:
+			print(f"{name:25}: sampling process failed to start")
+			continue
+		latency, steps, expected, cpu = result
+		print(f"{name:25}: step->write p50 {latency.milliseconds(50):.1f}ms p95 {latency.milliseconds(95):.1f}ms p99 {latency.milliseconds(99):.1f}ms max {latency.maximum / 1000:.1f}ms, jitter p99-p50 {latency.milliseconds(99) - latency.milliseconds(50):.1f}ms, {steps}/{expected} steps, controller CPU {cpu:.0%}")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Joystick sampling in the event loop vs a separate process, under synthetic load")
+	parser.add_argument('-rate', type=int, default=250, help="Joystick sample rate in Hz (default 250)")
+	parser.add_argument('-poll', type=int, default=None, help="Slot poll rate of the controller in Hz with the input process (default 1000)")
+	parser.add_argument('-load', type=float, default=6.0, help="Longest synthetic stall of the controller's loop in ms (default 6)")
+	parser.add_argument('-latency', type=float, default=1.0, help="Simulated write latency in ms, low so the input path dominates (default 1)")
+	parser.add_argument('-duration', type=float, default=10.0, help="Seconds per run (default 10)")
+	args = parser.parse_args()
+	args.jitter, args.loss, args.seed = 0.0, 0.0, 1
+	asyncio.run(main(args))
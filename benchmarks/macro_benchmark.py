@@ -0,0 +1,69 @@
+# Macro playback timing against the simulated hub: absolute deadlines versus sleeping the gap between frames
+# Usage: python -m benchmarks.macro_benchmark [write latency ms] [seconds]
+import asyncio
+import sys
+from utils.lwp3_definitions import *
+from utils.macro_player import compile_macro, MacroPlayer, START_DELAY
+from utils.latency_stats import LatencyHistogram
+from utils.simulated_hub import SimulatedClient
+
+RATES = (10, 50, 100, 200) # ramp steps per second, a steering step changes only the PLAYVM frame
+VIRTUAL_PORT = 0x10
+
+def ramp_script(rate, seconds):
+	return [f"rate {rate}", "power 40", f"ramp steer -80 80 {seconds / 2}", f"ramp steer 80 -80 {seconds / 2}", "power 0"]
+
+class RelativePlayer(MacroPlayer):
+	# the naive way: sleep the gap to the previous frame, every write time and timer overshoot adds up
+	async def play(self, steps, stop_event=None):
+		self.results = []
+		self.lateness = LatencyHistogram()
+		self.write_time = LatencyHistogram()
+		start = self.clock() + START_DELAY
+		await asyncio.sleep(START_DELAY)
+		previous = 0.0
+		for step in steps:
+			if step.time > previous:
+				await asyncio.sleep(step.time - previous)
+			previous = step.time
+			sent = self.clock()
+			ok = await self.write(step.frame, self.response)
+			written = self.clock()
+			lateness = sent - (start + step.time)
+			self.lateness.record(max(0.0, lateness))
+			self.write_time.record(written - sent)
+			self.results.append((step.time, lateness, written - sent, step.label, ok))
+		self.duration = self.clock() - start
+		return self.results
+
+async def run(player_class, rate, seconds, latency):
+	client = SimulatedClient(write_latency=latency, seed=rate)
+	await client.connect()
+
+	async def write(data, response=False):
+		await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=response)
+		return True
+
+	steps = compile_macro(ramp_script(rate, seconds), VIRTUAL_PORT)
+	player = player_class(write)
+	await player.play(steps)
+	hub_rate = len(client.writes) / (client.writes[-1][0] - client.writes[0][0])
+	return player, len(steps) / steps[-1].time, hub_rate
+
+async def main():
+	latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0025
+	seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 4.0
+	print(f"Simulated write latency {latency * 1000:.1f}ms, {seconds:.0f}s steering ramps")
+	failed = False
+	for rate in RATES:
+		for label, player_class in (("deadline", MacroPlayer), ("relative", RelativePlayer)):
+			player, target_rate, hub_rate = await run(player_class, rate, seconds, latency)
+			drift = player.drift() * 1000
+			print(f"{rate:4d} Hz {label:8}: {target_rate:5.0f} frames/s scripted, {hub_rate:5.0f}/s at the hub, lateness p50 {player.lateness.milliseconds(50):6.2f}ms p95 {player.lateness.milliseconds(95):6.2f}ms, drift at the end {drift:+8.2f}ms")
+			# the deadline player may only fall behind when the link can't keep up with the scripted rate
+			if player_class is MacroPlayer and target_rate * latency < 0.8 and drift > 5.0:
+				failed = True
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(asyncio.run(main()))
@@ -0,0 +1,97 @@
+# Background hub monitor against the simulated hub: drive latency with and without sampling, cached reads and automatic power caps
+# Usage: python -m benchmarks.monitor_benchmark [sample interval ms]
+import argparse
+import asyncio
+import contextlib
+import io
+import sys
+import time
+from utils.input_shaping import InputShaper
+from utils.latency_stats import STAGE_TOTAL, CATEGORY_DRIVE, CATEGORY_PLAYVM
+from benchmarks.controller_benchmark import load_controller, connect, post_changes, ScriptedJoystick, slalom
+
+DURATION = 2.0
+RATE = 100
+
+def drive_p95(metrics):
+	histograms = [metrics.histograms[key] for key in ((STAGE_TOTAL, CATEGORY_DRIVE), (STAGE_TOTAL, CATEGORY_PLAYVM)) if key in metrics.histograms]
+	return max((histogram.milliseconds(95) for histogram in histograms), default=0.0)
+
+async def drive(controller, args, interval):
+	# slalom trace with the monitor sampling every interval seconds (None: no monitor)
+	client = await connect(controller, args)
+	controller.monitor = None
+	stop_event = asyncio.Event()
+	tasks = [asyncio.create_task(controller.scheduler.run(stop_event))]
+	if interval is not None:
+		controller.monitor_interval = interval
+		tasks.append(asyncio.create_task(controller.start_monitor().run(stop_event)))
+	joystick = ScriptedJoystick()
+	controller.joystick = joystick
+	controller.pygame.event.clear()
+	start = time.monotonic()
+	next_sample = start
+	while next_sample - start < DURATION:
+		post_changes(controller.pygame, joystick, *slalom(next_sample - start))
+		await controller.handle_controller_events(batch=True, stamp=time.monotonic())
+		next_sample = max(next_sample + 1 / RATE, time.monotonic())
+		await asyncio.sleep(next_sample - time.monotonic())
+	await controller.scheduler.flush()
+	stop_event.set()
+	await asyncio.gather(*tasks)
+	await controller.dispatcher.stop()
+	return client, drive_p95(controller.metrics)
+
+async def wait_cap(controller, cap, timeout=2.0):
+	start = time.monotonic()
+	while controller.monitor.cap != cap and time.monotonic() - start < timeout:
+		await asyncio.sleep(0.005)
+	return time.monotonic() - start if controller.monitor.cap == cap else None
+
+async def main(args):
+	controller = load_controller()
+	controller.pygame.init()
+	controller.create_drive(InputShaper(controller.powerlimit))
+	interval = args.interval / 1000
+	print(f"Simulated hub: write latency {args.latency:.1f}ms, monitor sampling every {args.interval:.0f}ms (default is {controller.monitor_interval:g}s)")
+
+	client, without = await drive(controller, args, None)
+	client, with_monitor = await drive(controller, args, interval)
+	requests = sum(1 for stamp, frame, response in client.writes if frame[2] in (0x01, 0x21))
+	print(f"Drive input-to-write p95: {without:.1f}ms without monitor, {with_monitor:.1f}ms with monitor ({requests} monitor requests during the trace)")
+
+	await connect(controller, args)
+	stop_event = asyncio.Event()
+	tasks = [asyncio.create_task(controller.scheduler.run(stop_event))]
+	controller.monitor_interval = interval
+	with contextlib.redirect_stdout(io.StringIO()):
+		tasks.append(asyncio.create_task(controller.start_monitor().run(stop_event)))
+		await asyncio.sleep(interval * 2)
+		start = time.perf_counter()
+		await controller.get_battery_info()
+		round_trip = time.perf_counter() - start
+		start = time.perf_counter()
+		controller.monitor.print_battery()
+		cached = time.perf_counter() - start
+	print(f"voltage command: {round_trip * 1000:.2f}ms as a request, {cached * 1000:.3f}ms from the cache")
+
+	results = []
+	with contextlib.redirect_stdout(io.StringIO()):
+		for label, voltage, temperature, cap in (("battery sags to 6.8V", 6800, 254, 60), ("battery critical 6.4V", 6400, 254, 30), ("battery recovers 7.4V", 7400, 254, 100), ("hub overheats 65C", 7400, 650, 30), ("hub cools to 40C", 7400, 400, 100)):
+			controller.client.voltage = voltage
+			controller.client.temperature = temperature
+			results.append((label, cap, await wait_cap(controller, cap), controller.monitor.cap))
+	for label, cap, reaction, reached in results:
+		print(f"{label:24}: power cap {cap}% after {reaction * 1000:.0f}ms" if reaction is not None else f"{label:24}: cap {cap}% not reached, got {reached}%")
+	failed = any(reaction is None for label, cap, reaction, reached in results)
+	stop_event.set()
+	await asyncio.gather(*tasks)
+	await controller.dispatcher.stop()
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Hub monitor benchmark against the simulated hub")
+	parser.add_argument('interval', type=float, nargs='?', default=20, help="Monitor sample interval in ms, much faster than the default to stress the link (default 20)")
+	args = parser.parse_args()
+	args.latency, args.jitter, args.loss, args.seed = 7.5, 0.0, 0.0, 1
+	sys.exit(asyncio.run(main(args)))
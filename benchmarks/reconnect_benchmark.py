@@ -0,0 +1,106 @@
+# Recovery time after the Bluetooth link drops mid-drive: short glitch and long outage keep the hub's state, a quick power cycle loses it
+# Usage: python -m benchmarks.reconnect_benchmark [write latency ms]
+import asyncio
+import contextlib
+import functools
+import io
+import sys
+import time
+from utils.lwp3_definitions import *
+from utils.command_scheduler import CommandScheduler
+from utils.connection_supervisor import ConnectionSupervisor, REBOOT_WINDOW
+from utils.response_dispatcher import ResponseDispatcher
+from utils.input_shaping import InputShaper
+from utils.latency_stats import LatencyStats
+from utils.simulated_hub import SimulatedClient, SimulatedScanner
+from benchmarks.controller_benchmark import load_controller, ScriptedJoystick, post_changes, slalom
+
+HUB_ADDRESS = "90:84:2B:00:00:01"
+CONNECT_TIME = 0.3
+DROP_AT = 1.0 # seconds into the trace
+
+# hub state that only a restart clears
+HUB_STATE = ('virtual_ports', 'next_virtual_port', 'port_formats', 'steering_center', 'steering_angle')
+
+class Radio:
+	# when the hub can be reached again after a drop, the hub the last connection talked to and whether it restarts meanwhile
+	available_at = 0.0
+	hub = None
+	restarts = False
+
+def stand_in_client_class(latency):
+	class StandInClient(SimulatedClient):
+		def __init__(self, target, disconnected_callback=None):
+			super().__init__(write_latency=latency, address=getattr(target, 'address', target), disconnected_callback=disconnected_callback)
+
+		async def connect(self, timeout=None):
+			await asyncio.sleep(CONNECT_TIME)
+			if time.monotonic() < Radio.available_at:
+				raise OSError(f"Device with address {self.address} was not found")
+			if Radio.hub is not None and not Radio.restarts:
+				for name in HUB_STATE:
+					setattr(self, name, getattr(Radio.hub, name))
+			Radio.hub = self
+			return await super().connect(timeout)
+	return StandInClient
+
+async def run(controller, latency, outage, restarts=False):
+	Radio.hub = None
+	Radio.restarts = restarts
+	controller.ble_client_class = stand_in_client_class(latency)
+	controller.ble_scanner_class = functools.partial(SimulatedScanner, hubs=((HUB_ADDRESS, DEVICE_NAME, 0.05),))
+	controller.use_device_cache = False
+	controller.stop_event = asyncio.Event()
+	controller.metrics = LatencyStats()
+	controller.supervisor = ConnectionSupervisor(controller.reconnect, controller.restore_connection, controller.connection_lost, retry_delay=0.1)
+	with contextlib.redirect_stdout(io.StringIO()):
+		await controller.connect_to_device(DEVICE_NAME)
+	controller.scheduler = CommandScheduler(controller.write_characteristic, metrics=controller.metrics)
+	controller.dispatcher = ResponseDispatcher(timeout=0.5)
+	controller.dispatcher.subscribe(controller.handle_notification)
+	stop_event = asyncio.Event()
+	tasks = [asyncio.create_task(controller.scheduler.run(stop_event)), asyncio.create_task(controller.supervisor.run(stop_event))]
+	await controller.dispatcher.start(controller.client)
+	with contextlib.redirect_stdout(io.StringIO()):
+		await controller.initialize_hub()
+	joystick = ScriptedJoystick()
+	controller.joystick = joystick
+	controller.pygame.event.clear()
+
+	first_client = controller.client
+	dropped = False
+	start = time.monotonic()
+	next_sample = start
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		while next_sample - start < DROP_AT + outage + 2.0 or not controller.supervisor.is_up():
+			if not dropped and next_sample - start >= DROP_AT:
+				Radio.available_at = time.monotonic() + outage
+				first_client.drop_link()
+				dropped = True
+			post_changes(controller.pygame, joystick, *slalom(next_sample - start))
+			await controller.handle_controller_events(batch=True, stamp=time.monotonic())
+			next_sample = max(next_sample + 0.01, time.monotonic())
+			await asyncio.sleep(next_sample - time.monotonic())
+		await controller.scheduler.flush()
+	stop_event.set()
+	await asyncio.gather(*tasks)
+	controller.supervisor.close()
+	await controller.dispatcher.stop()
+
+	recovery, rebooted = controller.supervisor.recoveries[-1]
+	calibrated = any(frame[11:12] == bytes([PLAYVM_CALIBRATE_STEERING]) for timestamp, frame, response in controller.client.writes if len(frame) >= 12)
+	print(f"{'power cycle' if restarts else 'outage'} {outage:.1f}s: recovered in {recovery:.2f}s ({'full init' if rebooted else 'state restore'}{', recalibrated' if calibrated else ''}), {controller.supervisor.discarded} stale frames discarded, {len(controller.client.writes)} frames written after reconnect")
+
+async def main():
+	latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0075
+	controller = load_controller()
+	controller.pygame.init()
+	controller.create_drive(InputShaper(controller.powerlimit))
+	print(f"Simulated write latency {latency * 1000:.1f}ms, connection setup {CONNECT_TIME * 1000:.0f}ms, link dropped {DROP_AT:.1f}s into a slalom trace")
+	await run(controller, latency, 0.5)
+	await run(controller, latency, 0.5, restarts=True)
+	await run(controller, latency, REBOOT_WINDOW + 1.0)
+
+if __name__ == "__main__":
+	asyncio.run(main())
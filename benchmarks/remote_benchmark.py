@@ -0,0 +1,83 @@
+# Remote control over loopback UDP: packets/sec through the gateway and the latency it adds to the local joystick path
+# Usage: python -m benchmarks.remote_benchmark [write latency ms]
+import argparse
+import asyncio
+import contextlib
+import io
+import sys
+import time
+from utils.input_shaping import InputShaper
+from utils.latency_stats import STAGE_TOTAL, CATEGORY_DRIVE, CATEGORY_PLAYVM
+from utils.remote_gateway import RemoteControlClient
+from benchmarks.controller_benchmark import load_controller, connect, run_trace, slalom
+
+DURATION = 2.0
+PACKET_RATES = (100, 500, 2000, 10000)
+
+def total_p95(metrics):
+	histograms = [metrics.histograms[key] for key in ((STAGE_TOTAL, CATEGORY_DRIVE), (STAGE_TOTAL, CATEGORY_PLAYVM)) if key in metrics.histograms]
+	return max((histogram.milliseconds(95) for histogram in histograms), default=0.0)
+
+async def run_remote(controller, args, rate):
+	await connect(controller, args)
+	stop_event = asyncio.Event()
+	scheduler_task = asyncio.create_task(controller.scheduler.run(stop_event))
+	controller.drive_virtual_port = None
+	with contextlib.redirect_stdout(io.StringIO()):
+		await controller.setup_drive_virtual_port()
+		await controller.scheduler.flush()
+		gateway = await controller.start_gateway("127.0.0.1", 0)
+	controller.joystick = None
+	gateway_task = asyncio.create_task(gateway.run(stop_event))
+	operator = RemoteControlClient()
+	await operator.connect(*gateway.address[:2])
+
+	interval = 1 / rate
+	start = time.monotonic()
+	next_sample = start
+	while next_sample - start < DURATION:
+		steering, left, right, buttons = slalom(next_sample - start)
+		operator.send(int((right - left) * 50), int(steering * 100))
+		next_sample += interval
+		delay = next_sample - time.monotonic()
+		if delay > 0:
+			await asyncio.sleep(delay)
+		elif operator.sent % 50 == 0:
+			await asyncio.sleep(0) # let the gateway and scheduler run when sending faster than the timer
+	# a replayed old packet must be dropped
+	operator.sequence -= 10
+	operator.send(100, 0)
+	await asyncio.sleep(0.1)
+	await controller.scheduler.flush()
+	elapsed = time.monotonic() - start
+	stop_event.set()
+	await asyncio.gather(gateway_task, scheduler_task)
+	gateway.close()
+	operator.close()
+	await controller.dispatcher.stop()
+	return gateway, operator, elapsed
+
+async def main(args):
+	controller = load_controller()
+	controller.pygame.init()
+	controller.create_drive(InputShaper(controller.powerlimit))
+	print(f"Simulated hub: write latency {args.latency:.1f}ms, loopback UDP")
+	local = await run_trace(controller, args, "local joystick slalom", slalom)
+	local_p95 = local['latency_p95_ms']
+	failed = False
+	for rate in PACKET_RATES:
+		gateway, operator, elapsed = await run_remote(controller, args, rate)
+		remote_p95 = total_p95(controller.metrics)
+		print(f"{rate:5d} packets/s: {operator.sent / elapsed:6.0f}/s sent, {gateway.processed / elapsed:5.0f}/s processed, {gateway.coalesced} coalesced, {gateway.out_of_order} out of order, {gateway.stale} stale")
+		print(f"             ack round trip p50 {operator.round_trip.milliseconds(50):.2f}ms p95 {operator.round_trip.milliseconds(95):.2f}ms, gateway receive->queued p95 {gateway.gateway_time.milliseconds(95):.3f}ms, receive->written p95 {remote_p95:.1f}ms (local joystick {local_p95:.1f}ms)")
+		if gateway.out_of_order != 1:
+			print("FAILED: replayed packet was not dropped")
+			failed = True
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Remote control gateway benchmark over loopback")
+	parser.add_argument('latency', type=float, nargs='?', default=7.5, help="Simulated write latency in ms (default 7.5)")
+	args = parser.parse_args()
+	args.jitter, args.loss, args.seed, args.rate = 0.0, 0.0, 1, 100
+	sys.exit(asyncio.run(main(args)))
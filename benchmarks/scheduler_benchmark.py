@@ -0,0 +1,83 @@
+# Compares direct awaited writes with the latest-value-wins CommandScheduler
+# Usage: python -m benchmarks.scheduler_benchmark [write latency ms] [update rate Hz]
+import asyncio
+import sys
+import time
+from utils.lwp3_definitions import *
+from utils.command_scheduler import CommandScheduler
+from utils.simulated_hub import SimulatedClient
+
+DURATION = 2.0
+
+def drive_frames(step):
+	power = (step * 7) % 200 - 100
+	steering = (step * 3) % 176 - 88
+	playvm = bytes([0x0d, MESSAGE_HEADER, PORT_OUTPUT_COMMAND, PORT_PLAYVM, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0x03, 0x00, 0x00, steering & 0xFF, PLAYVM_LIGHTS_OFF_OFF, 0x00])
+	motor1 = bytes([0x08, MESSAGE_HEADER, PORT_OUTPUT_COMMAND, PORT_DRIVE_MOTOR_1, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, -power & 0xFF])
+	motor2 = bytes([0x08, MESSAGE_HEADER, PORT_OUTPUT_COMMAND, PORT_DRIVE_MOTOR_2, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, power & 0xFF])
+	return (playvm, motor1, motor2)
+
+def report(name, client, submitted, updates):
+	ages = sorted((written - submitted[id(frame)]) * 1000 for written, frame, response in client.writes if id(frame) in submitted)
+	if not ages:
+		print(f"{name}: nothing written")
+		return
+	p50 = ages[len(ages) // 2]
+	p99 = ages[min(len(ages) - 1, int(len(ages) * 0.99))]
+	print(f"{name}: {updates} updates, {len(client.writes)} writes, frame age p50 {p50:.1f}ms p99 {p99:.1f}ms max {ages[-1]:.1f}ms")
+
+async def run_direct(latency, rate):
+	client = SimulatedClient(write_latency=latency)
+	submitted = {}
+	queue = asyncio.Queue()
+
+	async def writer():
+		while True:
+			frame = await queue.get()
+			if frame is None:
+				return
+			await client.write_gatt_char(CHARACTERISTIC_UUID, frame, response=True)
+
+	task = asyncio.create_task(writer())
+	updates = await produce(rate, lambda frame: (submitted.__setitem__(id(frame), time.monotonic()), queue.put_nowait(frame)))
+	queue.put_nowait(None)
+	await task
+	report("direct", client, submitted, updates)
+
+async def run_scheduler(latency, rate):
+	client = SimulatedClient(write_latency=latency)
+	submitted = {}
+
+	async def write(data, response):
+		await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=response)
+		return True
+
+	scheduler = CommandScheduler(write)
+	stop_event = asyncio.Event()
+	task = asyncio.create_task(scheduler.run(stop_event))
+	updates = await produce(rate, lambda frame: (submitted.__setitem__(id(frame), time.monotonic()), scheduler.submit(frame)))
+	await scheduler.flush()
+	stop_event.set()
+	await task
+	report("scheduler", client, submitted, updates)
+	scheduler.print_stats()
+
+async def produce(rate, submit):
+	start = time.monotonic()
+	step = 0
+	while time.monotonic() - start < DURATION:
+		for frame in drive_frames(step):
+			submit(frame)
+		step += 1
+		await asyncio.sleep(1 / rate)
+	return step
+
+async def main():
+	latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.015
+	rate = float(sys.argv[2]) if len(sys.argv) > 2 else 100
+	print(f"Simulated write latency {latency * 1000:.1f}ms, {rate:.0f} updates/s for {DURATION:.0f}s")
+	await run_direct(latency, rate)
+	await run_scheduler(latency, rate)
+
+if __name__ == "__main__":
+	asyncio.run(main())
@@ -0,0 +1,115 @@
+# Batched vehicle simulator: checks that its commands match what the controller's process_controller_input sends for the same
+# joystick traces and shaper configurations, then measures how many simulated seconds one wall-clock second covers
+# Usage: python -m benchmarks.simulator_benchmark [-traces n] [-duration s] [-seed n]
+import argparse
+import asyncio
+import time
+import types
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import playvm_drive_frame, drive_motor_frame, PLAYVM_LIGHTS_STATES
+from utils.input_shaping import InputShaper
+from utils.simulated_hub import SimulatedClient
+from utils.vehicle_simulator import DEFAULT_CONFIG, random_traces, simulate, rank
+from benchmarks.controller_benchmark import load_controller, post_changes, ScriptedJoystick
+
+INPUT_RATE = 100 # Hz
+BRAKE = 0x7F
+CHECK_CONFIGS = (
+	{},
+	{'power_slew': 300, 'steering_slew': 400},
+	{'powerlimit': 40, 'power_deadzone': 25, 'power_curve': 2.0},
+	{'steering_curve': 1.5, 'steering_scale': True, 'steering_limit': 94, 'power_slew': 150},
+)
+BATCHES = ((10, 1), (100, 10), (1000, 10), (1000, 48))
+
+# frame -> sent value, for reading the controller's output back
+PLAYVM_STEERING = {playvm_drive_frame(steering, lights): steering for lights in PLAYVM_LIGHTS_STATES for steering in range(-100, 101)}
+DRIVE_POWER = {drive_motor_frame(PORT_DRIVE_MOTOR_2, power & 0xFF): power for power in range(-100, 101)}
+DRIVE_POWER[drive_motor_frame(PORT_DRIVE_MOTOR_2, BRAKE)] = BRAKE
+
+async def reference(controller, traces, config):
+	# every trace through process_controller_input on a simulated clock, (sample, power or BRAKE, steering) of each send
+	clock = types.SimpleNamespace(now=0.0)
+	controller.time = types.SimpleNamespace(monotonic=lambda: clock.now)
+	frames = []
+	async def capture(data, lane=None, stamp=None):
+		frames.append(bytes(data))
+	controller.queue_command = capture
+	runs = []
+	for trace in range(len(traces['steering'])):
+		controller.create_drive(InputShaper(**{**DEFAULT_CONFIG, **config})) # fresh drive state for every trace
+		joystick = ScriptedJoystick()
+		controller.joystick = joystick
+		controller.pygame.event.clear()
+		sends = []
+		for sample in range(len(traces['steering'][trace])):
+			clock.now = sample / INPUT_RATE
+			buttons = (5,) if traces['brake'][trace, sample] else ()
+			post_changes(controller.pygame, joystick, float(traces['steering'][trace, sample]), float(traces['left'][trace, sample]), float(traces['right'][trace, sample]), buttons)
+			del frames[:]
+			await controller.handle_controller_events(batch=True, stamp=clock.now)
+			steering = [PLAYVM_STEERING[frame] for frame in frames if frame in PLAYVM_STEERING]
+			power = [DRIVE_POWER[frame] for frame in frames if frame in DRIVE_POWER]
+			if steering:
+				sends.append((sample, power[-1], steering[-1]))
+		runs.append(sends)
+	return runs
+
+def batched(result, trace, config):
+	# the simulator's sends in the same form
+	sends = []
+	for sample in result['sent'][:, trace, config].nonzero()[0]:
+		power = BRAKE if result['brake'][sample, trace, config] else int(result['power'][sample, trace, config])
+		sends.append((int(sample), power, int(result['steering'][sample, trace, config])))
+	return sends
+
+async def check(args):
+	controller = load_controller()
+	controller.pygame.init()
+	controller.client = SimulatedClient(write_latency=0)
+	controller.metrics = None
+	traces = random_traces(args.check_traces, args.check_duration, INPUT_RATE, args.seed)
+	start = time.perf_counter()
+	result = simulate(traces, CHECK_CONFIGS, INPUT_RATE, record=True)
+	simulated = time.perf_counter() - start
+	mismatches = 0
+	sends = 0
+	start = time.perf_counter()
+	for config_index, config in enumerate(CHECK_CONFIGS):
+		runs = await reference(controller, traces, config)
+		for trace, expected in enumerate(runs):
+			sends += len(expected)
+			if batched(result, trace, config_index) != expected:
+				mismatches += 1
+				if mismatches <= 3:
+					print(f"Mismatch: trace {trace}, config {config}")
+	controller_time = time.perf_counter() - start
+	runs = len(CHECK_CONFIGS) * args.check_traces
+	seconds = runs * args.check_duration
+	print(f"Command check: {runs - mismatches}/{runs} runs identical to process_controller_input ({sends} sends), controller {seconds / controller_time:.0f} simulated s/s, batch {seconds / simulated:.0f} simulated s/s")
+	return mismatches == 0
+
+def throughput(args):
+	for traces_count, configs_count in BATCHES:
+		traces = random_traces(traces_count, args.duration, INPUT_RATE, args.seed)
+		configs = [{'power_slew': 100 * (index % 8), 'power_deadzone': 10 + 5 * (index // 8 % 6)} for index in range(configs_count)]
+		start = time.perf_counter()
+		result = simulate(traces, configs, INPUT_RATE)
+		elapsed = time.perf_counter() - start
+		runs = traces_count * configs_count
+		best_score, best = rank(configs, result)[0]
+		print(f"{traces_count:5} traces x {configs_count:3} configs of {args.duration:g}s: {elapsed:6.2f}s, {runs * args.duration / elapsed:8.0f}x real time, {elapsed / (runs * args.duration * INPUT_RATE) * 1e9:5.0f}ns per sample, best score {best_score:.1f}")
+
+def main(args):
+	ok = asyncio.run(check(args))
+	throughput(args)
+	return ok
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Batched vehicle simulator against the controller's command generation")
+	parser.add_argument('-traces', dest='check_traces', type=int, default=20, help="Traces per configuration in the command check (default 20)")
+	parser.add_argument('-duration', type=float, default=10.0, help="Trace length in s for the throughput runs (default 10)")
+	parser.add_argument('-seed', type=int, default=1, help="Random seed for the traces")
+	args = parser.parse_args()
+	args.check_duration = 5.0
+	raise SystemExit(0 if main(args) else 1)
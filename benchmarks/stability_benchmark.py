@@ -0,0 +1,123 @@
+# Traction and stability control against the simulated vehicle on a slippery floor: launch, direction change and a powered slalom
+# Reports time with spinning wheels, oversteer (spinning driven wheels in a corner) and understeer (yaw rate well below what
+# the steering asks for), distance covered and the control loop's compute time and deadline misses, also with synthetic
+# loop stalls that push it into pass-through
+# Usage: python -m benchmarks.stability_benchmark [-grip g] [-rate Hz] [-load ms] [-latency ms]
+import argparse
+import asyncio
+import contextlib
+import io
+import math
+import time
+from utils.simulated_hub import SIMULATED_CURVATURE, SIMULATED_SAMPLE_INTERVAL, SIMULATED_SPIN_SLIP
+from utils.input_shaping import InputShaper
+from benchmarks.controller_benchmark import load_controller, connect, post_changes, ScriptedJoystick, RELEASED
+from benchmarks.input_process_benchmark import load
+
+TRACE_DURATION = 5.0
+INPUT_RATE = 100 # Hz
+SLIP = 0.2 # slip ratio counted as wheel spin
+UNDERSTEER_MARGIN = 20.0 # deg/s of yaw below the requested rate counted as understeer
+
+def drive_trace(t):
+	# full throttle launch, full reverse while still rolling, coast, then a slalom stabbing the throttle in every corner
+	if t < 1.0:
+		return (0.0, RELEASED, 1.0, ())
+	if t < 2.0:
+		return (0.0, 1.0, RELEASED, ())
+	if t < 2.5:
+		return (0.0, RELEASED, RELEASED, ())
+	return (math.sin(2 * math.pi * 0.75 * (t - 2.5)), RELEASED, 1.0 if int((t - 2.5) / 0.33) % 2 else RELEASED, ())
+
+async def observe(controller, client, samples, stop_event):
+	# vehicle state next to the driver's shaped steering, every sensor sample
+	while not stop_event.is_set():
+		await asyncio.sleep(SIMULATED_SAMPLE_INTERVAL)
+		samples.append((client.slip(), client.yaw_rate, client.vehicle_speed, controller.drive.last_steering_input))
+
+async def run(controller, args, stability, loaded):
+	client = await connect(controller, args)
+	client.grip = args.grip
+	controller.stability = None
+	stop_event = asyncio.Event()
+	tasks = [asyncio.create_task(controller.scheduler.run(stop_event))]
+	controller.drive_virtual_port = None
+	with contextlib.redirect_stdout(io.StringIO()):
+		await controller.setup_drive_virtual_port()
+		if stability:
+			controller.stability_rate = args.rate
+			await controller.start_stability_control()
+	if stability and controller.stability is None:
+		return None
+	if client.motion_task is None:
+		client.motion_task = asyncio.create_task(client.simulate_motion()) # the vehicle moves without IMU subscribers too
+	controller.drive.resend()
+	joystick = ScriptedJoystick()
+	controller.joystick = joystick
+	controller.pygame.event.clear()
+	await asyncio.sleep(0.1) # first IMU samples
+	trace_stop = asyncio.Event()
+	samples = []
+	tasks.append(asyncio.create_task(observe(controller, client, samples, trace_stop)))
+	if stability:
+		tasks.append(asyncio.create_task(controller.stability.run(trace_stop)))
+	if loaded:
+		tasks.append(asyncio.create_task(load(trace_stop, args.load / 1000, args.seed)))
+	start = time.monotonic()
+	next_sample = start
+	while next_sample - start < TRACE_DURATION:
+		post_changes(controller.pygame, joystick, *drive_trace(next_sample - start))
+		await controller.handle_controller_events(batch=True, stamp=time.monotonic())
+		next_sample = max(next_sample + 1 / INPUT_RATE, time.monotonic())
+		await asyncio.sleep(next_sample - time.monotonic())
+	trace_stop.set()
+	await asyncio.gather(*tasks[1:])
+	await controller.scheduler.flush()
+	stop_event.set()
+	await tasks[0]
+	await client.disconnect()
+	await controller.dispatcher.stop()
+	spinning = sum(1 for slip, yaw, speed, steering in samples if abs(slip) > SLIP) * SIMULATED_SAMPLE_INTERVAL
+	oversteer = sum(1 for slip, yaw, speed, steering in samples if abs(slip) > SIMULATED_SPIN_SLIP and steering) * SIMULATED_SAMPLE_INTERVAL
+	understeer = sum(1 for slip, yaw, speed, steering in samples if abs(yaw) < abs(math.degrees(speed * steering / 100 * SIMULATED_CURVATURE)) - UNDERSTEER_MARGIN) * SIMULATED_SAMPLE_INTERVAL
+	distance = sum(abs(speed) for slip, yaw, speed, steering in samples) * SIMULATED_SAMPLE_INTERVAL
+	peak = max(abs(slip) for slip, yaw, speed, steering in samples)
+	return spinning, peak, oversteer, understeer, distance, controller.stability
+
+async def main(args):
+	controller = load_controller()
+	controller.pygame.init()
+	controller.create_drive(InputShaper(controller.powerlimit))
+	print(f"Simulated vehicle: grip {args.grip:g} g, write latency {args.latency:.1f}ms, {TRACE_DURATION:g}s launch/reverse/slalom trace, control loop at {args.rate} Hz, load: busy loop up to {args.load:g}ms / {args.load * 4:g}ms every 5-30ms")
+	runs = (
+		("stability off", False, None),
+		("stability on", True, None),
+		(f"on, {args.load:g}ms stalls", True, args.load),
+		(f"on, {args.load * 4:g}ms stalls", True, args.load * 4),
+	)
+	results = []
+	for name, stability, stall in runs:
+		if stall is not None:
+			args.load, load_ms = stall, args.load
+		results.append((name, await run(controller, args, stability, stall is not None)))
+		if stall is not None:
+			args.load = load_ms
+	for name, result in results:
+		if result is None:
+			print(f"{name:20}: gyro or accelerometer not available")
+			continue
+		spinning, peak, oversteer, understeer, distance, stability = result
+		line = f"{name:20}: wheel spin {spinning:.2f}s (peak slip {peak:.2f}), oversteer {oversteer:.2f}s, understeer {understeer:.2f}s, distance {distance:.2f}m"
+		if stability is not None:
+			line += f", compute p50 {stability.compute.percentile(50) * 1000000:.0f}us p95 {stability.compute.percentile(95) * 1000000:.0f}us max {stability.compute.maximum}us, lateness p99 {stability.lateness.milliseconds(99):.1f}ms, {stability.missed}/{stability.iterations} deadlines missed, pass-through {stability.pass_through_iterations / max(1, stability.iterations):.0%}"
+		print(line)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Traction and stability control against the simulated vehicle")
+	parser.add_argument('-grip', type=float, default=0.5, help="Tyre grip in g, the drivetrain can give 1.2 g (default 0.5)")
+	parser.add_argument('-rate', type=int, default=100, help="Control rate in Hz, at least 100 (default 100)")
+	parser.add_argument('-load', type=float, default=4.0, help="Longest synthetic stall of the event loop in ms, the last run uses four times this (default 4)")
+	parser.add_argument('-latency', type=float, default=7.5, help="Simulated write latency in ms (default 7.5)")
+	args = parser.parse_args()
+	args.jitter, args.loss, args.seed = 0.0, 0.0, 1
+	asyncio.run(main(args))
@@ -0,0 +1,56 @@
+# Startup time of the offline protocol tools versus the full controller import (pygame and bleak)
+# Usage: python -m benchmarks.startup_benchmark [runs]
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTROLLER = os.path.join(ROOT, "lego-porsche-controller.py")
+
+FULL_IMPORT = (
+	"import importlib.util, sys;"
+	f"spec = importlib.util.spec_from_file_location('controller', {CONTROLLER!r});"
+	"controller = importlib.util.module_from_spec(spec); spec.loader.exec_module(controller);"
+	"controller.load_pygame(); controller.load_bleak()"
+)
+TOOL_MODULES = (
+	"import runpy, sys;"
+	f"sys.argv = [{CONTROLLER!r}, 'tool', 'angletobytes', '90'];"
+	"exec(\"try:\\n\\trunpy.run_path(sys.argv[0], run_name='__main__')\\nexcept SystemExit:\\n\\tpass\");"
+	"print('heavy modules loaded:', [name for name in ('pygame', 'bleak') if name in sys.modules])"
+)
+
+CASES = (
+	("tool angletobytes 90", [sys.executable, CONTROLLER, "tool", "angletobytes", "90"]),
+	("python -m utils.protocol_tools", [sys.executable, "-m", "utils.protocol_tools", "decode", "050082360a"]),
+	("-h", [sys.executable, CONTROLLER, "-h"]),
+	("full import (pygame, bleak)", [sys.executable, "-c", FULL_IMPORT]),
+)
+
+def time_command(command, runs):
+	times = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+		times.append(time.perf_counter() - start)
+		if result.returncode != 0:
+			return None, result.stderr.strip().splitlines()[-1:] or ["failed"]
+	return times, None
+
+def main():
+	runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	print(f"Startup time, median of {runs} runs")
+	for label, command in CASES:
+		times, error = time_command(command, runs)
+		if times is None:
+			print(f"  {label:32} failed: {error[0]}")
+			continue
+		print(f"  {label:32} {statistics.median(times) * 1000:7.1f} ms (min {min(times) * 1000:.1f} ms)")
+	check = subprocess.run([sys.executable, "-c", TOOL_MODULES], cwd=ROOT, capture_output=True, text=True)
+	print(f"Tool mode {check.stdout.strip().splitlines()[-1] if check.stdout.strip() else check.stderr.strip()}")
+	return 0 if "heavy modules loaded: []" in check.stdout else 1
+
+if __name__ == "__main__":
+	sys.exit(main())
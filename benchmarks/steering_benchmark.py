@@ -0,0 +1,100 @@
+# Closed-loop steering step responses on the simulated steering motor: settling time, overshoot and time stalled at the end stops
+# Usage: python -m benchmarks.steering_benchmark [write latency ms]
+import asyncio
+import sys
+import time
+from utils.lwp3_definitions import *
+from utils.command_scheduler import CommandScheduler, LANE_DRIVE
+from utils.response_dispatcher import ResponseDispatcher
+from utils.simulated_hub import SimulatedClient
+from utils.steering_control import SteeringController, END_STOP_MARGIN
+
+STEERING_CENTER = 9 # encoder zero is not straight ahead
+STEERING_RANGE = 68 # narrower than the 88% clamp assumes
+ASSUMED_RANGE = 88 # fixed stops for the variants that don't sweep
+STEPS = (60, -60, 20, -100, 100, 0, 100, -30) # target percentages
+HOLD = 0.6 # seconds per step
+SETTLE_BAND = 2 # degrees
+
+VARIANTS = (
+	# name, controller options, sweep for the end stops
+	("P only, fixed stops", {'kd': 0.0, 'learn_stops': False}, False),
+	("PD, fixed stops", {'learn_stops': False}, False),
+	("PD, stall learning", {}, False),
+	("PD, swept stops", {}, True),
+)
+
+async def run(name, options, sweep, latency):
+	client = SimulatedClient(write_latency=latency, steering_center=STEERING_CENTER, steering_range=STEERING_RANGE)
+	dispatcher = ResponseDispatcher()
+	await dispatcher.start(client)
+	scheduler = CommandScheduler(lambda data, response: write(client, data, response))
+	stop_event = asyncio.Event()
+	scheduler_task = asyncio.create_task(scheduler.run(stop_event))
+	steering = SteeringController(lambda frame: scheduler.submit(frame, LANE_DRIVE), **options)
+	steering.attach(dispatcher)
+	angles = [] # (time, angle) as the hub reports them
+	dispatcher.subscribe(lambda data: angles.append((time.monotonic(), steering.angle)) if data[3] == PORT_STEERING_MOTOR else None, (MESSAGE_TYPE_PORT_VALUE,))
+	await write_setup(scheduler, dispatcher, steering)
+	control_task = asyncio.create_task(steering.run(stop_event))
+	sweep_stall = 0.0
+	if sweep:
+		sweep_start = time.monotonic()
+		await steering.calibrate()
+		sweep_time = time.monotonic() - sweep_start
+		sweep_stall = client.steering_stall_time
+	else:
+		steering.left_stop = STEERING_CENTER - ASSUMED_RANGE - END_STOP_MARGIN
+		steering.right_stop = STEERING_CENTER + ASSUMED_RANGE + END_STOP_MARGIN
+	await asyncio.sleep(0.3)
+	stall_before = client.steering_stall_time
+
+	settle_times = []
+	overshoots = []
+	for percent in STEPS:
+		start_angle = client.steering_angle
+		start = time.monotonic()
+		steering.set_target(percent)
+		await asyncio.sleep(HOLD)
+		target = steering.target_angle()
+		reachable = max(STEERING_CENTER - STEERING_RANGE, min(STEERING_CENTER + STEERING_RANGE, target))
+		window = [(stamp, angle) for stamp, angle in angles if stamp >= start]
+		settled = start
+		for stamp, angle in window:
+			if abs(angle - reachable) > SETTLE_BAND:
+				settled = stamp
+		settle_times.append(settled - start)
+		direction = 1 if reachable >= start_angle else -1
+		overshoots.append(max([0.0] + [(angle - reachable) * direction for stamp, angle in window]))
+	stall = client.steering_stall_time - stall_before
+
+	stop_event.set()
+	await asyncio.gather(control_task, scheduler_task)
+	await dispatcher.stop()
+	stops = f"{steering.left_stop}..{steering.right_stop}"
+	sweep = f", sweep {sweep_time * 1000:.0f}ms with {sweep_stall * 1000:.0f}ms at the stops" if sweep else ""
+	print(f"{name:22}: settle mean {sum(settle_times) / len(settle_times) * 1000:4.0f}ms max {max(settle_times) * 1000:4.0f}ms, overshoot max {max(overshoots):4.1f}deg, stalled {stall * 1000:5.0f}ms, stops {stops} (real {STEERING_CENTER - STEERING_RANGE}..{STEERING_CENTER + STEERING_RANGE}){sweep}")
+	return stall
+
+async def write(client, data, response):
+	try:
+		await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=response)
+	except Exception:
+		return False
+	return True
+
+async def write_setup(scheduler, dispatcher, steering):
+	async def queue(frame):
+		scheduler.submit(frame)
+	return await dispatcher.request(queue, steering.setup_frame(), (MESSAGE_TYPE_PORT_INPUT_FORMAT, PORT_STEERING_MOTOR))
+
+async def main():
+	latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0075
+	print(f"Simulated steering motor: end stops {STEERING_CENTER - STEERING_RANGE}..{STEERING_CENTER + STEERING_RANGE} deg, write latency {latency * 1000:.1f}ms, {len(STEPS)} steps of {HOLD}s")
+	results = {}
+	for name, options, sweep in VARIANTS:
+		results[name] = await run(name, options, sweep, latency)
+	return 0 if results["PD, swept stops"] < 0.1 else 1
+
+if __name__ == "__main__":
+	sys.exit(asyncio.run(main()))
@@ -0,0 +1,61 @@
+# Writes per control update and skew between the two drive motors, virtual port versus separate motor frames
+# Usage: python -m benchmarks.virtual_port_benchmark [write latency ms]
+import asyncio
+import sys
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import *
+from utils.command_scheduler import CommandScheduler
+from utils.response_dispatcher import ResponseDispatcher
+from utils.simulated_hub import SimulatedClient
+from utils.virtual_port import connect_virtual_port
+
+UPDATES = 100
+
+async def run(name, latency, virtual_ports, start_power2=True):
+	client = SimulatedClient(write_latency=latency, virtual_ports=virtual_ports, start_power2=start_power2)
+	dispatcher = ResponseDispatcher(timeout=0.5)
+	await dispatcher.start(client)
+
+	async def write(data, response=True):
+		await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=response)
+		return True
+
+	scheduler = CommandScheduler(write)
+	stop_event = asyncio.Event()
+	task = asyncio.create_task(scheduler.run(stop_event))
+	virtual_port = await connect_virtual_port(dispatcher, scheduler_write(scheduler), PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2)
+	if virtual_port is not None:
+		scheduler.add_motor_port(virtual_port)
+	await scheduler.flush()
+	writes_before = len(client.writes)
+
+	for step in range(UPDATES):
+		power = (step * 7) % 200 - 100
+		scheduler.submit(playvm_drive_frame((step * 3) % 176 - 88, PLAYVM_LIGHTS_OFF_OFF))
+		if virtual_port is not None:
+			scheduler.submit(combined_motor_frame(virtual_port, -power & 0xFF, power & 0xFF))
+		else:
+			scheduler.submit(drive_motor_frame(PORT_DRIVE_MOTOR_1, -power))
+			scheduler.submit(drive_motor_frame(PORT_DRIVE_MOTOR_2, power))
+		await scheduler.flush() # one update at a time, so nothing is coalesced
+	stop_event.set()
+	await task
+
+	skew = sorted(client.motor_skew())
+	writes = len(client.writes) - writes_before
+	print(f"{name}: virtual port {virtual_port}, {writes / UPDATES:.1f} writes per update, motor skew p50 {skew[len(skew) // 2] * 1000:.2f}ms max {skew[-1] * 1000:.2f}ms")
+
+def scheduler_write(scheduler):
+	async def submit(frame):
+		scheduler.submit(frame)
+	return submit
+
+async def main():
+	latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0075
+	print(f"Simulated write latency {latency * 1000:.1f}ms, {UPDATES} control updates")
+	await run("virtual port", latency, True)
+	await run("hub rejects virtual port", latency, False)
+	await run("hub rejects StartPower2", latency, True, False)
+
+if __name__ == "__main__":
+	asyncio.run(main())
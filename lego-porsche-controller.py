@@ -1,118 +1,338 @@
+import sys
+
+if __name__ == "__main__" and sys.argv[1:2] == ["tool"]:
+	# offline protocol utilities, dispatched before asyncio, pygame and bleak are imported
+	from utils.protocol_tools import main as tool_main
+	sys.exit(tool_main(sys.argv[2:]))
+
 import asyncio
+import json
 import os
+import time
 import argparse
+from functools import partial
 from utils.lwp3_definitions import *
-from bleak import BleakClient, BleakScanner
+from utils.lwp3_frames import *
+from utils.command_scheduler import CommandScheduler, LANE_DRIVE
+from utils.response_dispatcher import ResponseDispatcher, LWP3Error
+from utils.virtual_port import connect_virtual_port, virtual_port_accepts
+from utils.session_recorder import SessionRecorder
+from utils.lwp3_decoder import format_frame, set_port_value_format
+from utils.input_shaping import InputShaper
+from utils.drive_control import DriveControl, AXIS_STEERING, AXIS_LEFT_TRIGGER, AXIS_RIGHT_TRIGGER, BUTTON_CABIN_LIGHTS, BUTTON_LIGHTS, BUTTON_BRAKE
+from utils.latency_stats import LatencyStats
+from utils.fleet import connect_fleet
+from utils.device_discovery import connect_hub, DeviceCache
+from utils.connection_supervisor import ConnectionSupervisor, RESTART_CHECK_TIMEOUT
+from utils.macro_player import load_macro, played_lights, MacroPlayer
+from utils.remote_gateway import RemoteControlGateway, DEFAULT_PORT
+from utils.steering_control import SteeringController
+from utils.hub_monitor import HubMonitor, MONITOR_INTERVAL, LOW_VOLTAGE, HOT_TEMPERATURE
+from utils.debug_log import DebugLog
+from utils.port_discovery import PortCache, discover_ports, decoder_formats, PORT_CACHE_PATH
+from utils.input_process import InputProcess
+from utils.protocol_tools import run_tool_command, TOOL_COMMANDS
 from struct import unpack
 
-# Hide Pygame support prompt
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
-import pygame
+# pygame and bleak are imported only when the controller runs, tool commands and -h never load them
+pygame = None
+JOYSTICK_EVENTS = ()
+
+def load_pygame():
+	global pygame, JOYSTICK_EVENTS
+	if pygame is None:
+		# Hide Pygame support prompt
+		os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+		import pygame as pygame_module
+		JOYSTICK_EVENTS = (pygame_module.JOYAXISMOTION, pygame_module.JOYBUTTONDOWN, pygame_module.JOYBUTTONUP)
+		pygame = pygame_module
+	return pygame
+
+def load_bleak():
+	global ble_client_class, ble_scanner_class
+	if ble_client_class is None:
+		from bleak import BleakClient, BleakScanner
+		ble_client_class = BleakClient
+		ble_scanner_class = BleakScanner
 
 # Globals
 client = None
+scheduler = None
+dispatcher = None
 debug = False
+debug_log = DebugLog() # debug lines are queued here and written by a background thread
 joystick = None
-last_power_input = 0
-last_steering_input = 0
 stop_event = asyncio.Event()
 powerlimit = 100
-brakeapplied = False
-lightsplayvmstate = PLAYVM_LIGHTS_OFF_OFF
-last_lights_input = False
-cabinlights = False
-last_cabin_lights_input = False
-
-def create_command(*args):
-	command = bytes([len(args) + 2] + [MESSAGE_HEADER] + list(args))
-	return command
-
-def normalize_angle(angle):
-	if angle >= 180:
-		return angle - (360 * ((angle + 180) // 360))
-	elif angle < -180:
-		return angle + (360 * ((180 - angle) // 360))
-	return angle
-
-def angle_to_bytes(angle):
-	a0 = angle & 0xff
-	a1 = (angle >> 8) & 0xff
-	a2 = (angle >> 16) & 0xff
-	a3 = (angle >> 24) & 0xff
-	return bytes([a0, a1, a2, a3])
-
-def bytes_to_angle(byte_array):
-	if len(byte_array) != 4:
-		raise ValueError("Byte array must be exactly 4 bytes long.")
-	angle = (byte_array[3] << 24) | (byte_array[2] << 16) | (byte_array[1] << 8) | byte_array[0]
-	
-	# Handle negative values (32-bit signed integer)
-	if angle >= 0x80000000:
-		angle -= 0x100000000	
-	return angle
-
-def is_integer(s):
-	if s[0] == '-':
-		return s[1:].isdigit()
-	return s.isdigit()
-
-async def set_drive_motor_power(channel, power_byte):
-	command = create_command(PORT_OUTPUT_COMMAND, channel, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, power_byte)
-	await write_characteristic(command)
+input_mode = "poll"
+input_rate = 250
+input_process = None # InputProcess with -input process
+launch_time = time.monotonic()
+startup_phases = []
+drive_mode = "virtual"
+drive_virtual_port = None
+drive_power_bytes = (0x00, 0x00) # last drive power sent, re-sent when the virtual port has to be checked
+drive_port_check = None # task checking the virtual port after a port output command error
+telemetry = None
+recorder = None
+drive = None # DriveControl: the car's input shaping, brake and lights state
+record_path = None
+telemetry_ports = ""
+telemetry_delta = 1
+metrics = None
+stats_path = None
+fleet_mode = False
+device_address = None
+use_device_cache = True
+supervisor = None
+auto_reconnect = True
+ble_client_class = None # BleakClient after load_bleak(), replaced by stand-ins in benchmarks
+ble_scanner_class = None
+fleet_group = False
+shaper_options = {}
+macro_path = None
+macro_report_path = None
+macro_player = None
+macro_task = None
+remote_address = None # (host, port) for -remote
+gateway = None
+last_battery_level = None
+steering_mode = "playvm"
+steering = None # SteeringController with -steering closed
+monitor = None
+monitor_interval = MONITOR_INTERVAL
+low_voltage = LOW_VOLTAGE
+hot_temperature = HOT_TEMPERATURE
+hub_firmware = None
+hub_hardware = None
+discovery_mode = "cache"
+port_cache_path = PORT_CACHE_PATH
+port_capabilities = None # PortCapabilities from discovery or the port cache
+stability_rate = 0 # Hz, 0 disables stability control
+stability = None # StabilityController with -stability
+
+async def set_drive_motor_power(channel, power_byte, stamp=None):
+	command = drive_motor_frame(channel, power_byte)
+	await queue_command(command, stamp=stamp)
 	if debug:
-		print(f"Sent set_drive_motor_power command to channel {channel}: {command.hex()}")
+		debug_log.log("Queued set_drive_motor_power command to channel {}: {}", channel, command)
+
+async def set_drive_power(power_byte_1, power_byte_2, stamp=None):
+	# One frame for both drive motors on the virtual port, so they start together, two frames as fallback
+	global drive_power_bytes
+	drive_power_bytes = (power_byte_1 & 0xFF, power_byte_2 & 0xFF)
+	if drive_virtual_port is not None:
+		command = combined_motor_frame(drive_virtual_port, power_byte_1 & 0xFF, power_byte_2 & 0xFF)
+		await queue_command(command, stamp=stamp)
+		if debug:
+			debug_log.log("Queued combined drive power command to virtual port {}: {}", drive_virtual_port, command)
+	else:
+		await set_drive_motor_power(PORT_DRIVE_MOTOR_1, power_byte_1, stamp)
+		await set_drive_motor_power(PORT_DRIVE_MOTOR_2, power_byte_2, stamp)
+
+async def setup_drive_virtual_port():
+	global drive_virtual_port
+	if drive_mode != "virtual":
+		return None
+	drive_virtual_port = await connect_virtual_port(dispatcher, queue_command, PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2)
+	if drive_virtual_port is None:
+		print("Virtual drive port rejected by hub, using separate drive motor commands")
+	else:
+		scheduler.add_motor_port(drive_virtual_port)
+	return drive_virtual_port
+
+async def play_macro(path):
+	# Frames are compiled before the first deadline, the virtual port and power shaping in effect now are baked in
+	# the player writes at its deadlines past the scheduler, so joystick drive frames are held back while it plays
+	# the macro starts from the current headlights, the lights it switched are taken over afterwards
+	global macro_player
+	try:
+		steps = load_macro(path, drive_virtual_port, drive.shaper.power_table, drive.headlights_on())
+	except (OSError, ValueError) as e:
+		print(f"Failed to load macro {path}: {e}")
+		return
+	if steering is not None:
+		# the PLAYVM frames would hand the steering motor back to the hub's servo
+		steps = [step for step in steps if step.frame[3] != PORT_PLAYVM]
+		print("Closed-loop steering: macro steer and lights actions are skipped")
+	if not steps:
+		print(f"Macro {path} has no actions")
+		return
+	print(f"Playing macro {path}: {len(steps)} frames over {steps[-1].time:.2f}s")
+	macro_player = MacroPlayer(write_characteristic)
+	try:
+		await macro_player.play(steps, stop_event)
+	finally:
+		played = steps[:len(macro_player.results)]
+		if len(played) < len(steps):
+			# stopped or cancelled halfway, don't leave the motors running
+			await set_drive_power(0x7F, 0x7F)
+		headlights, cabin = played_lights(played)
+		if headlights is not None:
+			drive.lightsplayvmstate = PLAYVM_LIGHTS_ON_ON if headlights else PLAYVM_LIGHTS_OFF_OFF
+		if cabin is not None:
+			drive.cabinlights = cabin
+		# the stick's position goes out again with its next update
+		drive.resend()
+	macro_player.print_report()
+	if macro_report_path:
+		macro_player.dump(macro_report_path)
+		print(f"Macro report saved to {macro_report_path}")
+
+def macro_playing():
+	return macro_task is not None and not macro_task.done()
+
+def start_macro(path):
+	global macro_task
+	if macro_playing():
+		print("A macro is already playing, 'play stop' stops it")
+		return
+	macro_task = asyncio.create_task(play_macro(path))
+
+def stop_macro():
+	if macro_playing():
+		macro_task.cancel() # play_macro brakes the motors on the way out
+		print("Macro stopped")
+	else:
+		print("No macro playing")
 
 async def reset_encoder(channel):
 	await write_characteristic(create_command(PORT_OUTPUT_COMMAND, channel, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_2, 0x00, 0x00, 0x00, 0x00)) # angle bytes for 0 degrees
 
-def get_led_mask(led_states):
-	if len(led_states) != 6:
-		raise ValueError("There must be exactly 6 LED states provided.")
-	
-	mask = 0
-	for index, state in enumerate(led_states):
-		if state:
-			mask |= (1 << index)
-	return mask
-
 #async def go_pos(channel, byte_array): # this is wrong
 #	command = bytes([0x0b, 0x00, 0x81, channel, 0x11, 0x51, 0x03, byte_array[0], byte_array[1]])
 #	await write_characteristic(command)
 
 async def connect_to_device(name, max_attempts=10):
+	# Last connected hub is tried directly, otherwise connects on the first matching advertisement
 	global client
-	attempt = 0
-	while attempt < max_attempts:
-		attempt += 1
-		if debug:
-			print(f"Connection attempt {attempt}/{max_attempts}")
-		devices = await BleakScanner.discover(timeout=3)
-		for device in devices:
-			if device.name == name:
-				client = BleakClient(device.address)
-				try:
-					await client.connect()
-					return client
-				except Exception as e:
-					print(f"Failed to connect: {e}")
-		if debug:
-			print("Device not found, retrying...")
-		await asyncio.sleep(1)  # optional: delay before next attempt
-	print("Failed to connect after maximum attempts.")
-	return None
+	client_class = supervised_client_class()
+	client = (await connect_hub(name, device_address, DeviceCache() if use_device_cache else None, max_attempts, client_class=client_class, scanner_class=ble_scanner_class, debug=debug))[0]
+	return client
+
+def supervised_client_class():
+	load_bleak()
+	if supervisor is None:
+		return ble_client_class
+	return lambda target: ble_client_class(target, disconnected_callback=supervisor.handle_disconnect)
+
+async def reconnect():
+	# Same hub again: its address is tried directly, then a short scan for it
+	address = getattr(client, 'address', None) or device_address
+	client_class = supervised_client_class()
+	new_client = (await connect_hub(DEVICE_NAME, address, DeviceCache() if use_device_cache else None, max_attempts=1, scan_timeout=2.0, direct_timeout=2.0, client_class=client_class, scanner_class=ble_scanner_class, debug=debug))[0]
+	if new_client is None:
+		return None
+	try:
+		await new_client.pair(protection_level = 2)
+	except Exception as e:
+		print(f"Pairing after reconnect failed: {e}")
+	return new_client
+
+def connection_lost():
+	# Drive frames queued before the drop are stale, they must not reach the car when the link is back
+	if scheduler is not None:
+		scheduler.clear()
+
+async def virtual_port_attached(port):
+	# a hub forgets its virtual ports when it restarts: a stop command on the port completes only while it still exists
+	return await virtual_port_accepts(dispatcher, write_characteristic, combined_motor_frame(port, 0x00, 0x00), RESTART_CHECK_TIMEOUT)
 
-async def read_characteristic():
-	data = await client.read_gatt_char(CHARACTERISTIC_UUID)
-	return data
+async def check_drive_virtual_port(port):
+	# error replies carry no port: the last drive power is sent again and only a rejection of that drops the virtual port
+	global drive_virtual_port, drive_port_check
+	try:
+		if not await virtual_port_accepts(dispatcher, queue_command, combined_motor_frame(port, *drive_power_bytes)) and drive_virtual_port == port:
+			drive_virtual_port = None
+			print("Hub rejected the virtual drive port command, using separate drive motor commands")
+			await set_drive_power(*drive_power_bytes)
+	finally:
+		drive_port_check = None
 
-async def write_characteristic(data):
+async def restore_connection(new_client, rebooted):
+	# Versions and steering calibration are only redone when the hub restarted, which the drive virtual port tells
+	# without one (-drive separate, or rejected by the hub) the supervisor's guess from the outage length stands
+	global client, drive_virtual_port
+	client = new_client
+	previous_virtual_port = drive_virtual_port
+	drive_virtual_port = None
+	await dispatcher.start(client)
+	if previous_virtual_port is not None:
+		rebooted = not await virtual_port_attached(previous_virtual_port)
+	if rebooted:
+		await initialize_hub()
+	elif previous_virtual_port is not None:
+		drive_virtual_port = previous_virtual_port # still attached, a new one would leave it behind on the hub
+		await wait_command_completed(HUB_LED_GREEN_FRAME)
+	else:
+		await asyncio.gather(
+			wait_command_completed(HUB_LED_GREEN_FRAME),
+			setup_drive_virtual_port()
+		)
+	if telemetry is not None:
+		await asyncio.gather(*(request_reply(frame, (MESSAGE_TYPE_PORT_INPUT_FORMAT, frame[3])) for frame in telemetry.setup_frames(telemetry_delta)))
+	if steering is not None:
+		await request_reply(steering.setup_frame(), (MESSAGE_TYPE_PORT_INPUT_FORMAT, PORT_STEERING_MOTOR))
+		steering.set_target(0)
+		if rebooted:
+			await steering.calibrate() # encoder zero may have moved
+	if stability is not None:
+		await asyncio.gather(*(request_reply(frame, (MESSAGE_TYPE_PORT_INPUT_FORMAT, frame[3])) for frame in stability.setup_frames()))
+		stability.adjust(0, 0)
+	# car stops until the next joystick update, lights and cabin lights as before the drop
+	drive.resend()
+	if steering is None:
+		await queue_command(playvm_drive_frame(0, drive.lightsplayvmstate))
+	await set_drive_power(0x00, 0x00)
+	await queue_command(CABIN_LIGHTS_FRAMES[drive.cabinlights])
+	power_limit()
+	return rebooted
+
+async def write_characteristic(data, response=True):
 	try:
-		await client.write_gatt_char(CHARACTERISTIC_UUID, data)	
+		await client.write_gatt_char(CHARACTERISTIC_UUID, data, response=response)
 	except Exception as e:
-		print(f"Failed to write data  {data.hex()}: {e}")
+		if supervisor is None or supervisor.accepts():
+			print(f"Failed to write data  {data.hex()}: {e}")
+		if metrics is not None:
+			metrics.count_write(data, False)
+		return False
 	else:
+		if metrics is not None:
+			metrics.count_write(data)
+		if recorder is not None:
+			recorder.record_frame_out(data)
 		if debug:
-			print(f"{data.hex()} written")
+			debug_log.log("{} written", data)
+		return True
+
+async def queue_command(data, lane=None, stamp=None):
+	# Latest frame for each port wins, brake/stop frames are sent before lights and requests
+	if supervisor is not None and not supervisor.accepts(stamp):
+		supervisor.discard() # sent late it would be a stale command, the state is restored after reconnecting
+	elif scheduler is None:
+		await write_characteristic(data)
+	else:
+		scheduler.submit(data, lane, stamp)
+
+async def request_reply(command, key):
+	# Replies arrive as notifications and are matched by message type, port and property
+	try:
+		return await dispatcher.request(queue_command, command, key)
+	except asyncio.TimeoutError:
+		print(f"No reply to {command.hex()}")
+	except LWP3Error as e:
+		print(f"Request {command.hex()} failed: {e}")
+	return None
+
+def handle_notification(data):
+	global drive_port_check
+	if recorder is not None:
+		recorder.record_notification(data)
+	if data[2] == MESSAGE_TYPE_ERROR and len(data) >= 5 and data[3] == PORT_OUTPUT_COMMAND and drive_virtual_port is not None and drive_port_check is None:
+		drive_port_check = asyncio.create_task(check_drive_virtual_port(drive_virtual_port))
+	if debug:
+		debug_log.log(format_read_data, bytes(data)) # notification buffers may be reused, decoded on the writer thread
 
 def process_hub_property_data(data):
 	if data is None or len(data) < 6:
@@ -142,23 +362,38 @@ def process_voltage_or_temperature(data):
 	value = unpack('<H', data[:2])[0]
 	return value
 
-async def get_battery_info():
-	await write_characteristic(create_command(PORT_INPUT_INFORMATION_REQUEST, PORT_VOLTAGE, FEEDBACK_ACTION_NO_ACTION, 0x01, 0x00)) # port mode? updates count? mode combinations?
-	data = await read_characteristic()
-	battery_voltage = process_voltage_or_temperature(data[4:6])/1000
+async def read_battery_info():
+	# Both requests are in flight at once, replies are matched by the dispatcher
+	global last_battery_level
+	data, battery_level = await asyncio.gather(
+		request_reply(port_information_request_frame(PORT_VOLTAGE), (MESSAGE_TYPE_PORT_VALUE, PORT_VOLTAGE)), # value in the port's current mode
+		request_reply(create_command(HUB_PROPERTY, HUB_PROPERTY_BATTERY_LEVEL, HUB_PROPERTY_OPERATION_REQUEST_UPDATE), (HUB_PROPERTY, HUB_PROPERTY_BATTERY_LEVEL))
+	)
+	battery_voltage = process_voltage_or_temperature(data[4:6])/1000 if data is not None else None
+	level = process_hub_property_data(battery_level)
+	if level is not None:
+		last_battery_level = int(level) # reported to remote operators
+	return battery_voltage, level
 
-	await write_characteristic(create_command(HUB_PROPERTY, HUB_PROPERTY_BATTERY_LEVEL, HUB_PROPERTY_OPERATION_REQUEST_UPDATE))
-	battery_level = await read_characteristic()
-	battery_level = process_hub_property_data(battery_level)
-	
-	print(f"Battery voltage: {battery_voltage:.3f}V [{battery_level}%]")
+async def read_temperature():
+	data = await request_reply(port_information_request_frame(PORT_TEMPERATURE), (MESSAGE_TYPE_PORT_VALUE, PORT_TEMPERATURE))
+	if data is None:
+		return None
+	return process_voltage_or_temperature(data[4:6])/10
+
+def print_battery_info(battery_voltage, battery_level):
+	if battery_voltage is not None:
+		print(f"Battery voltage: {battery_voltage:.3f}V [{battery_level}%]")
+
+def print_temperature(hub_temperature):
+	if hub_temperature is not None:
+		print(f"HUB temperature: {hub_temperature:.1f}C")
+
+async def get_battery_info():
+	print_battery_info(*await read_battery_info())
 
 async def get_temperature():
-	await write_characteristic(create_command(PORT_INPUT_INFORMATION_REQUEST, PORT_TEMPERATURE, FEEDBACK_ACTION_NO_ACTION, 0x01, 0x00))
-	data = await read_characteristic()
-	hub_temperature = process_voltage_or_temperature(data[4:6])/10
-	
-	print(f"HUB temperature: {hub_temperature:.1f}C")	
+	print_temperature(await read_temperature())
 
 def process_version_number(data, index):
 	if len(data) < index + 4:
@@ -184,86 +419,157 @@ def process_lwp_version_number(data, index):
 
 	return f"{major}.{minor}"
 
+def format_read_data(data):
+	return f"Read data: {data.hex()} {format_frame(data) if len(data) >= 5 else ''}"
+
 def process_read_data(data):
-	buffer = ""
-	if len(data) >= 5:
-		data_length = data[0]
-		message_type = data[2]
-		if message_type == MESSAGE_TYPE_ERROR:
-			buffer = buffer + "[Error]"
-			commandtype = data[3]
-			errortype = data[4]
-			if commandtype == PORT_OUTPUT_COMMAND:
-				buffer = buffer + " Port Output Command"                
-				if errortype == ERROR_COMMAND_NOT_RECOGNIZED:
-					buffer = buffer + "->Command NOT recognized"
-				elif errortype == ERROR_INVALID_USE:
-					buffer = buffer + "->Invalid use (e.g. parameter error(s))"
-			elif commandtype == PORT_INPUT_COMMAND:
-				buffer = buffer + " Port Input Command" 
-				if errortype == ERROR_COMMAND_NOT_RECOGNIZED:
-					buffer = buffer + "->Command NOT recognized"
-				elif errortype == ERROR_INVALID_USE:
-					buffer = buffer + "->Invalid use (e.g. parameter error(s))"
-			elif commandtype == ERROR_GENERIC:
-				buffer = buffer + " Generic (wrong size??)"
-		elif message_type == MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK:        
-			port = data[3]
-			status = data[4]
-			buffer = buffer + "[Port Output Command Feedback] Port " + str(int(port))
-			if status == 0x0a:
-				buffer = buffer + " OK"
-			else:
-				buffer = buffer + " ??"
-		elif message_type == MESSAGE_TYPE_PORT_VALUE:
-			port = data[3]
-			buffer = buffer + "[Port Value] Port " + str(int(port))
-			if port == PORT_STEERING_MOTOR and len(data) == 8:# For our script, we assume we're getting steering angle here
-				angle = data[4:8]
-				angle = bytes_to_angle(angle)
-				buffer = buffer + " angle: " + str(angle) + "deg"
-			if port == PORT_TEMPERATURE:
-				databytes = data[4:6]
-				value = process_voltage_or_temperature(databytes)/10
-				buffer = buffer + " temperature bytes: " + str(databytes.hex()) + f" [{value:.1f}C]"
-			if port == PORT_VOLTAGE:
-				databytes = data[4:6]
-				value = process_voltage_or_temperature(databytes)/1000
-				buffer = buffer + " voltage bytes: " + str(databytes.hex()) + f" [{value:.3f}V]"
-		elif message_type == 0x47:
-			port = data[3]
-			buffer = buffer + "[Port Input subscribtion changed] Port " + str(int(port))
-	print(f"Read data: {data.hex()} {buffer}")
+	print(format_read_data(data))
 
-async def initialize_hub():
-	await write_characteristic(create_command(HUB_PROPERTY, HUB_PROPERTY_FW, HUB_PROPERTY_OPERATION_REQUEST_UPDATE))
-	fw_data = await read_characteristic()
-	firmware_version = process_hub_property_data(fw_data)
+def record_phase(name, start):
+	startup_phases.append((name, time.monotonic() - start))
 
-	await write_characteristic(create_command(HUB_PROPERTY, HUB_PROPERTY_HW, HUB_PROPERTY_OPERATION_REQUEST_UPDATE))
-	hw_data = await read_characteristic()
-	hardware_version = process_hub_property_data(hw_data)
+def print_startup_timing():
+	phases = ", ".join(f"{name} {duration:.2f}s" for name, duration in startup_phases)
+	print(f"Startup timing: {phases} | launch to READY {time.monotonic() - launch_time:.2f}s")
 
-	await write_characteristic(create_command(HUB_PROPERTY, HUB_PROPERTY_LWP, HUB_PROPERTY_OPERATION_REQUEST_UPDATE))
-	lwp_data = await read_characteristic()
-	lwp_version = process_hub_property_data(lwp_data)
+async def timed(name, coroutine):
+	# Runs one pipelined init step and records how long it took from the start of initialization
+	start = time.monotonic()
+	result = await coroutine
+	record_phase(name, start)
+	return result
 
-	# Change hub led color to green, so we're sure we're in control
-	await asyncio.sleep(1.0)
-	await write_characteristic(create_command(PORT_OUTPUT_COMMAND, PORT_HUB_LED, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, HUB_LED_MODE_COLOR, HUB_LED_COLOR_GREEN))
-	
+async def wait_command_completed(command, write=write_characteristic, timeout=3.0):
+	# Finishes when port output feedback (0x82) reports the command completed/discarded instead of after a fixed delay
+	def finished(data):
+		return data[4] & (FEEDBACK_STATUS_COMPLETED | FEEDBACK_STATUS_DISCARDED) != 0
+	try:
+		await dispatcher.request(write, command, (MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK, command[3]), timeout, finished)
+		return True
+	except asyncio.TimeoutError:
+		print(f"No completion feedback for {command.hex()}")
+	except LWP3Error as e:
+		print(f"Command {command.hex()} failed: {e}")
+	return False
+
+async def initialize_hub():
+	# Property and port information requests, the hub led and steering calibration all run at once
+	global hub_firmware, hub_hardware
+	init_start = time.monotonic()
+	fw_data, hw_data, lwp_data, battery_info, hub_temperature, led_done, calibration_done, virtual_port = await asyncio.gather(
+		timed("fw", request_reply(create_command(HUB_PROPERTY, HUB_PROPERTY_FW, HUB_PROPERTY_OPERATION_REQUEST_UPDATE), (HUB_PROPERTY, HUB_PROPERTY_FW))),
+		timed("hw", request_reply(create_command(HUB_PROPERTY, HUB_PROPERTY_HW, HUB_PROPERTY_OPERATION_REQUEST_UPDATE), (HUB_PROPERTY, HUB_PROPERTY_HW))),
+		timed("lwp", request_reply(create_command(HUB_PROPERTY, HUB_PROPERTY_LWP, HUB_PROPERTY_OPERATION_REQUEST_UPDATE), (HUB_PROPERTY, HUB_PROPERTY_LWP))),
+		timed("battery", read_battery_info()),
+		timed("temperature", read_temperature()),
+		# Change hub led color to green, so we're sure we're in control
+		timed("hub led", wait_command_completed(HUB_LED_GREEN_FRAME)),
+		timed("calibration", calibrate_steering()),
+		timed("virtual port", setup_drive_virtual_port())
+	)
+	record_phase("init total", init_start)
+
+	hub_firmware = process_hub_property_data(fw_data)
+	hub_hardware = process_hub_property_data(hw_data)
 	print(f"Connected to {DEVICE_NAME}")
-	print(f"Firmware Version: {firmware_version}")
-	print(f"Hardware Version: {hardware_version}")
-	print(f"LWP Version: {lwp_version}")
-	await get_battery_info()
-	await get_temperature()	
-	await autocalibrate_steering()
+	print(f"Firmware Version: {hub_firmware}")
+	print(f"Hardware Version: {hub_hardware}")
+	print(f"LWP Version: {process_hub_property_data(lwp_data)}")
+	if virtual_port is not None:
+		print(f"Drive motors combined on virtual port {virtual_port}")
+	print_battery_info(*battery_info)
+	print_temperature(hub_temperature)
+	print("Steering calibrated" if calibration_done else "Steering calibration not confirmed by hub")
+	print("Car is READY!")
+	print_startup_timing()
 	power_limit()
 
 	# Turn off 6led so we won't waste battery for now (led mask, power int 0-100)
 	#await write_characteristic(create_command(PORT_OUTPUT_COMMAND, PORT_6LEDS, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0xff, 0x00))
-	await write_characteristic(create_command(PORT_OUTPUT_COMMAND, PORT_PLAYVM, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0x03, 0x00, 0x00, 0x00, PLAYVM_LIGHTS_OFF_OFF, 0x00))
+	await write_characteristic(PLAYVM_LIGHTS_OFF_FRAME)
+
+async def load_port_capabilities():
+	# Port and mode information for this firmware/hardware from the port cache, discovered once and saved otherwise
+	global port_capabilities
+	if discovery_mode == "off":
+		return None
+	known_version = hub_firmware and hub_hardware
+	cache = PortCache(port_cache_path)
+	if discovery_mode == "cache" and known_version:
+		port_capabilities = cache.get(hub_firmware, hub_hardware)
+	if port_capabilities is not None:
+		print(f"Port capabilities of firmware {hub_firmware} hardware {hub_hardware} from cache: {len(port_capabilities.ports)} ports")
+	else:
+		start = time.monotonic()
+		port_capabilities = await discover_ports(partial(dispatcher.request, queue_command))
+		print(f"Discovered {len(port_capabilities.ports)} ports in {time.monotonic() - start:.2f}s")
+		if known_version and port_capabilities.ports:
+			cache.store(hub_firmware, hub_hardware, port_capabilities)
+	for port, value_format, label in decoder_formats(port_capabilities):
+		set_port_value_format(port, value_format, label)
+	return port_capabilities
+
+async def start_telemetry(port_names):
+	global telemetry
+	# numpy is only needed when telemetry is enabled
+	from utils.telemetry import TelemetryStream, TELEMETRY_PORT_NAMES, telemetry_formats
+	names = [name for name in port_names.split(",") if name]
+	unknown = [name for name in names if name not in TELEMETRY_PORT_NAMES]
+	if unknown:
+		print(f"Unknown telemetry ports: {', '.join(unknown)} (available: {', '.join(TELEMETRY_PORT_NAMES)})")
+		return
+	ports = [TELEMETRY_PORT_NAMES[name] for name in names]
+	telemetry = TelemetryStream(ports, formats=telemetry_formats(port_capabilities, ports))
+	telemetry.attach(dispatcher)
+	replies = await asyncio.gather(*(request_reply(frame, (MESSAGE_TYPE_PORT_INPUT_FORMAT, frame[3])) for frame in telemetry.setup_frames(telemetry_delta)))
+	enabled = [name for name, reply in zip(names, replies) if reply is not None]
+	print(f"Telemetry streaming: {', '.join(enabled) if enabled else 'none'}")
+
+def submit_steering(frame):
+	# called from the angle notification callback, so no await: straight into the scheduler's drive lane
+	if supervisor is None or supervisor.accepts():
+		scheduler.submit(frame, LANE_DRIVE)
+
+async def start_closed_loop_steering():
+	# Position control on the steering motor angle, no PLAYVM frames are sent from here on: their steering servo would
+	# fight the position control, so headlights and brake lights stay as they are
+	global steering
+	steering = SteeringController(submit_steering)
+	steering.attach(dispatcher)
+	subscribed = await request_reply(steering.setup_frame(), (MESSAGE_TYPE_PORT_INPUT_FORMAT, PORT_STEERING_MOTOR))
+	if subscribed is None or not await steering.calibrate():
+		print("Steering motor angle not available, using PLAYVM steering")
+		steering.detach(dispatcher)
+		steering = None
+		return None
+	drive.shaper.set_steering_limit(100)
+	print(f"Closed-loop steering: end stops at {steering.left_stop} and {steering.right_stop} deg, headlights and brake lights stay as they are (lights button disabled)")
+	return steering
+
+async def send_stability_output(power, steering_percent):
+	# corrections the stability loop makes between joystick updates, lights as last sent, nothing while braking
+	if client is None or not client.is_connected or macro_playing():
+		return
+	if steering is not None:
+		steering.set_target(steering_percent)
+	else:
+		await queue_command(playvm_drive_frame(steering_percent, drive.lightsplayvmstate))
+	await set_drive_power(-power & 0xFF, power & 0xFF)
+
+async def start_stability_control():
+	# numpy is only needed when stability control is enabled
+	global stability
+	from utils.stability_control import StabilityController
+	stability = StabilityController(send_stability_output, stability_rate, port_capabilities)
+	stability.attach(dispatcher)
+	replies = await asyncio.gather(*(request_reply(frame, (MESSAGE_TYPE_PORT_INPUT_FORMAT, frame[3])) for frame in stability.setup_frames()))
+	if None in replies:
+		print("Gyro or accelerometer not available, stability control is off")
+		stability.detach(dispatcher)
+		stability = None
+		return None
+	print(f"Stability control at {stability.rate} Hz on gyro and accelerometer")
+	return stability
 
 async def initialize_joystick():
 	global joystick
@@ -276,143 +582,112 @@ async def initialize_joystick():
 		joystick.init()	
 		print(f"Joystick name: {joystick.get_name()}")
 
+async def calibrate_steering():
+	# "Special" PLAYVM commands to calibrate steering, written directly so the scheduler can't merge them
+	# we need to wait until calibration is finished before sending any more PLAYVM commands, the hub reports it with 0x82 feedback
+	if not await wait_command_completed(PLAYVM_COMMAND_FRAME):
+		return False
+	return await wait_command_completed(PLAYVM_CALIBRATE_STEERING_FRAME)
+
 async def autocalibrate_steering():
 	print("Calibrating steering...")
-	# "Special" PLAYVM commands to calibrate steering
-	await write_characteristic(create_command(PORT_OUTPUT_COMMAND, PORT_PLAYVM, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0x03, 0x00, 0x00, 0x00, PLAYVM_COMMAND, 0x00))
-	await write_characteristic(create_command(PORT_OUTPUT_COMMAND, PORT_PLAYVM, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0x03, 0x00, 0x00, 0x00, PLAYVM_CALIBRATE_STEERING, 0x00))
-	await asyncio.sleep(1.5) # we need to wait unti calibration is finished before sending any more PLAYVM commands
+	if not await calibrate_steering():
+		await asyncio.sleep(1.5) # no feedback from hub, fall back to the fixed calibration time
 	print("Car is READY!")
 
-async def handle_controller_events():
-	global last_power_input, last_steering_input, powerlimit, lightsplayvmstate, brakeapplied, last_lights_input, cabinlights, last_cabin_lights_input
-	for event in pygame.event.get():
-		if event.type == pygame.JOYAXISMOTION or event.type == pygame.JOYBUTTONDOWN or event.type == pygame.JOYBUTTONUP:
-			
-			# drive power
-			power_input = int(((joystick.get_axis(5)-joystick.get_axis(4)) * 100) / 2)
-			power_input_modified = int(power_input*(powerlimit*0.01))
-			if abs(power_input_modified) <= 15:
-				power_input_modified = 0
-			elif power_input_modified >= 95:
-				power_input_modified = 100
-			elif power_input_modified <= -95:
-				power_input_modified = -100
-			
-			# steering
-			steering_input = int(joystick.get_axis(0)*100)
-			steering_input_modified = steering_input
-			if abs(steering_input_modified) <= 2:
-				steering_input_modified = 0
-			# Prevent triggering overcurrent protection at max steering input - calibration by PLAYVM is not super precise
-			# limiting to 94% is enough to prevent overcurrent, 88 should be good to prevent stall
-			# todo: adjust joystick input to get linear 0-88%
-			elif steering_input_modified >= 88:
-				steering_input_modified = 88
-			elif steering_input_modified <= -88:
-				steering_input_modified = -88
-
-			# braking
-			brake_state_changed = False
-			brake_input = joystick.get_button(5)
-			if brake_input and not brakeapplied:
-				brake_state_changed = True
-				brakeapplied = True				
-			elif not brake_input and brakeapplied:
-				brake_state_changed = True
-				brakeapplied = False
-
-			# cabin lights on/off
-			cabin_lights_input = joystick.get_button(1)
-			if event.type == pygame.JOYBUTTONDOWN:				
-				if cabin_lights_input and not last_cabin_lights_input:
-					if debug:
-						print("cabin_lights_input and not last_cabin_lights_input")
-					last_cabin_lights_input = True
-					if cabinlights == True:
-						cabinlights = False
-						if debug:
-							print("Cabin lights changed from True to False")						
-					else:
-						cabinlights = True
-						if debug:
-							print("Cabin lights changed from False to True")
-					cabinlightsbyte = 100 if cabinlights else 0
-					await write_characteristic(create_command(PORT_OUTPUT_COMMAND, PORT_6LEDS, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, get_led_mask([1, 0, 0, 1, 0, 0]), cabinlightsbyte))
-			if event.type == pygame.JOYBUTTONUP and last_cabin_lights_input:
-				last_cabin_lights_input = False
-
-			# lights on/off
-			lights_state_changed = False
-			lights_input = joystick.get_button(3)
-			if event.type == pygame.JOYBUTTONDOWN:				
-				if lights_input and not last_lights_input:
-					if debug:
-						print("lights_input and not last_lights_input")
-					lights_state_changed = True
-					last_lights_input = True
-					if lightsplayvmstate == PLAYVM_LIGHTS_ON_ON or lightsplayvmstate == PLAYVM_LIGHTS_ON_BRAKING:
-						lightsplayvmstate = PLAYVM_LIGHTS_OFF_OFF
-						if debug:
-							print("Lights changed from LIGHTS_ON_ON to LIGHTS_OFF_OFF")						
-					elif lightsplayvmstate == PLAYVM_LIGHTS_OFF_OFF or lightsplayvmstate == PLAYVM_LIGHTS_OFF_BRAKING:
-						lights_state_changed = True
-						lightsplayvmstate = PLAYVM_LIGHTS_ON_ON
-						if debug:
-							print("Lights changed from LIGHTS_OFF_OFF to LIGHTS_ON_ON")
-			if event.type == pygame.JOYBUTTONUP and last_lights_input:
-				last_lights_input = False
-
-			if debug:
-				print(f"power_input: {power_input} (modified: {power_input_modified}), steering_input: {steering_input} (modified: {steering_input_modified}), brake_input: {brake_input}, lights_input: {lights_input}")
-
-			# Ignore power_input change for less than 5% and steering less than 3%
-			power_input_changed = False
-			steering_input_changed = False
-			if abs(power_input_modified - last_power_input) >= 5:# todo this is fine fo 100% power, but not for 25%, so changed it to int(5*powerlimit*0.01)
-				power_input_changed = True
-				last_power_input = power_input_modified
-			if abs(steering_input_modified - last_steering_input) >= 3:
-				steering_input_changed = True
-				last_steering_input = steering_input_modified
-
-			if brake_input:
-				if lightsplayvmstate == PLAYVM_LIGHTS_OFF_OFF:
-					lights = PLAYVM_LIGHTS_OFF_BRAKING
-				elif lightsplayvmstate == PLAYVM_LIGHTS_ON_ON:
-					lights = PLAYVM_LIGHTS_ON_BRAKING
-			else: 
-				lights = lightsplayvmstate
-			# Send PLAYVM commands
-			if (power_input_changed or steering_input_changed or brake_state_changed or lights_state_changed) and client != None and client.is_connected:		
-				await write_characteristic(create_command(PORT_OUTPUT_COMMAND, PORT_PLAYVM, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0x03, 0x00, 0x00, steering_input_modified&0xFF, lights, 0x00))
-				# Send drive motor power commands directly to get instant response
-				if not brake_input:
-					await set_drive_motor_power(PORT_DRIVE_MOTOR_1, -power_input_modified&0xFF)
-					await set_drive_motor_power(PORT_DRIVE_MOTOR_2, power_input_modified&0xFF)
-				else: # engine braking # todo don't send when only lights or steering changed
-					await set_drive_motor_power(PORT_DRIVE_MOTOR_1, 0x7F)
-					await set_drive_motor_power(PORT_DRIVE_MOTOR_2, 0x7F)
-				# todo those can be send in one command maybe?				
-			elif debug:
-				print("Drive commands ignored due to low input change or HUB disconnected!")
-		if event.type == pygame.JOYBUTTONUP:
-			last_cabin_lights_input = joystick.get_button(1)
-			last_lights_input = joystick.get_button(3)
-			bra = joystick.get_button(5)
-
-				
+async def handle_controller_events(batch=False, stamp=None):
+	# batch=False keeps the original behaviour of processing every joystick event separately,
+	# batch=True takes one joystick snapshot and sends at most one command set for all pending events
+	events = pygame.event.get()
+	processed = False
+	if batch:
+		event_types = {event.type for event in events if event.type in JOYSTICK_EVENTS}
+		if event_types:
+			pressed_buttons = {event.button for event in events if event.type == pygame.JOYBUTTONDOWN}
+			await process_controller_input(event_types, pressed_buttons, stamp)
+			processed = True
+	else:
+		for event in events:
+			if event.type in JOYSTICK_EVENTS:
+				pressed_buttons = (event.button,) if event.type == pygame.JOYBUTTONDOWN else ()
+				await process_controller_input((event.type,), pressed_buttons, stamp)
+				processed = True
+	# slew limited outputs keep moving towards the stick position without new events
+	if not processed and joystick is not None and drive.shaper.settling():
+		await process_controller_input((), (), stamp)
+
+async def process_controller_input(event_types, pressed_buttons=(), stamp=None, pad=None):
+	if pad is None:
+		pad = joystick # the local joystick, remote operators pass their own state
+	if recorder is not None:
+		recorder.record_joystick(pad.get_axis(AXIS_STEERING), pad.get_axis(AXIS_LEFT_TRIGGER), pad.get_axis(AXIS_RIGHT_TRIGGER), pad.get_button(BUTTON_BRAKE), pad.get_button(BUTTON_LIGHTS) or BUTTON_LIGHTS in pressed_buttons, pad.get_button(BUTTON_CABIN_LIGHTS) or BUTTON_CABIN_LIGHTS in pressed_buttons)
+	shaped = time.monotonic()
+	if metrics is not None:
+		metrics.record_shaped(stamp, shaped)
+	# shaping, brake, lights toggles and the drive frames, shared with the fleet's cars
+	await drive.update(pad, pressed_buttons, pygame.JOYBUTTONUP in event_types, stamp, shaped, steering, stability, debug_log.log if debug else None)
+
+def drive_ready():
+	return client is not None and client.is_connected and not macro_playing()
+
+def create_drive(new_shaper):
+	global drive
+	drive = DriveControl(new_shaper, queue_command, set_drive_power, drive_ready)
+	return drive
+
+async def handle_remote_input(pad, pressed_buttons, released_buttons, stamp):
+	# Remote operator or input process state through the same shaping, lights toggling and scheduler path as the local joystick
+	event_types = {pygame.JOYAXISMOTION}
+	if pressed_buttons:
+		event_types.add(pygame.JOYBUTTONDOWN)
+	if released_buttons:
+		event_types.add(pygame.JOYBUTTONUP)
+	await process_controller_input(event_types, pressed_buttons, stamp, pad)
+
+async def settle_input(pad, stamp):
+	# slew limited outputs keep moving towards the last sampled state between input process updates
+	if drive.shaper.settling():
+		await process_controller_input((), (), stamp, pad)
+
+async def start_input_process():
+	# joystick sampling in its own process, event mode in this process when it can't start
+	global input_process, input_mode
+	input_process = InputProcess(input_rate)
+	if await input_process.start():
+		print(f"Joystick name: {input_process.pad.get_name()} (sampled at {input_rate} Hz in a separate process)")
+	else:
+		input_process = None
+		input_mode = "event"
+
+def remote_status():
+	link_up = client is not None and client.is_connected and (supervisor is None or supervisor.is_up())
+	return link_up, last_battery_level
+
+async def start_gateway(host, port):
+	global gateway
+	gateway = RemoteControlGateway(handle_remote_input, remote_status)
+	try:
+		address = await gateway.start(host, port)
+	except OSError as e:
+		print(f"Remote control gateway failed to start on {host}:{port}: {e}")
+		gateway = None
+		return None
+	print(f"Remote control gateway listening on UDP {address[0]}:{address[1]}")
+	return gateway
+
 async def read_input():
 	loop = asyncio.get_event_loop()
 	while True:
 		command = await loop.run_in_executor(None, input, "Enter data to write, use controller or type 'help':\n")
-		yield command.strip().lower()
+		yield command.strip()
 
 def debug_mode(status=None):
 	global debug
 	if status != None:
 		debug = status
 	print("Debug mode is:", "ON" if debug else "OFF")
+	if debug_log.logged:
+		debug_log.print_stats()
 
 def power_limit(limit=None):
 	global powerlimit
@@ -421,22 +696,47 @@ def power_limit(limit=None):
 			powerlimit = limit
 		else:
 			print("Power limit must be between 25 and 100")
+	if drive is not None:
+		drive.shaper.set_power_limit(effective_power_limit())
 	if powerlimit != 100:
 		print(f"Power limited to {powerlimit}%")
 	else:
 		print(f"Power is UNLIMITED")
+	if monitor is not None and monitor.cap < powerlimit:
+		print(f"Power capped to {monitor.cap}% by hub monitor ({monitor.reason})")
+
+def effective_power_limit():
+	# the user's limit, lowered further while the battery sags or the hub is hot
+	if monitor is None:
+		return powerlimit
+	return min(powerlimit, monitor.cap)
+
+def monitor_limit_changed(cap, reason):
+	if drive is not None:
+		drive.shaper.set_power_limit(effective_power_limit())
+	if reason is not None:
+		print(f"Power capped to {cap}%: {reason}")
+	else:
+		print(f"Battery and temperature back to normal, power limit {powerlimit}%")
+
+def start_monitor():
+	global monitor
+	monitor = HubMonitor(read_battery_info, read_temperature, monitor_interval, low_voltage, hot_temperature, monitor_limit_changed, lambda: supervisor is None or supervisor.is_up())
+	return monitor
 
 async def handle_terminal_commands(stop_event):
 	global powerlimit
 	async for cmd in read_input():
 		parts = cmd.split()  # Rozdziela komendę od argumentów
-		command = parts[0]
+		command = parts[0].lower() # arguments keep their case, macro file names are case sensitive
 		if command == "exit":
 			stop_event.set()
 			break
 		elif command == "read":
-			data = await read_characteristic()
-			process_read_data(data)
+			if not dispatcher.recent:
+				print("No data received")
+			while dispatcher.recent:
+				process_read_data(dispatcher.recent.popleft())
 		elif command == "debug":
 			debug_mode()
 		elif command == "debugon":
@@ -446,11 +746,45 @@ async def handle_terminal_commands(stop_event):
 		elif command == "autocalibrate":
 			await autocalibrate_steering()
 		elif command == "joystick":
-			await initialize_joystick()
+			if input_process is not None:
+				input_process.print_stats()
+			else:
+				await initialize_joystick()
+		elif command == "ports":
+			if port_capabilities is not None:
+				port_capabilities.print_summary()
+			else:
+				print("Port discovery is off, use -discovery cache or refresh")
+		elif command == "scheduler":
+			if scheduler is not None:
+				scheduler.print_stats()
+		elif command == "telemetry":
+			if telemetry is not None:
+				telemetry.print_status()
+			else:
+				print("Telemetry is off, start with -telemetry accel,gyro,tilt,orientation")
+		elif command == "stats":
+			metrics.print_stats()
+			if supervisor is not None:
+				supervisor.print_stats()
+		elif command == "latency":
+			if scheduler is not None:
+				scheduler.print_latency(f" ({input_mode} mode)")
 		elif command == "voltage":
-			await get_battery_info()
+			if monitor is not None and monitor.voltage.samples:
+				monitor.print_battery()
+			else:
+				await get_battery_info()
 		elif command == "temp":
-			await get_temperature()
+			if monitor is not None and monitor.temperature.samples:
+				monitor.print_temperature()
+			else:
+				await get_temperature()
+		elif command == "monitor":
+			if monitor is not None:
+				monitor.print_status()
+			else:
+				print("Hub monitor is off, start with -monitor seconds")
 		elif command == "power":
 			if len(parts) == 2 and parts[1].isdigit():
 				limit = int(parts[1])
@@ -459,91 +793,313 @@ async def handle_terminal_commands(stop_event):
 				power_limit()
 			else:
 				print("Invalid power limit command. Usage: powerlimit <value>")
-		elif command == "getledmask":
-			if len(parts) == 7 and all(part.isdigit() for part in parts[1:]):
-				led_states = [bool(int(arg)) for arg in parts[1:]]
-				mask = get_led_mask(led_states)
-				print(f"Generated LED mask: {mask:02x}")
+		elif command in TOOL_COMMANDS:
+			# angletobytes, bytestoangle, getledmask, frame, decode - also available offline with 'tool'
+			run_tool_command([part.lower() for part in parts])
+		elif command == "play":
+			if len(parts) == 2 and parts[1].lower() == "stop":
+				stop_macro()
+			elif len(parts) == 2:
+				start_macro(parts[1])
 			else:
-				print("Invalid getledmask command. Usage example: getledmask 0 0 1 0 0 0")
-		elif command == "angletobytes":
-			if len(parts) == 2 and is_integer(parts[1]):
-				angle = int(parts[1])
-				anglebytes = angle_to_bytes(angle)
-				print(f"Angle {angle} bytes representation: {anglebytes.hex()}")
+				print("Invalid play command. Usage: play file | play stop")
+		elif command == "steering":
+			if steering is not None:
+				steering.print_status()
 			else:
-				print("Invalid angletobytes command. Usage: angletobytes angle (int)")
-		elif command == "bytestoangle":
-			if len(parts) == 2:
-				try:
-					anglebytes = parts[1]
-					angle = bytes_to_angle(bytes.fromhex(anglebytes))
-					print(f"Angle bytes {anglebytes} int representation: {angle}")
-				except ValueError:
-					print("Invalid hex data format.")
-					print("Invalid bytestoangle command. Usage: bytestoangle angle (hex)")
+				print("Steering is open-loop through PLAYVM, start with -steering closed for position control")
+		elif command == "stability":
+			if stability is not None:
+				stability.print_status()
 			else:
-				print("Invalid bytestoangle command. Usage: bytestoangle angle (hex)")
+				print("Stability control is off, start with -stability Hz")
+		elif command == "remote":
+			if gateway is not None:
+				gateway.print_stats()
+			else:
+				print("Remote control is off, start with -remote [host:]port")
+		elif command == "macro":
+			if macro_player is not None:
+				macro_player.print_report(frames=True)
+			else:
+				print("No macro played yet, start one with: play file")
 		elif command == "help":			
-			print("Available commands: angletobytes, autocalibrate, bytestoangle, debug, debugoff, debugon, exit, getledmask, help, joystick, power, read, temp, voltage")
-			print("'read' is automatically called after any write in debug-mode")
+			print("Available commands: angletobytes, autocalibrate, bytestoangle, debug, debugoff, debugon, decode, exit, frame, getledmask, help, joystick, latency, macro, monitor, play, ports, power, read, remote, stability, steering, scheduler, stats, telemetry, temp, voltage")
+			print("'read' prints notifications received since last call, in debug-mode every notification is printed")
 		else:
 			try:
 				data_bytes = bytes.fromhex(command)
 				await write_characteristic(data_bytes)
 				print("Data written")
-				if debug:
-					data = await read_characteristic()
-					process_read_data(data)
 			except ValueError:
 				print("Invalid hex data format or unknown command")
 
 
 async def main():
-	global client, joystick
+	global client, joystick, scheduler, dispatcher, recorder, metrics, supervisor
+	if fleet_mode:
+		await fleet_main()
+		return
 	print("Searching for LEGO Porsche car. Make sure it's on and blinking...")
 	debug_mode()
+	# pygame import overlaps with the scan and connection instead of delaying startup
+	pygame_loading = asyncio.get_running_loop().run_in_executor(None, load_pygame)
+	input_starting = asyncio.create_task(start_input_process()) if input_mode == "process" else None
+	metrics = LatencyStats()
+	if auto_reconnect:
+		supervisor = ConnectionSupervisor(reconnect, restore_connection, connection_lost)
+	if record_path:
+		recorder = SessionRecorder(record_path)
+		print(f"Recording session to {record_path}")
+	phase_start = time.monotonic()
 	client = await connect_to_device(DEVICE_NAME)
 	if client is None:
 		print(f"Device '{DEVICE_NAME}' not found.")
+		if input_starting is not None:
+			await input_starting
+			if input_process is not None:
+				input_process.close()
 		return
+	record_phase("connect", phase_start)
 
+	phase_start = time.monotonic()
 	await client.pair(protection_level = 2)
+	record_phase("pair", phase_start)
+
+	scheduler = CommandScheduler(write_characteristic, metrics=metrics)
+	scheduler_task = asyncio.create_task(scheduler.run(stop_event))
+	dispatcher = ResponseDispatcher()
+	dispatcher.subscribe(handle_notification)
+	phase_start = time.monotonic()
+	await dispatcher.start(client)
+	record_phase("notify", phase_start)
 	await initialize_hub()
+	await load_port_capabilities()
+	if telemetry_ports:
+		await start_telemetry(telemetry_ports)
+	if steering_mode == "closed":
+		await start_closed_loop_steering()
+	if stability_rate > 0:
+		await start_stability_control()
+	if monitor_interval > 0:
+		start_monitor()
+
+	await pygame_loading
+	if input_starting is not None:
+		await input_starting
+	if input_process is None:
+		pygame.init()
+		await initialize_joystick()
+	if macro_path:
+		start_macro(macro_path)
+	if remote_address is not None:
+		await start_gateway(*remote_address)
 
-	pygame.init()
-	await initialize_joystick()
-	
 	try:
 		await asyncio.gather(
 			handle_terminal_commands(stop_event),
-			controller_event_loop(stop_event)
+			controller_event_loop(stop_event),
+			scheduler_task,
+			*([supervisor.run(stop_event)] if supervisor is not None else []),
+			*([gateway.run(stop_event)] if gateway is not None else []),
+			*([steering.run(stop_event)] if steering is not None else []),
+			*([stability.run(stop_event)] if stability is not None else []),
+			*([monitor.run(stop_event)] if monitor is not None else [])
 		)
 	except KeyboardInterrupt:
 		pass
-	
+	if gateway is not None:
+		gateway.close()
+	if input_process is not None:
+		input_process.close()
+	if debug:
+		scheduler.print_stats()
+		scheduler.print_latency(f" ({input_mode} mode)")
+
+	if supervisor is not None:
+		supervisor.close()
+	await dispatcher.stop()
 	await client.disconnect()
 	print("Disconnected")
+	if recorder is not None:
+		recorder.close()
+		print(f"Session saved to {record_path} ({recorder.records} records)")
+	if stats_path:
+		metrics.dump(stats_path)
+		print(f"Stats saved to {stats_path}")
+
+async def fleet_main():
+	print("Searching for all LEGO Porsche cars. Make sure they're on and blinking...")
+	pygame_loading = asyncio.get_running_loop().run_in_executor(None, load_pygame)
+	load_bleak()
+	fleet = await connect_fleet(DEVICE_NAME, DeviceCache() if use_device_cache else None, client_class=ble_client_class, scanner_class=ble_scanner_class, powerlimit=powerlimit, drive_mode=drive_mode, shaper_options=shaper_options)
+	if not fleet.cars:
+		print(f"No '{DEVICE_NAME}' hubs found.")
+		return
+	print(f"Connected to {len(fleet.cars)} cars")
+	fleet_task = asyncio.create_task(fleet.run(stop_event))
+	await fleet.initialize()
+	power_limit()
+	fleet.set_power_limit(powerlimit)
+
+	await pygame_loading
+	pygame.init()
+	pygame.joystick.init()
+	joysticks = [pygame.joystick.Joystick(index) for index in range(pygame.joystick.get_count())]
+	for joystick in joysticks:
+		joystick.init()
+	controlled = fleet.assign(joysticks, fleet_group)
+	print(f"{len(joysticks)} joysticks, {controlled} of {len(fleet.cars)} cars controlled{' by joystick 0' if fleet_group else ''}")
+
+	try:
+		await asyncio.gather(
+			handle_fleet_commands(fleet, stop_event),
+			fleet_event_loop(fleet, stop_event),
+			fleet_task
+		)
+	except KeyboardInterrupt:
+		pass
+	if stats_path:
+		with open(stats_path, 'w') as file:
+			json.dump({car.name(): car.metrics.to_dict() for car in fleet.cars}, file, indent=2)
+		print(f"Stats saved to {stats_path}")
+	await fleet.disconnect()
+	print("Disconnected")
+
+async def fleet_event_loop(fleet, stop_event):
+	# One pygame event queue for all joysticks, events are grouped by joystick and every car gets at most one update per sample
+	interval = 1 / input_rate
+	next_sample = time.monotonic()
+	last_sample = next_sample
+	while not stop_event.is_set():
+		now = time.monotonic()
+		pressed = {}
+		released = set()
+		for event in pygame.event.get():
+			if event.type in JOYSTICK_EVENTS:
+				buttons = pressed.setdefault(event.instance_id, set())
+				if event.type == pygame.JOYBUTTONDOWN:
+					buttons.add(event.button)
+				elif event.type == pygame.JOYBUTTONUP:
+					released.add(event.instance_id)
+		await fleet.handle_input(pressed, (last_sample + now) / 2, released)
+		last_sample = now
+		next_sample = max(next_sample + interval, time.monotonic())
+		await asyncio.sleep(next_sample - time.monotonic())
+
+async def handle_fleet_commands(fleet, stop_event):
+	async for cmd in read_input():
+		parts = cmd.split()
+		if not parts:
+			continue
+		command = parts[0]
+		if command == "exit":
+			stop_event.set()
+			break
+		elif command == "stats":
+			fleet.print_stats()
+		elif command == "power" and len(parts) == 2 and parts[1].isdigit():
+			power_limit(int(parts[1]))
+			fleet.set_power_limit(powerlimit)
+		elif command == "help":
+			print("Fleet mode commands: exit, help, power, stats")
+		else:
+			print("Unknown command, type 'help'")
 
 async def controller_event_loop(stop_event):
+	# Events have no arrival time, so input time is estimated as the middle of the sampling interval
 	try:
-		while not stop_event.is_set():
-			await handle_controller_events()
-			await asyncio.sleep(0.05)
+		if input_process is not None:
+			await input_process.run(handle_remote_input, stop_event, settle_input)
+		elif input_mode == "event":
+			interval = 1 / input_rate
+			next_sample = time.monotonic()
+			last_sample = next_sample
+			while not stop_event.is_set():
+				now = time.monotonic()
+				await handle_controller_events(batch=True, stamp=(last_sample + now) / 2)
+				last_sample = now
+				# absolute deadlines so slow iterations don't stretch the sampling period
+				next_sample = max(next_sample + interval, time.monotonic())
+				await asyncio.sleep(next_sample - time.monotonic())
+		else:
+			last_sample = time.monotonic()
+			while not stop_event.is_set():
+				now = time.monotonic()
+				await handle_controller_events(stamp=(last_sample + now) / 2)
+				last_sample = now
+				await asyncio.sleep(0.05)
 	except KeyboardInterrupt:
 		pass
 
 if __name__ == "__main__":
-	parser = argparse.ArgumentParser(description="LEGO Porsche Controller")
+	parser = argparse.ArgumentParser(description="LEGO Porsche Controller", epilog="Offline protocol utilities: tool angletobytes|bytestoangle|getledmask|frame|decode ..., 'tool -' reads commands from stdin")
 	parser.add_argument('-debug', action='store_true', help="Enable debug mode to print controller inputs")
+	parser.add_argument('-debuglog', help="Write debug lines with timestamps to this file instead of the terminal")
 	parser.add_argument('-power', type=int, choices=range(25, 101), help="Set initial power limit (25-100)")
+	parser.add_argument('-input', choices=["poll", "event", "process"], default="poll", help="Controller input mode: poll every 50 ms (default), batch events at -rate Hz or sample the joystick at -rate Hz in a separate process")
+	parser.add_argument('-drive', choices=["virtual", "separate"], default="virtual", help="Drive motors as one virtual port (default, falls back if the hub rejects it) or two separate ports")
+	parser.add_argument('-telemetry', default="", help="Stream IMU ports, comma separated: accel,gyro,tilt,orientation")
+	parser.add_argument('-telemetrydelta', type=int, default=1, help="Value change that triggers a telemetry notification (default 1)")
+	parser.add_argument('-record', help="Record outgoing frames, notifications and joystick snapshots to a binary session log")
+	parser.add_argument('-powerslew', type=int, default=0, help="Max drive power change in %%/s, 0 disables slew limiting (default)")
+	parser.add_argument('-steerslew', type=int, default=0, help="Max steering change in %%/s, 0 disables slew limiting (default)")
+	parser.add_argument('-steerscale', action='store_true', help="Scale steering linearly to the 88%% limit instead of clamping it")
+	parser.add_argument('-stats', help="Dump write counters and latency histograms to this JSON file at exit")
+	parser.add_argument('-address', help="Connect only to the hub with this Bluetooth address")
+	parser.add_argument('-nocache', action='store_true', help="Don't use or update the known hub address cache")
+	parser.add_argument('-noreconnect', action='store_true', help="Don't reconnect automatically when the Bluetooth link drops")
+	parser.add_argument('-fleet', action='store_true', help="Connect to every Technic Move hub found, joystick N drives car N")
+	parser.add_argument('-group', action='store_true', help="With -fleet, joystick 0 drives all cars together")
+	parser.add_argument('-macro', help="Play this macro script once the car is ready (see utils/macro_player.py for the format)")
+	parser.add_argument('-macroreport', help="Save per-frame deadline lateness and write times of played macros to this JSON file")
+	parser.add_argument('-steering', choices=["playvm", "closed"], default="playvm", help="playvm (default): steering percentage in the PLAYVM frame, closed: position control on the steering motor angle with learned end stops")
+	parser.add_argument('-stability', type=int, default=0, help="Traction and stability control on the gyro and accelerometer at this rate in Hz, at least 100, 0 disables (default, needs numpy)")
+	parser.add_argument('-monitor', type=float, default=MONITOR_INTERVAL, help=f"Seconds between background battery and temperature samples, 0 disables (default {MONITOR_INTERVAL:g})")
+	parser.add_argument('-lowvoltage', type=float, default=LOW_VOLTAGE, help=f"Battery voltage below which power is capped automatically (default {LOW_VOLTAGE}V)")
+	parser.add_argument('-hottemp', type=float, default=HOT_TEMPERATURE, help=f"Hub temperature above which power is capped automatically (default {HOT_TEMPERATURE:g}C)")
+	parser.add_argument('-discovery', choices=["cache", "refresh", "off"], default="cache", help="Port and mode information: cache (default) discovers once per hub firmware/hardware version, refresh discovers again, off uses the built-in formats")
+	parser.add_argument('-remote', help="Accept UDP control packets from remote operators on [host:]port (default host 0.0.0.0, port 7777)")
+	parser.add_argument('-rate', type=int, default=250, help="Sample rate in Hz for -input event and -input process (default 250)")
 	args = parser.parse_args()
 
 	debug = args.debug
+	if args.debuglog:
+		debug_log = DebugLog(open(args.debuglog, 'w'), timestamps=True)
 	if args.power is not None:
 		powerlimit = args.power
+	input_mode = args.input
+	input_rate = max(1, args.rate)
+	drive_mode = args.drive
+	telemetry_ports = args.telemetry
+	record_path = args.record
+	stats_path = args.stats
+	macro_path = args.macro
+	macro_report_path = args.macroreport
+	steering_mode = args.steering
+	discovery_mode = args.discovery
+	stability_rate = max(100, args.stability) if args.stability > 0 else 0
+	monitor_interval = max(0.0, args.monitor)
+	low_voltage = args.lowvoltage
+	hot_temperature = args.hottemp
+	if args.remote is not None:
+		host, _, port = args.remote.rpartition(':')
+		if not host and not port.isdigit():
+			host, port = port, "" # only a host given
+		remote_address = (host or "0.0.0.0", int(port) if port else DEFAULT_PORT)
+	shaper_options = {'power_slew': max(0, args.powerslew), 'steering_slew': max(0, args.steerslew), 'steering_scale': args.steerscale}
+	create_drive(InputShaper(powerlimit, **shaper_options))
+	fleet_mode = args.fleet
+	device_address = args.address
+	use_device_cache = not args.nocache
+	auto_reconnect = not args.noreconnect
+	fleet_group = args.group
+	telemetry_delta = max(1, args.telemetrydelta)
 
-	asyncio.run(main())
+	try:
+		asyncio.run(main())
+	finally:
+		debug_log.close() # writes the lines still queued
 
 #todo telemetry
 #todo fix stalling drive motor on low power and fast steering inputs + drive direction changes
@@ -0,0 +1,85 @@
+import asyncio
+import argparse
+import time
+from utils.lwp3_definitions import *
+from utils.session_recorder import *
+from utils.simulated_hub import SimulatedClient
+
+STALL_POWER = 30 # drive power (%) below which the motors are known to stall
+
+def signed(byte):
+	return byte - 256 if byte >= 128 else byte
+
+def drive_power(frame):
+	# power of drive motor 2 from a separate motor frame or a combined virtual port frame, None for other frames
+	if len(frame) != 8 or frame[2] != PORT_OUTPUT_COMMAND:
+		return None
+	if frame[3] == PORT_DRIVE_MOTOR_2 and frame[5] == PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT:
+		return signed(frame[7])
+	if frame[5] == PORT_OUTPUT_SUBCOMMAND_START_POWER2:
+		return signed(frame[7])
+	return None
+
+def print_summary(records):
+	counts = {}
+	ports = {}
+	for record_type, timestamp, payload in records:
+		counts[record_type] = counts.get(record_type, 0) + 1
+		if record_type == RECORD_FRAME_OUT and len(payload) > 3:
+			ports[payload[3]] = ports.get(payload[3], 0) + 1
+	duration = records[-1][1] - records[0][1] if records else 0
+	print(f"Session: {len(records)} records over {duration:.2f}s ({', '.join(f'{RECORD_NAMES[t]} {c}' for t, c in sorted(counts.items()))})")
+	if duration > 0:
+		print(f"Writes/sec: {counts.get(RECORD_FRAME_OUT, 0) / duration:.1f}")
+	for port, count in sorted(ports.items()):
+		print(f"  port 0x{port:02x}: {count} frames")
+
+	# Drive power history, where direction changes and low power updates cause stalls
+	powers = [power for record_type, timestamp, payload in records if record_type == RECORD_FRAME_OUT for power in (drive_power(payload),) if power is not None and power != 0x7F]
+	reversals = sum(1 for previous, power in zip(powers, powers[1:]) if previous * power < 0)
+	low_power = sum(1 for power in powers if 0 < abs(power) < STALL_POWER)
+	print(f"Drive updates: {len(powers)}, direct direction changes: {reversals}, updates below {STALL_POWER}% power: {low_power}")
+
+async def replay(records, fast, write_latency):
+	client = SimulatedClient(write_latency=write_latency)
+	frames = [(timestamp, payload) for record_type, timestamp, payload in records if record_type == RECORD_FRAME_OUT]
+	if not frames:
+		print("No outgoing frames to replay")
+		return
+	first = frames[0][0]
+	start = time.monotonic()
+	lateness = []
+	for timestamp, payload in frames:
+		if not fast:
+			delay = (timestamp - first) - (time.monotonic() - start)
+			if delay > 0:
+				await asyncio.sleep(delay)
+			lateness.append(time.monotonic() - start - (timestamp - first))
+		await client.write_gatt_char(CHARACTERISTIC_UUID, payload, response=payload[2] != PORT_OUTPUT_COMMAND)
+	elapsed = time.monotonic() - start
+	recorded = frames[-1][0] - first
+	print(f"Replayed {len(frames)} frames in {elapsed:.3f}s (recorded {recorded:.3f}s, {len(frames) / elapsed if elapsed else 0:.0f} frames/s)")
+	if lateness:
+		lateness.sort()
+		print(f"Replay lateness p50 {lateness[len(lateness) // 2] * 1000:.2f}ms, max {lateness[-1] * 1000:.2f}ms")
+	skew = sorted(client.motor_skew())
+	if skew:
+		print(f"Drive motor skew on simulated hub: p50 {skew[len(skew) // 2] * 1000:.2f}ms, max {skew[-1] * 1000:.2f}ms")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Replay and analyse a LEGO Porsche Controller session log")
+	parser.add_argument('log', help="Session log written with -record")
+	parser.add_argument('-fast', action='store_true', help="Replay as fast as possible instead of in real time")
+	parser.add_argument('-latency', type=float, default=0.0, help="Simulated hub write latency in ms")
+	parser.add_argument('-export', help="Export the session to NumPy arrays (.npz)")
+	parser.add_argument('-noreplay', action='store_true', help="Only print the summary")
+	args = parser.parse_args()
+
+	records = list(read_session(args.log))
+	print_summary(records)
+	if not args.noreplay:
+		asyncio.run(replay(records, args.fast, args.latency / 1000))
+	if args.export:
+		import numpy as np
+		np.savez(args.export, **session_to_arrays(args.log))
+		print(f"Exported arrays to {args.export}")
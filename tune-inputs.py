@@ -0,0 +1,61 @@
+import argparse
+import itertools
+import time
+from utils.vehicle_simulator import DEFAULT_CONFIG, TOP_SPEED, MAX_WHEEL_ANGLE, random_traces, session_traces, simulate, rank
+
+# command line option -> InputShaper option, the defaults are a small grid around the controller's defaults
+GRID_OPTIONS = (
+	('powerlimit', 'powerlimit', int, "100"),
+	('deadzone', 'power_deadzone', int, "15,20,25,30"),
+	('powercurve', 'power_curve', float, "1"),
+	('powerslew', 'power_slew', int, "0,150,300"),
+	('steerlimit', 'steering_limit', int, "88,94"),
+	('steercurve', 'steering_curve', float, "1"),
+	('steerscale', 'steering_scale', lambda value: bool(int(value)), "0"),
+	('steerslew', 'steering_slew', int, "0,400"),
+)
+
+def parse_grid(args):
+	axes = [(option, [cast(value) for value in getattr(args, name).split(',')]) for name, option, cast, default in GRID_OPTIONS]
+	return [dict(zip((option for option, values in axes), combination)) for combination in itertools.product(*(values for option, values in axes))]
+
+def describe(config):
+	changed = [f"{option}={value}" for option, value in config.items() if DEFAULT_CONFIG[option] != value]
+	return ", ".join(changed) or "controller defaults"
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Score input shaping configurations against the batched vehicle simulator")
+	parser.add_argument('log', nargs='*', help="Session logs written with -record, their joystick traces replace the random ones")
+	parser.add_argument('-traces', type=int, default=500, help="Random joystick traces (default 500)")
+	parser.add_argument('-duration', type=float, default=10.0, help="Random trace length in s (default 10)")
+	parser.add_argument('-seed', type=int, default=1, help="Random seed for the traces")
+	for name, option, cast, default in GRID_OPTIONS:
+		parser.add_argument(f'-{name}', default=default, help=f"Comma separated values of {option} (default {default})")
+	parser.add_argument('-rate', type=int, default=100, help="Joystick sample rate in Hz (default 100)")
+	parser.add_argument('-latency', type=float, default=7.5, help="BLE write latency in ms (default 7.5)")
+	parser.add_argument('-separate', action='store_true', help="Two drive motor frames per update instead of the virtual port")
+	parser.add_argument('-top', type=int, default=10, help="Configurations listed (default 10)")
+	args = parser.parse_args()
+
+	configs = parse_grid(args)
+	traces = session_traces(args.log, args.rate) if args.log else random_traces(args.traces, args.duration, args.rate, args.seed)
+	if traces is None:
+		raise SystemExit("No joystick snapshots in the session logs")
+	count, samples = traces['steering'].shape
+	duration = samples / args.rate
+	print(f"{count} joystick traces of {duration:g}s x {len(configs)} configurations, {args.rate} Hz input, {args.latency:g}ms write latency")
+	start = time.perf_counter()
+	result = simulate(traces, configs, args.rate, args.latency / 1000, 2 if args.separate else 1)
+	elapsed = time.perf_counter() - start
+	print(f"Simulated {count * len(configs) * duration:.0f}s of driving in {elapsed:.2f}s ({count * len(configs) * duration / elapsed:.0f}x real time)")
+	print("Score: tracking error (% of speed at the power limit + % of wheel angle) + stall and write penalties, lower is better")
+	ranking = rank(configs, result)
+	defaults = next((position for position, (score, index) in enumerate(ranking) if configs[index] == DEFAULT_CONFIG), None)
+	for position, (score, index) in enumerate(ranking):
+		if position >= args.top and position != defaults:
+			continue
+		speed = result['speed_error'][:, index].mean() / TOP_SPEED * 100
+		angle = result['angle_error'][:, index].mean() / MAX_WHEEL_ANGLE * 100
+		stalls = result['stalls'][:, index].mean() / duration * 60
+		writes = result['writes_per_s'][:, index].mean()
+		print(f"{position + 1:4}. score {score:6.1f}: speed error {speed:4.1f}%, wheel angle error {angle:4.1f}%, {stalls:5.1f} stalls/min, {writes:5.1f} writes/s - {describe(configs[index])}")
@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import deque
+from utils.lwp3_definitions import *
+
+# Priority lanes, lower lane is always written first
+LANE_CRITICAL = 0 # brake and stop frames
+LANE_DRIVE = 1 # PLAYVM steering/lights and drive motor power
+LANE_BACKGROUND = 2 # cabin lights, hub led, telemetry and other requests
+
+DRIVE_PORTS = (PORT_PLAYVM, PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2)
+MOTOR_BRAKE = 0x7F
+MOTOR_STOP = 0x00
+
+def frame_port(frame):
+	# Port byte of port related messages, None for hub wide messages
+	if len(frame) >= 4 and frame[2] in (PORT_OUTPUT_COMMAND, PORT_INPUT_COMMAND, PORT_INPUT_INFORMATION_REQUEST):
+		return frame[3]
+	return None
+
+def frame_key(frame):
+	# Frames with the same key replace each other while waiting to be sent
+	port = frame_port(frame)
+	if port is not None:
+		if frame[2] == PORT_INPUT_INFORMATION_REQUEST and len(frame) >= 5:
+			return (frame[2], port, frame[4]) # value, mode and combination requests of one port ask different things
+		return (frame[2], port)
+	if len(frame) >= 4 and frame[2] == HUB_PROPERTY:
+		return (HUB_PROPERTY, frame[3])
+	return bytes(frame) # unknown frames are only merged with identical ones
+
+class CommandScheduler:
+	def __init__(self, write, without_response=True, metrics=None):
+		# write is a coroutine function write(data, response) returning True on success
+		# metrics is an optional LatencyStats getting queued and written timestamps of every frame
+		self.write = write
+		self.metrics = metrics
+		self.without_response = without_response
+		self.lanes = [{}, {}, {}]
+		self.wakeup = asyncio.Event()
+		self.idle = asyncio.Event()
+		self.idle.set()
+		self.motor_ports = {PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2}
+		self.drive_ports = set(DRIVE_PORTS)
+		self.stats = {'queued': 0, 'written': 0, 'coalesced': 0, 'dropped': 0, 'failed': 0}
+		self.latencies = deque(maxlen=2000) # input timestamp -> write completed, seconds
+
+	def add_motor_port(self, port):
+		# e.g. a virtual port combining both drive motors
+		self.motor_ports.add(port)
+		self.drive_ports.add(port)
+		if self.metrics is not None:
+			self.metrics.add_drive_port(port)
+
+	def classify(self, frame):
+		port = frame_port(frame)
+		if frame[2] == PORT_OUTPUT_COMMAND and port in self.motor_ports and len(frame) >= 8:
+			if all(power in (MOTOR_BRAKE, MOTOR_STOP) for power in frame[7:]):
+				return LANE_CRITICAL
+		if port in self.drive_ports:
+			return LANE_DRIVE
+		return LANE_BACKGROUND
+
+	def submit(self, frame, lane=None, stamp=None):
+		# stamp is the monotonic time of the input that produced this frame
+		if lane is None:
+			lane = self.classify(frame)
+		key = frame_key(frame)
+		self.stats['queued'] += 1
+		for index, pending in enumerate(self.lanes):
+			if key in pending:
+				if index == lane:
+					self.stats['coalesced'] += 1
+				else:
+					# newer frame for the same port in another lane makes the old one stale
+					del pending[key]
+					self.stats['dropped'] += 1
+		queued = time.monotonic()
+		if self.metrics is not None:
+			self.metrics.record_queued(frame, stamp, queued)
+		self.lanes[lane][key] = (frame, stamp, queued)
+		self.idle.clear()
+		self.wakeup.set()
+
+	def clear(self, lanes=(LANE_CRITICAL, LANE_DRIVE, LANE_BACKGROUND)):
+		for lane in lanes:
+			self.stats['dropped'] += len(self.lanes[lane])
+			self.lanes[lane].clear()
+		if not self.pending():
+			self.idle.set()
+
+	def pending(self):
+		return sum(len(pending) for pending in self.lanes)
+
+	def pop(self):
+		for pending in self.lanes:
+			if pending:
+				key = next(iter(pending))
+				return pending.pop(key)
+		return (None, None, None)
+
+	def uses_response(self, frame):
+		# The hub accepts write without response for output commands, requests still need the reply
+		return not (self.without_response and frame[2] == PORT_OUTPUT_COMMAND)
+
+	async def flush(self):
+		await self.idle.wait()
+
+	async def run(self, stop_event):
+		while not stop_event.is_set():
+			frame, stamp, queued = self.pop()
+			if frame is None:
+				self.idle.set()
+				self.wakeup.clear()
+				try:
+					await asyncio.wait_for(self.wakeup.wait(), 0.1) # timeout only to notice stop_event
+				except asyncio.TimeoutError:
+					pass
+				continue
+			if await self.write(frame, self.uses_response(frame)):
+				self.stats['written'] += 1
+				written = time.monotonic()
+				if stamp is not None:
+					self.latencies.append(written - stamp)
+				if self.metrics is not None:
+					self.metrics.record_written(frame, stamp, queued, written)
+			else:
+				self.stats['failed'] += 1
+		self.idle.set()
+
+	def print_stats(self):
+		print(f"Scheduler: queued {self.stats['queued']}, written {self.stats['written']}, coalesced {self.stats['coalesced']}, dropped {self.stats['dropped']}, failed {self.stats['failed']}, pending {self.pending()}")
+
+	def print_latency(self, label=""):
+		if not self.latencies:
+			print(f"Input-to-write latency{label}: no samples yet")
+			return
+		samples = sorted(self.latencies)
+		p50 = samples[len(samples) // 2] * 1000
+		p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000
+		print(f"Input-to-write latency{label}: p50 {p50:.1f}ms, p95 {p95:.1f}ms, max {samples[-1] * 1000:.1f}ms ({len(samples)} samples)")
+
+class SchedulerGroup:
+	# Shared scheduling for several hubs on one loop, every hub keeps its own lanes and writer
+	# so a slow link or a busy car never delays the frames of another car
+	def __init__(self):
+		self.schedulers = []
+
+	def add(self, write, without_response=True, metrics=None):
+		scheduler = CommandScheduler(write, without_response, metrics)
+		self.schedulers.append(scheduler)
+		return scheduler
+
+	def pending(self):
+		return sum(scheduler.pending() for scheduler in self.schedulers)
+
+	async def flush(self):
+		await asyncio.gather(*(scheduler.flush() for scheduler in self.schedulers))
+
+	async def run(self, stop_event):
+		await asyncio.gather(*(scheduler.run(stop_event) for scheduler in self.schedulers))
+
+	def print_stats(self):
+		for index, scheduler in enumerate(self.schedulers):
+			print(f"[{index}] ", end="")
+			scheduler.print_stats()
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+REBOOT_WINDOW = 5.0 # guess when the hub can't be asked: a link back within this time is treated as a glitch
+RESTART_CHECK_TIMEOUT = 1.0 # s to wait for the hub to confirm a command on a port from before the drop
+
+class ConnectionSupervisor:
+	# Notices dropped links through bleak's disconnected callback and reconnects in the background
+	# reconnect() returns a connected client or None, restore(client, rebooted) brings the hub back to the controller state
+	# rebooted is a guess from the outage length, restore asks the hub where it can and returns what it found (None: the guess)
+	def __init__(self, reconnect, restore, lost=None, reboot_window=REBOOT_WINDOW, retry_delay=0.5):
+		self.reconnect = reconnect
+		self.restore = restore
+		self.lost = lost # called right after the drop, e.g. to discard queued drive frames
+		self.reboot_window = reboot_window
+		self.retry_delay = retry_delay
+		self.link_up = asyncio.Event()
+		self.link_up.set()
+		self.link_lost = asyncio.Event()
+		self.lost_at = None
+		self.closing = False
+		self.restoring = False
+		self.discarded = 0 # frames not sent while the link was down
+		self.recoveries = [] # (seconds to recover, rebooted)
+
+	def is_up(self):
+		return self.link_up.is_set()
+
+	def accepts(self, stamp=None):
+		# controller input frames (stamped) only go out while the link is up, restore frames also while restoring
+		return self.link_up.is_set() or (self.restoring and stamp is None)
+
+	def handle_disconnect(self, client=None):
+		# bleak disconnected_callback, also called for our own disconnect at exit
+		if self.closing or not self.link_up.is_set():
+			return
+		self.lost_at = time.monotonic()
+		self.link_up.clear()
+		self.link_lost.set()
+		if self.lost is not None:
+			self.lost()
+
+	def close(self):
+		self.closing = True
+
+	def discard(self):
+		self.discarded += 1
+
+	async def run(self, stop_event):
+		while not stop_event.is_set():
+			try:
+				await asyncio.wait_for(self.link_lost.wait(), 0.1) # timeout only to notice stop_event
+			except asyncio.TimeoutError:
+				continue
+			print("Connection lost, reconnecting...")
+			client = None
+			while client is None and not stop_event.is_set():
+				client = await self.reconnect()
+				if client is None:
+					await asyncio.sleep(self.retry_delay)
+			if client is None:
+				break
+			rebooted = time.monotonic() - self.lost_at > self.reboot_window
+			self.restoring = True
+			try:
+				checked = await self.restore(client, rebooted)
+			finally:
+				self.restoring = False
+			if checked is not None:
+				rebooted = checked
+			recovery = time.monotonic() - self.lost_at
+			self.recoveries.append((recovery, rebooted))
+			self.link_lost.clear()
+			self.link_up.set()
+			print(f"Reconnected in {recovery:.2f}s ({'full initialization, hub restarted' if rebooted else 'state restored'})")
+
+	def print_stats(self):
+		if not self.recoveries:
+			print(f"Connection: no drops{f', {self.discarded} frames discarded' if self.discarded else ''}")
+			return
+		times = [recovery for recovery, rebooted in self.recoveries]
+		print(f"Connection: {len(times)} drops, recovery last {times[-1]:.2f}s, max {max(times):.2f}s, {self.discarded} stale frames discarded")
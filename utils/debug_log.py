@@ -0,0 +1,83 @@
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG_LOG_CAPACITY = 4096 # records waiting for the writer, newer records are dropped when it is full
+WRITER_INTERVAL = 0.02 # s between writer passes
+
+def format_line(format, args):
+	try:
+		if callable(format):
+			return format(*args)
+		return format.format(*(arg.hex() if isinstance(arg, (bytes, bytearray)) else arg for arg in args))
+	except Exception as e:
+		return f"debug log format error {e!r}: {format!r} {args!r}"
+
+class DebugLog:
+	# Hot path appends (time, format, args) tuples, a writer thread formats them and writes in batches
+	# format is a str.format string or a callable returning the line, bytes arguments are written as hex
+	# deque append/popleft are atomic, so the control loop never takes a lock or waits on terminal I/O
+	def __init__(self, output=None, capacity=DEBUG_LOG_CAPACITY, timestamps=False, interval=WRITER_INTERVAL):
+		self.output = output
+		self.capacity = capacity
+		self.timestamps = timestamps
+		self.interval = interval
+		self.records = deque()
+		self.logged = 0
+		self.dropped = 0
+		self.reported_dropped = 0
+		self.written = 0
+		self.start = time.monotonic()
+		self.thread = None
+		self.stopping = threading.Event()
+
+	def log(self, format, *args):
+		if len(self.records) >= self.capacity:
+			self.dropped += 1
+			return
+		self.records.append((time.monotonic(), format, args))
+		self.logged += 1
+		if self.thread is None:
+			self.start_writer()
+
+	def start_writer(self):
+		self.thread = threading.Thread(target=self.run, name="debug-log", daemon=True)
+		self.thread.start()
+
+	def format_record(self, stamp, format, args):
+		line = format_line(format, args)
+		if self.timestamps:
+			return f"{stamp - self.start:10.4f} {line}"
+		return line
+
+	def drain(self):
+		lines = []
+		while self.records:
+			stamp, format, args = self.records.popleft()
+			lines.append(self.format_record(stamp, format, args))
+		if self.dropped != self.reported_dropped:
+			lines.append(f"debug log: {self.dropped - self.reported_dropped} records dropped, writer fell behind")
+			self.reported_dropped = self.dropped
+		if lines:
+			output = self.output or sys.stdout
+			output.write("\n".join(lines) + "\n")
+			output.flush()
+			self.written += len(lines)
+
+	def run(self):
+		while not self.stopping.wait(self.interval):
+			self.drain()
+		self.drain()
+
+	def close(self):
+		# writes what is still queued, called at exit
+		if self.thread is not None:
+			self.stopping.set()
+			self.thread.join()
+			self.thread = None
+		if self.output is not None and self.output is not sys.stdout:
+			self.output.close()
+
+	def print_stats(self):
+		print(f"Debug log: {self.logged} records, {self.written} lines written, {self.dropped} dropped, {len(self.records)} waiting")
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import time
+from utils.lwp3_definitions import *
+
+DEVICE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".lego-porsche-controller-devices.json")
+
+class DeviceCache:
+	# Known hub addresses with metadata, the most recently connected hub is tried directly on the next launch
+	# an address that can't be reached that way is dropped, the scan adds it again once the hub advertises
+	def __init__(self, path=DEVICE_CACHE_PATH):
+		self.path = path
+		self.devices = {} # address -> {'name', 'last_connected', 'connects'}
+		try:
+			with open(path) as file:
+				self.devices = json.load(file)
+		except (OSError, ValueError):
+			pass
+
+	def addresses(self, address=None):
+		known = sorted(self.devices, key=lambda known_address: self.devices[known_address].get('last_connected', 0), reverse=True)
+		if address is not None:
+			return [known_address for known_address in known if known_address.upper() == address.upper()]
+		return known
+
+	def remember(self, address, name):
+		entry = self.devices.setdefault(address, {'connects': 0})
+		entry['name'] = name
+		entry['last_connected'] = time.time()
+		entry['connects'] = entry.get('connects', 0) + 1
+		self.save()
+
+	def forget(self, address):
+		if self.devices.pop(address, None) is not None:
+			self.save()
+
+	def save(self):
+		try:
+			with open(self.path, 'w') as file:
+				json.dump(self.devices, file, indent=2)
+		except OSError as e:
+			print(f"Failed to save device cache {self.path}: {e}")
+
+def advertisement_matches(device, advertisement_data, name, address=None):
+	# address picks one car among several, otherwise any hub advertising the name or the LWP3 service
+	if address is not None:
+		return device.address.upper() == address.upper()
+	if device.name == name or getattr(advertisement_data, 'local_name', None) == name:
+		return True
+	return SERVICE_UUID in (getattr(advertisement_data, 'service_uuids', None) or ())
+
+async def find_device(name, address=None, timeout=10.0, scanner_class=None, exclude=()):
+	# Returns the first matching device as soon as its advertisement arrives, None after timeout
+	# exclude: addresses to ignore, e.g. hubs a fleet is already connected to
+	if scanner_class is None:
+		from bleak import BleakScanner
+		scanner_class = BleakScanner
+	found = asyncio.get_running_loop().create_future()
+
+	def detected(device, advertisement_data):
+		if not found.done() and device.address not in exclude and advertisement_matches(device, advertisement_data, name, address):
+			found.set_result(device)
+
+	async with scanner_class(detection_callback=detected):
+		try:
+			return await asyncio.wait_for(found, timeout)
+		except asyncio.TimeoutError:
+			return None
+
+async def connect_client(client_class, address_or_device, timeout):
+	client = client_class(address_or_device)
+	try:
+		await client.connect(timeout=timeout)
+	except Exception as e:
+		return None, e
+	return client, None
+
+async def connect_hub(name, address=None, cache=None, max_attempts=10, scan_timeout=10.0, direct_timeout=3.0, connect_timeout=10.0, client_class=None, scanner_class=None, debug=False, exclude=()):
+	# The most recently connected address (or -address) is tried with a direct connect first, then the callback scan
+	# connects on the first advertisement. Only one direct connect: each unreachable address costs direct_timeout
+	# returns (client, seconds to connected) or (None, None)
+	if client_class is None:
+		from bleak import BleakClient
+		client_class = BleakClient
+	start = time.monotonic()
+	known = [known_address for known_address in cache.addresses(address) if known_address not in exclude][:1] if cache is not None else []
+	if address is not None and not known:
+		known = [address]
+	for known_address in known:
+		client, error = await connect_client(client_class, known_address, direct_timeout)
+		if client is not None:
+			if cache is not None:
+				cache.remember(known_address, cache.devices.get(known_address, {}).get('name', name))
+			print(f"Connected to known hub {known_address} in {time.monotonic() - start:.2f}s")
+			return client, time.monotonic() - start
+		if cache is not None:
+			cache.forget(known_address)
+		if debug:
+			print(f"Hub {known_address} not reachable directly: {error}")
+	for attempt in range(1, max_attempts + 1):
+		if debug:
+			print(f"Scan attempt {attempt}/{max_attempts}")
+		device = await find_device(name, address, scan_timeout, scanner_class, exclude)
+		if device is None:
+			if debug:
+				print("Device not found, retrying...")
+			continue
+		client, error = await connect_client(client_class, device, connect_timeout)
+		if client is not None:
+			if cache is not None:
+				cache.remember(device.address, device.name or name)
+			print(f"Connected to {device.address} in {time.monotonic() - start:.2f}s")
+			return client, time.monotonic() - start
+		print(f"Failed to connect: {error}")
+	print("Failed to connect after maximum attempts.")
+	return None, None
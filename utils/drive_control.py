@@ -0,0 +1,131 @@
+import time
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import playvm_drive_frame, CABIN_LIGHTS_FRAMES
+
+# Xbox controller layout
+AXIS_STEERING = 0
+AXIS_LEFT_TRIGGER = 4
+AXIS_RIGHT_TRIGGER = 5
+BUTTON_CABIN_LIGHTS = 1
+BUTTON_LIGHTS = 3
+BUTTON_BRAKE = 5
+
+class DriveControl:
+	# One car's joystick state: shaping, braking, light toggles and the drive frames they produce
+	# the single car controller and every fleet Car drive through it, frames go out through the owner's callbacks:
+	# queue(frame, stamp=None), set_drive_power(power byte 1, power byte 2, stamp) and ready() (False: link down, macro playing)
+	def __init__(self, shaper, queue, set_drive_power, ready):
+		self.shaper = shaper
+		self.queue = queue
+		self.set_drive_power = set_drive_power
+		self.ready = ready
+		self.last_power_input = 0
+		self.last_steering_input = 0
+		self.brakeapplied = False
+		self.lightsplayvmstate = PLAYVM_LIGHTS_OFF_OFF
+		self.last_lights_input = False
+		self.cabinlights = False
+		self.last_cabin_lights_input = False
+
+	def headlights_on(self):
+		return self.lightsplayvmstate in (PLAYVM_LIGHTS_ON_ON, PLAYVM_LIGHTS_ON_BRAKING)
+
+	def resend(self):
+		# the next update sends the stick position again, e.g. after a reconnect or a macro
+		self.last_power_input = 0
+		self.last_steering_input = 0
+
+	async def update(self, pad, pressed_buttons=(), released=False, stamp=None, now=None, steering=None, stability=None, log=None):
+		# pad: joystick snapshot (get_axis/get_button), pressed_buttons: buttons pressed since the last update,
+		# released: a button was released. steering is the SteeringController with closed-loop steering, stability the
+		# StabilityController, log(format, *args) the debug log
+		# drive power and steering, deadzones/limits/curves are lookup tables rebuilt only when power limit changes
+		power_input = int(((pad.get_axis(AXIS_RIGHT_TRIGGER)-pad.get_axis(AXIS_LEFT_TRIGGER)) * 100) / 2)
+		steering_input = int(pad.get_axis(AXIS_STEERING)*100)
+		power_input_modified, steering_input_modified = self.shaper.shape(power_input, steering_input, time.monotonic() if now is None else now)
+
+		# braking
+		brake_state_changed = False
+		brake_input = pad.get_button(BUTTON_BRAKE)
+		if brake_input and not self.brakeapplied:
+			brake_state_changed = True
+			self.brakeapplied = True
+		elif not brake_input and self.brakeapplied:
+			brake_state_changed = True
+			self.brakeapplied = False
+
+		# cabin lights on/off
+		cabin_lights_input = pad.get_button(BUTTON_CABIN_LIGHTS) or BUTTON_CABIN_LIGHTS in pressed_buttons # press and release can land in one batch
+		if pressed_buttons:
+			if cabin_lights_input and not self.last_cabin_lights_input:
+				if log:
+					log("cabin_lights_input and not last_cabin_lights_input")
+				self.last_cabin_lights_input = True
+				self.cabinlights = not self.cabinlights
+				if log:
+					log("Cabin lights changed to {}", self.cabinlights)
+				await self.queue(CABIN_LIGHTS_FRAMES[self.cabinlights], stamp=stamp)
+		if released and self.last_cabin_lights_input:
+			self.last_cabin_lights_input = False
+
+		# lights on/off
+		lights_state_changed = False
+		lights_input = pad.get_button(BUTTON_LIGHTS) or BUTTON_LIGHTS in pressed_buttons
+		if pressed_buttons:
+			if lights_input and not self.last_lights_input and steering is not None:
+				self.last_lights_input = True
+				print("Headlights can't be switched with closed-loop steering, they are set by PLAYVM frames which it doesn't send")
+			elif lights_input and not self.last_lights_input:
+				if log:
+					log("lights_input and not last_lights_input")
+				lights_state_changed = True
+				self.last_lights_input = True
+				if self.headlights_on():
+					self.lightsplayvmstate = PLAYVM_LIGHTS_OFF_OFF
+					if log:
+						log("Lights changed from LIGHTS_ON_ON to LIGHTS_OFF_OFF")
+				else:
+					self.lightsplayvmstate = PLAYVM_LIGHTS_ON_ON
+					if log:
+						log("Lights changed from LIGHTS_OFF_OFF to LIGHTS_ON_ON")
+		if released and self.last_lights_input:
+			self.last_lights_input = False
+
+		if log:
+			log("power_input: {} (modified: {}), steering_input: {} (modified: {}), brake_input: {}, lights_input: {}", power_input, power_input_modified, steering_input, steering_input_modified, brake_input, lights_input)
+
+		# Ignore power_input change for less than 5% of power limit and steering less than 3%
+		power_input_changed = False
+		steering_input_changed = False
+		if self.shaper.power_changed(self.last_power_input, power_input_modified):
+			power_input_changed = True
+			self.last_power_input = power_input_modified
+		if self.shaper.steering_changed(self.last_steering_input, steering_input_modified):
+			steering_input_changed = True
+			self.last_steering_input = steering_input_modified
+			if steering is not None:
+				steering.set_target(steering_input_modified)
+
+		lights = self.lightsplayvmstate
+		if brake_input and steering is None: # brake lights are part of the PLAYVM frame too
+			lights = PLAYVM_LIGHTS_ON_BRAKING if self.headlights_on() else PLAYVM_LIGHTS_OFF_BRAKING
+		# Send PLAYVM commands
+		if (power_input_changed or steering_input_changed or brake_state_changed or lights_state_changed) and self.ready():
+			drive_power, drive_steering = power_input_modified, steering_input_modified
+			if stability is not None:
+				# traction and yaw corrections of the stability loop, pass-through while it misses deadlines
+				drive_power, drive_steering = stability.adjust(power_input_modified, steering_input_modified, bool(brake_input))
+				if steering is not None:
+					steering.set_target(drive_steering)
+			if steering is None: # closed-loop steering owns the steering motor, PLAYVM's servo would pull it back to center
+				await self.queue(playvm_drive_frame(drive_steering, lights), stamp=stamp)
+			# Send drive motor power commands directly to get instant response
+			if not brake_input:
+				await self.set_drive_power(-drive_power&0xFF, drive_power&0xFF, stamp)
+			else: # engine braking # todo don't send when only lights or steering changed
+				await self.set_drive_power(0x7F, 0x7F, stamp)
+		elif log:
+			log("Drive commands ignored due to low input change, HUB disconnected or macro playing!")
+		if released:
+			self.last_cabin_lights_input = pad.get_button(BUTTON_CABIN_LIGHTS)
+			self.last_lights_input = pad.get_button(BUTTON_LIGHTS)
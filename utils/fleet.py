@@ -0,0 +1,166 @@
+import asyncio
+import time
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import *
+from utils.command_scheduler import SchedulerGroup
+from utils.response_dispatcher import ResponseDispatcher, LWP3Error
+from utils.virtual_port import connect_virtual_port
+from utils.input_shaping import InputShaper
+from utils.drive_control import DriveControl
+from utils.device_discovery import connect_hub
+from utils.latency_stats import LatencyStats
+
+class Car:
+	# Everything the single car mode keeps in module globals, one instance per hub
+	def __init__(self, client, index, powerlimit=100, drive_mode="virtual", shaper_options=None):
+		self.client = client
+		self.index = index
+		self.drive_mode = drive_mode
+		self.dispatcher = ResponseDispatcher()
+		self.metrics = LatencyStats()
+		self.scheduler = None # assigned by Fleet.add
+		self.virtual_port = None
+		self.battery_level = None
+		# shaping, brake and lights state, the same DriveControl the single car mode drives with
+		self.drive = DriveControl(InputShaper(powerlimit, **(shaper_options or {})), self.queue, self.set_drive_power, lambda: self.client.is_connected)
+
+	def name(self):
+		return f"Car {self.index} ({getattr(self.client, 'address', '?')})"
+
+	async def write(self, data, response=True):
+		try:
+			await self.client.write_gatt_char(CHARACTERISTIC_UUID, data, response=response)
+		except Exception as e:
+			print(f"{self.name()}: failed to write data {data.hex()}: {e}")
+			self.metrics.count_write(data, False)
+			return False
+		self.metrics.count_write(data)
+		return True
+
+	async def queue(self, data, stamp=None):
+		self.scheduler.submit(data, stamp=stamp)
+
+	async def request(self, command, key, timeout=None, accept=None, write=None):
+		try:
+			return await self.dispatcher.request(write or self.queue, command, key, timeout, accept)
+		except asyncio.TimeoutError:
+			print(f"{self.name()}: no reply to {command.hex()}")
+		except LWP3Error as e:
+			print(f"{self.name()}: request {command.hex()} failed: {e}")
+		return None
+
+	async def wait_completed(self, command):
+		# written directly, PLAYVM calibration frames must not be merged with drive frames
+		reply = await self.request(command, (MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK, command[3]), 3.0, lambda data: data[4] & (FEEDBACK_STATUS_COMPLETED | FEEDBACK_STATUS_DISCARDED) != 0, self.write)
+		return reply is not None
+
+	async def calibrate_steering(self):
+		if not await self.wait_completed(PLAYVM_COMMAND_FRAME):
+			return False
+		return await self.wait_completed(PLAYVM_CALIBRATE_STEERING_FRAME)
+
+	async def setup_virtual_port(self):
+		if self.drive_mode != "virtual":
+			return None
+		self.virtual_port = await connect_virtual_port(self.dispatcher, self.queue, PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2)
+		if self.virtual_port is not None:
+			self.scheduler.add_motor_port(self.virtual_port)
+		return self.virtual_port
+
+	async def initialize(self):
+		# same pipelined start as the single car mode, without the version requests
+		await self.dispatcher.start(self.client)
+		battery, led_done, calibrated, virtual_port = await asyncio.gather(
+			self.request(create_command(HUB_PROPERTY, HUB_PROPERTY_BATTERY_LEVEL, HUB_PROPERTY_OPERATION_REQUEST_UPDATE), (HUB_PROPERTY, HUB_PROPERTY_BATTERY_LEVEL)),
+			self.wait_completed(HUB_LED_GREEN_FRAME),
+			self.calibrate_steering(),
+			self.setup_virtual_port()
+		)
+		self.battery_level = battery[5] if battery is not None and len(battery) > 5 else None
+		await self.write(PLAYVM_LIGHTS_OFF_FRAME)
+		print(f"{self.name()}: battery {self.battery_level}%, {'steering calibrated' if calibrated else 'calibration not confirmed'}, {f'virtual port {virtual_port}' if virtual_port is not None else 'separate drive motors'}")
+
+	async def set_drive_power(self, power_byte_1, power_byte_2, stamp=None):
+		if self.virtual_port is not None:
+			await self.queue(combined_motor_frame(self.virtual_port, power_byte_1 & 0xFF, power_byte_2 & 0xFF), stamp)
+		else:
+			await self.queue(drive_motor_frame(PORT_DRIVE_MOTOR_1, power_byte_1), stamp)
+			await self.queue(drive_motor_frame(PORT_DRIVE_MOTOR_2, power_byte_2), stamp)
+
+	async def update(self, joystick, pressed_buttons=(), released=False, stamp=None):
+		# One control update from a joystick snapshot, lights toggle on button presses
+		shaped = time.monotonic()
+		self.metrics.record_shaped(stamp, shaped)
+		await self.drive.update(joystick, pressed_buttons, released, stamp, shaped)
+
+	async def disconnect(self):
+		await self.dispatcher.stop()
+		await self.client.disconnect()
+
+class Fleet:
+	# Several cars on one asyncio loop, joystick N drives car N or one joystick drives the whole group
+	def __init__(self):
+		self.cars = []
+		self.schedulers = SchedulerGroup()
+		self.controls = {} # joystick instance id -> (joystick, cars)
+
+	def add(self, car):
+		car.scheduler = self.schedulers.add(car.write, metrics=car.metrics)
+		self.cars.append(car)
+		return car
+
+	async def initialize(self):
+		await asyncio.gather(*(car.initialize() for car in self.cars))
+
+	def assign(self, joysticks, group=False):
+		# joysticks: initialized pygame joysticks (or anything with get_axis/get_button/get_instance_id)
+		self.controls = {}
+		if group and joysticks:
+			self.controls[joysticks[0].get_instance_id()] = (joysticks[0], list(self.cars))
+		else:
+			for joystick, car in zip(joysticks, self.cars):
+				self.controls[joystick.get_instance_id()] = (joystick, [car])
+		return sum(len(cars) for joystick, cars in self.controls.values())
+
+	async def handle_input(self, pressed, stamp=None, released=()):
+		# pressed: joystick instance id -> buttons pressed during the sampling interval, for every joystick that had events
+		# released: instance ids of joysticks with a button released in the interval, every car gets at most one update per interval
+		for instance_id, (joystick, cars) in self.controls.items():
+			buttons = pressed.get(instance_id)
+			for car in cars:
+				if buttons is not None or car.drive.shaper.settling():
+					await car.update(joystick, buttons or (), instance_id in released, stamp)
+
+	async def run(self, stop_event):
+		await self.schedulers.run(stop_event)
+
+	def set_power_limit(self, powerlimit):
+		for car in self.cars:
+			car.drive.shaper.set_power_limit(powerlimit)
+
+	def print_stats(self):
+		for car in self.cars:
+			print(f"{car.name()}:")
+			car.metrics.print_stats()
+		self.schedulers.print_stats()
+
+	async def disconnect(self):
+		await asyncio.gather(*(car.disconnect() for car in self.cars), return_exceptions=True)
+
+async def connect_fleet(name, cache=None, scan_timeout=5.0, client_class=None, scanner_class=None, **car_options):
+	# Hubs are connected one after another like the single car mode does it: the next cached address directly,
+	# then the first advertisement of a hub that isn't connected yet. Stops when a scan finds no new hub
+	fleet = Fleet()
+	addresses = set()
+	while True:
+		client = (await connect_hub(name, cache=cache, max_attempts=1, scan_timeout=scan_timeout, client_class=client_class, scanner_class=scanner_class, exclude=addresses))[0]
+		if client is None:
+			return fleet
+		addresses.add(client.address)
+		try:
+			await client.pair(protection_level=2)
+		except Exception as e:
+			print(f"Failed to pair with {client.address}: {e}")
+			await client.disconnect()
+			continue
+		fleet.add(Car(client, len(fleet.cars), **car_options))
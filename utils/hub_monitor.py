@@ -0,0 +1,141 @@
+import asyncio
+import time
+from collections import deque
+
+MONITOR_INTERVAL = 5.0 # seconds between samples
+HISTORY_LENGTH = 120 # samples kept per value, 10 minutes at the default interval
+LOW_VOLTAGE = 7.0 # V, the 2 cell pack under load
+CRITICAL_VOLTAGE_DROP = 0.4 # V below LOW_VOLTAGE
+HOT_TEMPERATURE = 50.0 # C
+CRITICAL_TEMPERATURE_RISE = 10.0 # C above HOT_TEMPERATURE
+VOLTAGE_HYSTERESIS = 0.2 # limits are only lifted once the value is this far back on the safe side
+TEMPERATURE_HYSTERESIS = 3.0
+VOLTAGE_WINDOW = 3 # samples averaged, a single sag during hard acceleration doesn't lower the limit
+LEVEL_POWER_LIMITS = (100, 60, 30) # power cap for ok, low/hot, critical
+
+class History:
+	# Latest values with their sample time, fixed length
+	def __init__(self, length=HISTORY_LENGTH):
+		self.samples = deque(maxlen=length)
+
+	def add(self, value, now):
+		self.samples.append((now, value))
+
+	def latest(self):
+		return self.samples[-1] if self.samples else (None, None)
+
+	def values(self, count=None):
+		values = [value for stamp, value in self.samples]
+		return values[-count:] if count else values
+
+	def mean(self, count=None):
+		values = self.values(count)
+		return sum(values) / len(values) if values else None
+
+def severity(value, thresholds, falling):
+	# number of thresholds crossed, thresholds ordered from warning to critical
+	return sum(1 for threshold in thresholds if (value < threshold if falling else value > threshold))
+
+def update_level(level, value, thresholds, hysteresis, falling):
+	# worse values take effect at once, better ones only after moving hysteresis past the threshold
+	raw = severity(value, thresholds, falling)
+	if raw >= level:
+		return raw
+	held = severity(value - hysteresis if falling else value + hysteresis, thresholds, falling)
+	return max(raw, min(level, held))
+
+class HubMonitor:
+	# Samples battery voltage, level and hub temperature in its own task, the requests go through the scheduler's background lane
+	# read_battery() -> (volts, level %), read_temperature() -> C, either may return None when the hub didn't answer
+	# on_limit(cap, reason) is called when the power cap changes, active() can pause sampling while the link is down
+	def __init__(self, read_battery, read_temperature, interval=MONITOR_INTERVAL, low_voltage=LOW_VOLTAGE, hot_temperature=HOT_TEMPERATURE, on_limit=None, active=None, clock=time.monotonic):
+		self.read_battery = read_battery
+		self.read_temperature = read_temperature
+		self.interval = interval
+		self.voltage_thresholds = (low_voltage, low_voltage - CRITICAL_VOLTAGE_DROP)
+		self.temperature_thresholds = (hot_temperature, hot_temperature + CRITICAL_TEMPERATURE_RISE)
+		self.on_limit = on_limit
+		self.active = active
+		self.clock = clock
+		self.voltage = History()
+		self.level = History()
+		self.temperature = History()
+		self.voltage_level = 0
+		self.temperature_level = 0
+		self.cap = 100
+		self.reason = None
+		self.samples = 0
+		self.missed = 0
+
+	async def sample(self):
+		(voltage, level), temperature = await asyncio.gather(self.read_battery(), self.read_temperature())
+		self.record(voltage, level, temperature)
+
+	def record(self, voltage, level, temperature):
+		now = self.clock()
+		if voltage is None and temperature is None:
+			self.missed += 1
+			return
+		self.samples += 1
+		if voltage is not None:
+			self.voltage.add(voltage, now)
+		if level is not None:
+			self.level.add(int(level), now)
+		if temperature is not None:
+			self.temperature.add(temperature, now)
+		self.evaluate()
+
+	def evaluate(self):
+		voltage = self.voltage.mean(VOLTAGE_WINDOW)
+		if voltage is not None:
+			self.voltage_level = update_level(self.voltage_level, voltage, self.voltage_thresholds, VOLTAGE_HYSTERESIS, True)
+		stamp, temperature = self.temperature.latest()
+		if temperature is not None:
+			self.temperature_level = update_level(self.temperature_level, temperature, self.temperature_thresholds, TEMPERATURE_HYSTERESIS, False)
+		cap = min(LEVEL_POWER_LIMITS[self.voltage_level], LEVEL_POWER_LIMITS[self.temperature_level])
+		reasons = []
+		if self.voltage_level:
+			reasons.append(f"battery {'critical' if self.voltage_level > 1 else 'low'} {voltage:.2f}V")
+		if self.temperature_level:
+			reasons.append(f"hub {'overheating' if self.temperature_level > 1 else 'hot'} {temperature:.1f}C")
+		reason = ", ".join(reasons) or None
+		if cap != self.cap:
+			self.cap = cap
+			self.reason = reason
+			if self.on_limit is not None:
+				self.on_limit(cap, reason)
+		else:
+			self.reason = reason
+
+	async def run(self, stop_event):
+		while not stop_event.is_set():
+			if self.active is None or self.active():
+				await self.sample()
+			try:
+				await asyncio.wait_for(stop_event.wait(), self.interval)
+			except asyncio.TimeoutError:
+				pass
+
+	def age(self, history):
+		stamp, value = history.latest()
+		return self.clock() - stamp if stamp is not None else None
+
+	def print_battery(self):
+		stamp, voltage = self.voltage.latest()
+		if voltage is None:
+			print("No battery sample yet")
+			return
+		stamp, level = self.level.latest()
+		values = self.voltage.values()
+		print(f"Battery voltage: {voltage:.3f}V [{level}%], {self.age(self.voltage):.0f}s ago, min {min(values):.3f}V max {max(values):.3f}V over {len(values)} samples")
+
+	def print_temperature(self):
+		stamp, temperature = self.temperature.latest()
+		if temperature is None:
+			print("No temperature sample yet")
+			return
+		values = self.temperature.values()
+		print(f"HUB temperature: {temperature:.1f}C, {self.age(self.temperature):.0f}s ago, min {min(values):.1f}C max {max(values):.1f}C over {len(values)} samples")
+
+	def print_status(self):
+		print(f"Hub monitor: every {self.interval:g}s, {self.samples} samples, {self.missed} missed, power cap {self.cap}%{f' ({self.reason})' if self.reason else ''}")
@@ -0,0 +1,204 @@
+import asyncio
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from utils.latency_stats import LatencyHistogram
+from utils.remote_gateway import RemoteJoystick, joystick_percentages, joystick_buttons
+
+# Joystick sampling in its own process at a fixed rate, the latest state goes to a shared memory slot guarded by a sequence number
+# The sampler makes the sequence odd, writes the state and makes it even again, the controller copies the state and retries
+# when the sequence was odd or changed meanwhile, so neither process ever waits for the other
+SEQUENCE = struct.Struct('<I')
+STATE = struct.Struct('<bbHdI') # power -100..100, steering -100..100, buttons bitmask, sample time (monotonic clock, same in both processes), samples taken
+STATE_OFFSET = SEQUENCE.size
+STATUS_OFFSET = 32 # written by the sampler
+STOP_OFFSET = 33 # written by the controller
+NAME_OFFSET = 40 # joystick name or the reason the sampler failed, utf-8
+NAME_SIZE = 88
+SLOT_SIZE = NAME_OFFSET + NAME_SIZE
+STATUS_STARTING = 0
+STATUS_RUNNING = 1
+STATUS_FAILED = 2
+READ_ATTEMPTS = 8
+START_TIMEOUT = 10.0 # s, the new process imports pygame before it samples
+POLL_RATE = 1000 # Hz, reading the slot costs a few us, polling at the sample rate would add up to a whole sample interval
+
+class InputSlot:
+	def __init__(self, buffer):
+		self.buffer = buffer
+		self.sequence = 0
+		self.retries = 0 # reads that caught the sampler writing
+
+	def publish(self, power, steering, buttons, stamp, samples):
+		self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+		SEQUENCE.pack_into(self.buffer, 0, self.sequence)
+		STATE.pack_into(self.buffer, STATE_OFFSET, power, steering, buttons, stamp, samples)
+		self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+		SEQUENCE.pack_into(self.buffer, 0, self.sequence)
+
+	def read(self):
+		# (sequence, power, steering, buttons, stamp, samples), None when every attempt overlapped a write
+		for attempt in range(READ_ATTEMPTS):
+			sequence = SEQUENCE.unpack_from(self.buffer, 0)[0]
+			if not sequence & 1:
+				state = STATE.unpack_from(self.buffer, STATE_OFFSET)
+				if SEQUENCE.unpack_from(self.buffer, 0)[0] == sequence:
+					return (sequence,) + state
+			self.retries += 1
+		return None
+
+	def status(self):
+		return self.buffer[STATUS_OFFSET]
+
+	def set_status(self, status):
+		self.buffer[STATUS_OFFSET] = status
+
+	def stop_requested(self):
+		return self.buffer[STOP_OFFSET] != 0
+
+	def request_stop(self):
+		self.buffer[STOP_OFFSET] = 1
+
+	def name(self):
+		return bytes(self.buffer[NAME_OFFSET:NAME_OFFSET + NAME_SIZE]).rstrip(b'\0').decode('utf-8', 'replace')
+
+	def set_name(self, name):
+		data = name.encode('utf-8')[:NAME_SIZE]
+		self.buffer[NAME_OFFSET:NAME_OFFSET + len(data)] = data
+
+class JoystickSource:
+	# pygame joystick opened in the sampling process, the controller process doesn't pump SDL events at all
+	def __init__(self, index=0):
+		os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+		import pygame
+		pygame.init()
+		pygame.joystick.init()
+		if pygame.joystick.get_count() <= index:
+			raise RuntimeError("No joystick found.")
+		self.pygame = pygame
+		self.joystick = pygame.joystick.Joystick(index)
+		self.joystick.init()
+		self.name = self.joystick.get_name()
+
+	def read(self):
+		self.pygame.event.pump()
+		power, steering = joystick_percentages(self.joystick)
+		return max(-100, min(100, power)), max(-100, min(100, steering)), joystick_buttons(self.joystick)
+
+def sample_inputs(memory_name, rate, source_class, source_args):
+	# Sampling process: reads the source every 1/rate s on absolute deadlines, publishes only changed states
+	memory = shared_memory.SharedMemory(memory_name)
+	slot = InputSlot(memory.buf)
+	try:
+		source = source_class(*source_args)
+	except Exception as e:
+		slot.set_name(str(e))
+		slot.set_status(STATUS_FAILED)
+		memory.close()
+		return
+	slot.set_name(getattr(source, 'name', ""))
+	slot.set_status(STATUS_RUNNING)
+	parent = multiprocessing.parent_process()
+	interval = 1 / rate
+	samples = 0
+	last = None
+	next_sample = time.monotonic()
+	try:
+		while not slot.stop_requested() and parent.is_alive():
+			sampled = time.monotonic()
+			state = source.read()
+			samples += 1
+			if state != last:
+				slot.publish(*state, sampled, samples)
+				last = state
+			next_sample = max(next_sample + interval, time.monotonic())
+			time.sleep(max(0.0, next_sample - time.monotonic()))
+	except KeyboardInterrupt:
+		pass # Ctrl+C reaches the whole process group, the controller stops the car
+	finally:
+		memory.close()
+
+class SampledJoystick(RemoteJoystick):
+	def __init__(self, name):
+		super().__init__()
+		self.name = name
+
+	def get_name(self):
+		return self.name
+
+class InputProcess:
+	# Controller side: starts the sampler, run() polls the slot and hands new states to handle(pad, pressed, released, stamp)
+	# idle(pad, now) runs on polls without a new state, e.g. to let slew limited outputs keep moving
+	def __init__(self, rate=250, poll_rate=None, source_class=JoystickSource, source_args=()):
+		self.rate = rate
+		self.poll_rate = poll_rate or max(rate, POLL_RATE)
+		self.source_class = source_class
+		self.source_args = source_args
+		self.memory = None
+		self.slot = None
+		self.process = None
+		self.pad = None
+		self.sequence = 0
+		self.updates = 0
+		self.coalesced = 0 # states replaced before the controller polled
+		self.samples = 0
+		self.pickup = LatencyHistogram() # sample -> handed to the controller
+
+	async def start(self):
+		# True once the sampler runs, False with the reason printed when it failed
+		self.memory = shared_memory.SharedMemory(create=True, size=SLOT_SIZE)
+		self.slot = InputSlot(self.memory.buf)
+		context = multiprocessing.get_context('spawn') # no fork of the event loop and bleak's threads
+		self.process = context.Process(target=sample_inputs, args=(self.memory.name, self.rate, self.source_class, self.source_args), name="input-sampler", daemon=True)
+		self.process.start()
+		start = time.monotonic()
+		while self.slot.status() == STATUS_STARTING and self.process.is_alive() and time.monotonic() - start < START_TIMEOUT:
+			await asyncio.sleep(0.01)
+		if self.slot.status() != STATUS_RUNNING:
+			reason = self.slot.name() if self.slot.status() == STATUS_FAILED else "sampler did not start"
+			print(f"Input process failed: {reason}")
+			self.close()
+			return False
+		self.pad = SampledJoystick(self.slot.name())
+		return True
+
+	async def run(self, handle, stop_event, idle=None):
+		interval = 1 / self.poll_rate
+		next_poll = time.monotonic()
+		while not stop_event.is_set():
+			state = self.slot.read()
+			if state is not None and state[0] != self.sequence:
+				sequence, power, steering, buttons, stamp, samples = state
+				if self.sequence:
+					self.coalesced += max(0, ((sequence - self.sequence) & 0xFFFFFFFF) // 2 - 1)
+				self.sequence = sequence
+				self.samples = samples
+				self.pickup.record(time.monotonic() - stamp)
+				pressed, released = self.pad.apply(power, steering, buttons)
+				await handle(self.pad, pressed, released, stamp)
+				self.updates += 1
+			elif idle is not None:
+				await idle(self.pad, time.monotonic())
+			next_poll = max(next_poll + interval, time.monotonic())
+			await asyncio.sleep(next_poll - time.monotonic())
+
+	def close(self):
+		if self.process is not None:
+			self.slot.request_stop()
+			self.process.join(1.0)
+			if self.process.is_alive():
+				self.process.terminate()
+			self.process = None
+		if self.memory is not None:
+			self.slot = None
+			self.memory.close()
+			self.memory.unlink()
+			self.memory = None
+
+	def print_stats(self):
+		name = self.pad.get_name() if self.pad is not None else "no joystick"
+		print(f"Input process ({name}): sampling at {self.rate} Hz, polled at {self.poll_rate} Hz, {self.samples} samples, {self.updates} states handled, {self.coalesced} coalesced")
+		if self.pickup.total:
+			print(f"  sample->handled p50 {self.pickup.milliseconds(50):.2f}ms p95 {self.pickup.milliseconds(95):.2f}ms max {self.pickup.maximum / 1000:.2f}ms")
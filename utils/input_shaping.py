@@ -0,0 +1,114 @@
+INPUT_RANGE = 100 # raw inputs are integer percentages -100..100
+MAX_SLEW_DT = 0.05 # after idle periods the ramp starts fresh instead of jumping to the target
+
+def apply_curve(raw, curve):
+	# curve > 1 gives finer control around center, 1 keeps the input linear
+	if curve == 1.0:
+		return raw
+	return int(INPUT_RANGE * (abs(raw) / INPUT_RANGE) ** curve) * (1 if raw >= 0 else -1)
+
+def build_power_table(powerlimit=100, deadzone=15, snap=95, curve=1.0):
+	# raw trigger difference -> drive power, limit is applied before deadzone/snapping like the original float code
+	table = []
+	for raw in range(-INPUT_RANGE, INPUT_RANGE + 1):
+		shaped = apply_curve(raw, curve)
+		power = int(shaped * (powerlimit * 0.01))
+		if abs(power) <= deadzone:
+			power = 0
+		elif power >= snap:
+			power = 100
+		elif power <= -snap:
+			power = -100
+		table.append(power)
+	return tuple(table)
+
+def build_steering_table(deadzone=2, limit=88, scale=False, curve=1.0):
+	# Prevent triggering overcurrent protection at max steering input - calibration by PLAYVM is not super precise
+	# limiting to 94% is enough to prevent overcurrent, 88 should be good to prevent stall
+	# scale=True maps the whole stick travel linearly onto 0-limit instead of clamping
+	table = []
+	for raw in range(-INPUT_RANGE, INPUT_RANGE + 1):
+		magnitude = abs(raw)
+		sign = 1 if raw >= 0 else -1
+		if magnitude <= deadzone:
+			steering = 0
+		elif scale:
+			steering = round(limit * ((magnitude - deadzone) / (INPUT_RANGE - deadzone)) ** curve) * sign
+		else:
+			steering = min(abs(apply_curve(raw, curve)), limit) * sign
+		table.append(steering)
+	return tuple(table)
+
+class InputShaper:
+	# Deadzones, curves and powerlimit compiled into lookup tables, plus slew-rate limiting per axis
+	def __init__(self, powerlimit=100, power_slew=0, steering_slew=0, power_curve=1.0, steering_curve=1.0, steering_scale=False, power_deadzone=15, steering_limit=88):
+		self.power_curve = power_curve
+		self.steering_curve = steering_curve
+		self.steering_scale = steering_scale
+		self.steering_table = build_steering_table(limit=steering_limit, scale=steering_scale, curve=steering_curve)
+		self.power_slew = power_slew # %/s, 0 disables
+		self.steering_slew = steering_slew
+		self.power_deadzone = power_deadzone
+		self.powerlimit = None
+		self.set_power_limit(powerlimit)
+		self.power = 0
+		self.steering = 0
+		self.power_target = 0
+		self.steering_target = 0
+		self.last_update = None
+		self.ramp_finished = False
+
+	def set_power_limit(self, powerlimit):
+		if powerlimit == self.powerlimit:
+			return
+		self.powerlimit = powerlimit
+		self.power_table = build_power_table(powerlimit, deadzone=self.power_deadzone, curve=self.power_curve)
+		# change thresholds follow the usable range, 5% of full power is too coarse at 25%
+		self.power_threshold = max(1, round(5 * powerlimit / 100))
+		self.steering_threshold = 3
+
+	def set_steering_limit(self, limit):
+		# closed-loop steering keeps the motor away from its end stops itself and gets the full range
+		self.steering_table = build_steering_table(limit=limit, scale=self.steering_scale, curve=self.steering_curve)
+
+	def shape(self, raw_power, raw_steering, now):
+		self.power_target = self.power_table[max(-INPUT_RANGE, min(INPUT_RANGE, raw_power)) + INPUT_RANGE]
+		self.steering_target = self.steering_table[max(-INPUT_RANGE, min(INPUT_RANGE, raw_steering)) + INPUT_RANGE]
+		return self.update(now)
+
+	def update(self, now):
+		# moves the outputs towards the targets, returns (power, steering)
+		dt = min(now - self.last_update, MAX_SLEW_DT) if self.last_update is not None else 0.0
+		self.last_update = now
+		was_settling = self.settling()
+		self.power = self.slew(self.power, self.power_target, self.power_slew, dt, self.power_deadzone + 1)
+		self.steering = self.slew(self.steering, self.steering_target, self.steering_slew, dt)
+		self.ramp_finished = was_settling and not self.settling()
+		return self.power, self.steering
+
+	def slew(self, value, target, rate, dt, floor=0):
+		# floor > 0 is used for drive power: direction changes pass through zero, reversing at speed stalls the motors,
+		# and power never ramps through the deadzone where the motors stall either
+		if not rate or value == target:
+			return target
+		step = max(1, int(rate * dt))
+		if floor and value * target < 0:
+			target = 0
+		if abs(target - value) <= step:
+			return target
+		value = value + step if target > value else value - step
+		if floor and 0 < abs(value) < floor:
+			# targets are never inside the deadzone, so jump to its edge when speeding up and to zero when stopping
+			value = 0 if target == 0 else (floor if target > 0 else -floor)
+		return value
+
+	def settling(self):
+		# True while slew limiting still has to move an output, the loop keeps updating without new events
+		return self.power != self.power_target or self.steering != self.steering_target
+
+	# Small changes are ignored, but stopping, full power and the end of a slew ramp are always sent
+	def power_changed(self, last, power):
+		return abs(power - last) >= self.power_threshold or (power != last and (power in (0, 100, -100) or self.ramp_finished))
+
+	def steering_changed(self, last, steering):
+		return abs(steering - last) >= self.steering_threshold or (steering != last and (steering == 0 or self.ramp_finished))
@@ -0,0 +1,172 @@
+import json
+import time
+from utils.lwp3_definitions import *
+
+# Log-linear buckets over microseconds like HdrHistogram: 16 sub-buckets per power of two, ~6% worst case error
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+BUCKET_COUNT = 30 * SUB_BUCKETS # covers up to ~2^30us (~18 minutes), longer samples land in the last bucket
+
+# Stages measured between the four timestamps of the hot path
+STAGE_SHAPED = "input->shaped" # joystick event arrival to deadzones/curves/slew applied
+STAGE_QUEUED = "input->queued" # event arrival to frame handed to the scheduler
+STAGE_WRITE = "queued->written" # time in the scheduler plus the GATT write itself
+STAGE_TOTAL = "input->written"
+STAGES = (STAGE_SHAPED, STAGE_QUEUED, STAGE_WRITE, STAGE_TOTAL)
+
+CATEGORY_PLAYVM = "playvm"
+CATEGORY_DRIVE = "drive" # drive motors and the virtual port combining them
+CATEGORY_LEDS = "leds" # 6 LEDs and hub LED
+CATEGORY_OTHER = "other"
+
+# write counters for messages other than port output commands
+MESSAGE_TYPE_NAMES = {
+	HUB_PROPERTY: "hub property",
+	PORT_INPUT_INFORMATION_REQUEST: "port information request",
+	PORT_INPUT_COMMAND: "port input format setup",
+	VIRTUAL_PORT_SETUP: "virtual port setup",
+}
+
+def bucket_index(microseconds):
+	if microseconds < 2 * SUB_BUCKETS:
+		return max(0, microseconds)
+	shift = microseconds.bit_length() - SUB_BUCKET_BITS - 1
+	return min(BUCKET_COUNT - 1, (shift << SUB_BUCKET_BITS) + (microseconds >> shift))
+
+def bucket_value(index):
+	# middle of the bucket, in microseconds
+	shift = max(0, (index >> SUB_BUCKET_BITS) - 1)
+	lowest = (index - (shift << SUB_BUCKET_BITS)) << shift
+	return lowest + ((1 << shift) - 1) / 2
+
+class LatencyHistogram:
+	# Fixed memory, recording is one index calculation and one increment
+	def __init__(self):
+		self.counts = [0] * BUCKET_COUNT
+		self.total = 0
+		self.maximum = 0
+
+	def record(self, seconds):
+		microseconds = int(seconds * 1000000)
+		self.counts[bucket_index(microseconds)] += 1
+		self.total += 1
+		if microseconds > self.maximum:
+			self.maximum = microseconds
+
+	def percentile(self, percent):
+		# seconds, None without samples
+		if not self.total:
+			return None
+		target = max(1, round(self.total * percent / 100))
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if seen >= target:
+				return min(bucket_value(index), self.maximum) / 1000000
+		return self.maximum / 1000000
+
+	def to_dict(self):
+		return {
+			'samples': self.total,
+			'p50_ms': self.milliseconds(50),
+			'p95_ms': self.milliseconds(95),
+			'p99_ms': self.milliseconds(99),
+			'max_ms': self.maximum / 1000,
+			'buckets_us': [[bucket_value(index), count] for index, count in enumerate(self.counts) if count],
+		}
+
+	def milliseconds(self, percent):
+		value = self.percentile(percent)
+		return value * 1000 if value is not None else None
+
+class LatencyStats:
+	# Always-on hot path instrumentation: per command type write counters and latency histograms per stage
+	def __init__(self):
+		self.start = time.monotonic()
+		self.drive_ports = {PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2}
+		self.histograms = {}
+		self.writes = {}
+		self.failures = {}
+
+	def add_drive_port(self, port):
+		self.drive_ports.add(port)
+
+	def category(self, frame):
+		if len(frame) < 4 or frame[2] != PORT_OUTPUT_COMMAND:
+			return CATEGORY_OTHER
+		port = frame[3]
+		if port == PORT_PLAYVM:
+			return CATEGORY_PLAYVM
+		if port in self.drive_ports:
+			return CATEGORY_DRIVE
+		if port in (PORT_6LEDS, PORT_HUB_LED):
+			return CATEGORY_LEDS
+		return CATEGORY_OTHER
+
+	def histogram(self, stage, category):
+		key = (stage, category)
+		histogram = self.histograms.get(key)
+		if histogram is None:
+			histogram = self.histograms[key] = LatencyHistogram()
+		return histogram
+
+	def record_shaped(self, stamp, now):
+		if stamp is not None:
+			self.histogram(STAGE_SHAPED, CATEGORY_OTHER).record(now - stamp)
+
+	def record_queued(self, frame, stamp, now):
+		if stamp is not None:
+			self.histogram(STAGE_QUEUED, self.category(frame)).record(now - stamp)
+
+	def record_written(self, frame, stamp, queued, now):
+		category = self.category(frame)
+		if queued is not None:
+			self.histogram(STAGE_WRITE, category).record(now - queued)
+		if stamp is not None:
+			self.histogram(STAGE_TOTAL, category).record(now - stamp)
+
+	def command_type(self, frame):
+		if len(frame) < 3:
+			return CATEGORY_OTHER
+		if frame[2] == PORT_OUTPUT_COMMAND:
+			return self.category(frame)
+		return MESSAGE_TYPE_NAMES.get(frame[2], CATEGORY_OTHER)
+
+	def count_write(self, frame, ok=True):
+		command_type = self.command_type(frame)
+		counters = self.writes if ok else self.failures
+		counters[command_type] = counters.get(command_type, 0) + 1
+
+	def elapsed(self):
+		return max(time.monotonic() - self.start, 1e-9)
+
+	def sorted_histograms(self):
+		# hot path order, then command type
+		return sorted(self.histograms.items(), key=lambda item: (STAGES.index(item[0][0]), item[0][1]))
+
+	def print_stats(self):
+		elapsed = self.elapsed()
+		total = sum(self.writes.values())
+		print(f"Writes: {total} in {elapsed:.1f}s ({total / elapsed:.1f}/s)")
+		for category, count in sorted(self.writes.items()):
+			failed = self.failures.get(category, 0)
+			print(f"  {category}: {count} ({count / elapsed:.1f}/s){f', {failed} failed' if failed else ''}")
+		if not self.histograms:
+			print("No latency samples yet")
+			return
+		for (stage, category), histogram in self.sorted_histograms():
+			print(f"  {stage} [{category}]: p50 {histogram.milliseconds(50):.1f}ms, p95 {histogram.milliseconds(95):.1f}ms, p99 {histogram.milliseconds(99):.1f}ms, max {histogram.maximum / 1000:.1f}ms ({histogram.total} samples)")
+
+	def to_dict(self):
+		elapsed = self.elapsed()
+		return {
+			'elapsed_s': elapsed,
+			'writes': dict(self.writes),
+			'failures': dict(self.failures),
+			'writes_per_s': sum(self.writes.values()) / elapsed,
+			'latency': {f"{stage} [{category}]": histogram.to_dict() for (stage, category), histogram in self.sorted_histograms()},
+		}
+
+	def dump(self, path):
+		with open(path, 'w') as file:
+			json.dump(self.to_dict(), file, indent=2)
@@ -0,0 +1,217 @@
+import struct
+from collections import namedtuple
+from utils.lwp3_definitions import *
+
+# Decoded records, payload fields are memoryview slices of the decoded buffer, so no copies
+ErrorRecord = namedtuple('ErrorRecord', 'command_type error_code')
+PortValueRecord = namedtuple('PortValueRecord', 'port value payload')
+FeedbackRecord = namedtuple('FeedbackRecord', 'port status more') # more: further (port, status) pairs of the same message
+HubPropertyRecord = namedtuple('HubPropertyRecord', 'property operation payload')
+PortInputFormatRecord = namedtuple('PortInputFormatRecord', 'port mode delta notify')
+HubAttachedIORecord = namedtuple('HubAttachedIORecord', 'port event io_type port_a port_b')
+UnknownRecord = namedtuple('UnknownRecord', 'message_type payload')
+
+PORT_STATUS = struct.Struct('<BB')
+PORT_INPUT_FORMAT = struct.Struct('<BBIB')
+HUB_ATTACHED_IO = struct.Struct('<BBHBB')
+INT32 = struct.Struct('<i')
+UINT16 = struct.Struct('<H')
+
+# Port value layout for the ports we know, other ports keep value None and the raw payload
+BUILTIN_PORT_VALUE_FORMATS = {
+	PORT_STEERING_MOTOR: INT32, # angle, deg
+	PORT_TEMPERATURE: UINT16, # 0.1C
+	PORT_VOLTAGE: UINT16, # mV
+}
+PORT_VALUE_FORMATS = dict(BUILTIN_PORT_VALUE_FORMATS)
+PORT_VALUE_LABELS = {} # port -> (mode name, unit symbol, decimals, (raw min, si min, factor) or None), from port discovery
+
+def set_port_value_format(port, value_format, label=None):
+	# layout reported by the hub for a port without a built-in format, value becomes a tuple for several datasets
+	if port not in BUILTIN_PORT_VALUE_FORMATS:
+		PORT_VALUE_FORMATS[port] = value_format
+		PORT_VALUE_LABELS[port] = label
+
+# Decoders get the buffer, a memoryview of it, the offset of the message and the message length
+# fields are read from the buffer (indexing bytes is cheaper than indexing a view), payloads are sliced from the view
+def decode_error(buffer, view, offset, length):
+	if length < 5:
+		return None
+	return ErrorRecord(buffer[offset + 3], buffer[offset + 4])
+
+def decode_port_value(buffer, view, offset, length):
+	port = buffer[offset + 3]
+	value_format = PORT_VALUE_FORMATS.get(port)
+	if value_format is not None and length - 4 == value_format.size:
+		values = value_format.unpack_from(buffer, offset + 4)
+		return PortValueRecord(port, values[0] if len(values) == 1 else values, view[offset + 4:offset + length])
+	return PortValueRecord(port, None, view[offset + 4:offset + length])
+
+def decode_feedback(buffer, view, offset, length):
+	if length < 5:
+		return None
+	if length < 7:
+		return FeedbackRecord(buffer[offset + 3], buffer[offset + 4], ())
+	return FeedbackRecord(buffer[offset + 3], buffer[offset + 4], tuple(PORT_STATUS.unpack_from(buffer, offset + pair) for pair in range(5, length - 1, 2)))
+
+def decode_hub_property(buffer, view, offset, length):
+	if length < 5:
+		return None
+	return HubPropertyRecord(buffer[offset + 3], buffer[offset + 4], view[offset + 5:offset + length])
+
+def decode_port_input_format(buffer, view, offset, length):
+	if length < 3 + PORT_INPUT_FORMAT.size:
+		return None
+	return PortInputFormatRecord(*PORT_INPUT_FORMAT.unpack_from(buffer, offset + 3))
+
+def decode_hub_attached_io(buffer, view, offset, length):
+	if length < 5:
+		return None
+	if length >= 3 + HUB_ATTACHED_IO.size:
+		port, event, io_type, port_a, port_b = HUB_ATTACHED_IO.unpack_from(buffer, offset + 3)
+		if event != HUB_ATTACHED_IO_ATTACHED_VIRTUAL:
+			port_a = port_b = None
+		return HubAttachedIORecord(port, event, io_type, port_a, port_b)
+	io_type = UINT16.unpack_from(buffer, offset + 5)[0] if length >= 7 else None
+	return HubAttachedIORecord(buffer[offset + 3], buffer[offset + 4], io_type, None, None)
+
+DECODERS = {
+	MESSAGE_TYPE_ERROR: decode_error,
+	MESSAGE_TYPE_PORT_VALUE: decode_port_value,
+	MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK: decode_feedback,
+	HUB_PROPERTY: decode_hub_property,
+	MESSAGE_TYPE_PORT_INPUT_FORMAT: decode_port_input_format,
+	MESSAGE_TYPE_HUB_ATTACHED_IO: decode_hub_attached_io,
+}
+
+def decode_frame(data):
+	# One LWP3 message (short length form), returns a record or None for truncated frames
+	size = len(data)
+	if size < 4:
+		return None
+	length = data[0]
+	if length > size:
+		length = size
+	message_type = data[2]
+	decoder = DECODERS.get(message_type)
+	if decoder is None:
+		return UnknownRecord(message_type, memoryview(data)[3:length])
+	return decoder(data, memoryview(data), 0, length)
+
+def decode_frames(buffer):
+	# Batch mode: decodes back-to-back length-prefixed messages from one buffer, payloads are views into it
+	# truncated messages are skipped, the batch stops at a length that runs past the end of the buffer
+	view = memoryview(buffer)
+	records = []
+	append = records.append
+	get = DECODERS.get
+	offset = 0
+	end = len(buffer)
+	while offset + 4 <= end:
+		length = buffer[offset]
+		if length < 3 or offset + length > end:
+			break
+		message_type = buffer[offset + 2]
+		decoder = get(message_type)
+		record = decoder(buffer, view, offset, length) if decoder is not None else UnknownRecord(message_type, view[offset + 3:offset + length])
+		if record is not None:
+			append(record)
+		offset += length
+	return records
+
+ERROR_COMMAND_NAMES = {PORT_OUTPUT_COMMAND: " Port Output Command", PORT_INPUT_COMMAND: " Port Input Command", ERROR_GENERIC: " Generic (wrong size??)"}
+ERROR_CODE_NAMES = {ERROR_COMMAND_NOT_RECOGNIZED: "->Command NOT recognized", ERROR_INVALID_USE: "->Invalid use (e.g. parameter error(s))"}
+
+def format_error(record):
+	name = ERROR_COMMAND_NAMES.get(record.command_type, "")
+	code = ERROR_CODE_NAMES.get(record.error_code, "") if record.command_type in (PORT_OUTPUT_COMMAND, PORT_INPUT_COMMAND) else ""
+	return f"[Error]{name}{code}"
+
+def format_feedback(record):
+	return f"[Port Output Command Feedback] Port {record.port} {'OK' if record.status == 0x0a else '??'}"
+
+def format_port_value(record):
+	text = f"[Port Value] Port {record.port}"
+	if record.value is None:
+		return text
+	if record.port == PORT_STEERING_MOTOR:
+		return f"{text} angle: {record.value}deg"
+	if record.port == PORT_TEMPERATURE:
+		return f"{text} temperature bytes: {record.payload.hex()} [{record.value / 10:.1f}C]"
+	if record.port == PORT_VOLTAGE:
+		return f"{text} voltage bytes: {record.payload.hex()} [{record.value / 1000:.3f}V]"
+	label = PORT_VALUE_LABELS.get(record.port)
+	if label is None:
+		return f"{text} {record.value}"
+	name, symbol, decimals, scale = label
+	values = record.value if isinstance(record.value, tuple) else (record.value,)
+	if scale is not None:
+		raw_min, si_min, factor = scale
+		values = [si_min + (value - raw_min) * factor for value in values]
+	return f"{text} {name}: {', '.join(f'{value:.{decimals}f}' for value in values)}{f' {symbol}' if symbol else ''}"
+
+def format_port_input_format(record):
+	return f"[Port Input subscribtion changed] Port {record.port}"
+
+FORMATTERS = {
+	ErrorRecord: format_error,
+	FeedbackRecord: format_feedback,
+	PortValueRecord: format_port_value,
+	PortInputFormatRecord: format_port_input_format,
+}
+
+def format_record(record):
+	formatter = FORMATTERS.get(type(record))
+	return formatter(record) if formatter is not None else ""
+
+# Text straight from the frame bytes for the 'read' command and debug output, the same text as format_record(decode_frame(data))
+# without building a record first: fixed parts are looked up per port/status, only values are formatted
+PORT_VALUE_PREFIXES = tuple(f"[Port Value] Port {port}" for port in range(256))
+FEEDBACK_TEXTS = tuple((f"[Port Output Command Feedback] Port {port} ??", f"[Port Output Command Feedback] Port {port} OK") for port in range(256))
+PORT_INPUT_FORMAT_TEXTS = tuple(f"[Port Input subscribtion changed] Port {port}" for port in range(256))
+ERROR_TEXTS = {(command_type, error_code): format_error(ErrorRecord(command_type, error_code)) for command_type in (PORT_OUTPUT_COMMAND, PORT_INPUT_COMMAND, ERROR_GENERIC) for error_code in range(256)}
+
+def text_error(data, length):
+	if length < 5:
+		return ""
+	text = ERROR_TEXTS.get((data[3], data[4]))
+	return text if text is not None else "[Error]"
+
+def text_feedback(data, length):
+	if length < 5:
+		return ""
+	return FEEDBACK_TEXTS[data[3]][data[4] == 0x0a]
+
+def text_port_value(data, length):
+	port = data[3]
+	if port == PORT_STEERING_MOTOR and length == 8:
+		return f"{PORT_VALUE_PREFIXES[port]} angle: {INT32.unpack_from(data, 4)[0]}deg"
+	if port == PORT_TEMPERATURE and length == 6:
+		return f"{PORT_VALUE_PREFIXES[port]} temperature bytes: {data[4:6].hex()} [{UINT16.unpack_from(data, 4)[0] / 10:.1f}C]"
+	if port == PORT_VOLTAGE and length == 6:
+		return f"{PORT_VALUE_PREFIXES[port]} voltage bytes: {data[4:6].hex()} [{UINT16.unpack_from(data, 4)[0] / 1000:.3f}V]"
+	if port in PORT_VALUE_LABELS or (port in PORT_VALUE_FORMATS and port not in BUILTIN_PORT_VALUE_FORMATS):
+		return format_port_value(decode_port_value(data, memoryview(data), 0, length))
+	return PORT_VALUE_PREFIXES[port]
+
+def text_port_input_format(data, length):
+	if length < 3 + PORT_INPUT_FORMAT.size:
+		return ""
+	return PORT_INPUT_FORMAT_TEXTS[data[3]]
+
+TEXT_FORMATTERS = {
+	MESSAGE_TYPE_ERROR: text_error,
+	MESSAGE_TYPE_PORT_VALUE: text_port_value,
+	MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK: text_feedback,
+	MESSAGE_TYPE_PORT_INPUT_FORMAT: text_port_input_format,
+}
+
+def format_frame(data):
+	size = len(data)
+	if size < 4:
+		return ""
+	formatter = TEXT_FORMATTERS.get(data[2])
+	if formatter is None:
+		return ""
+	length = data[0]
+	return formatter(data, length if length < size else size)
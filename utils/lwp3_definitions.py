@@ -63,14 +63,27 @@ HUB_PROPERTY_OPERATION_UPDATE = 0x06 #received
 
 # Commands
 MESSAGE_HEADER = 0x00
+MESSAGE_TYPE_HUB_ATTACHED_IO = 0x04
 MESSAGE_TYPE_ERROR = 0x05
+MESSAGE_TYPE_PORT_INFORMATION = 0x43
+MESSAGE_TYPE_PORT_MODE_INFORMATION = 0x44
 MESSAGE_TYPE_PORT_VALUE = 0x45
+MESSAGE_TYPE_PORT_INPUT_FORMAT = 0x47
 MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK = 0x82
 
 PORT_INPUT_INFORMATION_REQUEST = 0x21
+PORT_MODE_INFORMATION_REQUEST = 0x22
 PORT_INPUT_COMMAND = 0x41
 PORT_OUTPUT_COMMAND = 0x81
+PORT_OUTPUT_SUBCOMMAND_START_POWER2 = 0x02 # Power1, Power2 for the two motors of a virtual port
 PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT = 0x51
+VIRTUAL_PORT_SETUP = 0x61
+VIRTUAL_PORT_DISCONNECT = 0x00
+VIRTUAL_PORT_CONNECT = 0x01
+
+HUB_ATTACHED_IO_DETACHED = 0x00
+HUB_ATTACHED_IO_ATTACHED = 0x01
+HUB_ATTACHED_IO_ATTACHED_VIRTUAL = 0x02
 
 PORT_MODE_0 = 0x00
 PORT_MODE_1 = 0x01
@@ -83,6 +96,39 @@ FEEDBACK_ACTION_ACTION_COMPLETION = 0x01
 FEEDBACK_ACTION_ACTION_START = 0x10
 FEEDBACK_ACTION_BOTH = 0x11
 
+# Port output command feedback (0x82) status bits
+FEEDBACK_STATUS_IN_PROGRESS = 0x01
+FEEDBACK_STATUS_COMPLETED = 0x02
+FEEDBACK_STATUS_DISCARDED = 0x04
+FEEDBACK_STATUS_IDLE = 0x08
+FEEDBACK_STATUS_BUSY = 0x10
+
+# Port information request (0x21) types, answered with port value (0x45) or port information (0x43)
+PORT_INFORMATION_VALUE = 0x00
+PORT_INFORMATION_MODE_INFO = 0x01
+PORT_INFORMATION_COMBINATIONS = 0x02
+
+# Port information capability bits
+PORT_CAPABILITY_OUTPUT = 0x01
+PORT_CAPABILITY_INPUT = 0x02
+PORT_CAPABILITY_COMBINABLE = 0x04
+PORT_CAPABILITY_SYNCHRONIZABLE = 0x08
+
+# Port mode information request (0x22) types, answered with port mode information (0x44)
+MODE_INFORMATION_NAME = 0x00
+MODE_INFORMATION_RAW = 0x01
+MODE_INFORMATION_PCT = 0x02
+MODE_INFORMATION_SI = 0x03
+MODE_INFORMATION_SYMBOL = 0x04
+MODE_INFORMATION_MAPPING = 0x05
+MODE_INFORMATION_VALUE_FORMAT = 0x80
+
+# Value format dataset types
+DATASET_INT8 = 0x00
+DATASET_INT16 = 0x01
+DATASET_INT32 = 0x02
+DATASET_FLOAT = 0x03
+
 # Errors
 ERROR_GENERIC = 0x00
 ERROR_COMMAND_NOT_RECOGNIZED = 0x05
@@ -0,0 +1,63 @@
+from functools import lru_cache
+from utils.lwp3_definitions import *
+
+def create_command(*args):
+	command = bytes([len(args) + 2] + [MESSAGE_HEADER] + list(args))
+	return command
+
+def get_led_mask(led_states):
+	if len(led_states) != 6:
+		raise ValueError("There must be exactly 6 LED states provided.")
+
+	mask = 0
+	for index, state in enumerate(led_states):
+		if state:
+			mask |= (1 << index)
+	return mask
+
+# Hot path frames are encoded once at import and shared, bytes are immutable so the scheduler can keep them queued safely
+PLAYVM_LIGHTS_STATES = (PLAYVM_LIGHTS_ON_ON, PLAYVM_LIGHTS_ON_BRAKING, PLAYVM_LIGHTS_OFF_OFF, PLAYVM_LIGHTS_OFF_BRAKING)
+
+def build_playvm_frame(steering_byte, lights):
+	return create_command(PORT_OUTPUT_COMMAND, PORT_PLAYVM, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, 0x03, 0x00, 0x00, steering_byte, lights, 0x00)
+
+def build_motor_power_frame(channel, power_byte):
+	return create_command(PORT_OUTPUT_COMMAND, channel, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, power_byte)
+
+# PLAYVM drive frame for every steering byte x lights state
+PLAYVM_DRIVE_FRAMES = {lights: tuple(build_playvm_frame(steering_byte, lights) for steering_byte in range(256)) for lights in PLAYVM_LIGHTS_STATES}
+
+# 256 entry power table per motor channel, the steering motor is driven directly by closed-loop steering
+DRIVE_MOTOR_FRAMES = {channel: tuple(build_motor_power_frame(channel, power_byte) for power_byte in range(256)) for channel in (PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2, PORT_STEERING_MOTOR)}
+
+CABIN_LIGHTS_MASK = get_led_mask([1, 0, 0, 1, 0, 0])
+CABIN_LIGHTS_FRAMES = {on: create_command(PORT_OUTPUT_COMMAND, PORT_6LEDS, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, PORT_MODE_0, CABIN_LIGHTS_MASK, 100 if on else 0) for on in (False, True)}
+HUB_LED_GREEN_FRAME = create_command(PORT_OUTPUT_COMMAND, PORT_HUB_LED, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT, HUB_LED_MODE_COLOR, HUB_LED_COLOR_GREEN)
+PLAYVM_COMMAND_FRAME = build_playvm_frame(0x00, PLAYVM_COMMAND)
+PLAYVM_CALIBRATE_STEERING_FRAME = build_playvm_frame(0x00, PLAYVM_CALIBRATE_STEERING)
+PLAYVM_LIGHTS_OFF_FRAME = build_playvm_frame(0x00, PLAYVM_LIGHTS_OFF_OFF)
+
+def playvm_drive_frame(steering, lights):
+	# steering is the signed percentage (-100..100), lights one of PLAYVM_LIGHTS_STATES
+	return PLAYVM_DRIVE_FRAMES[lights][steering & 0xFF]
+
+def drive_motor_frame(channel, power_byte):
+	return DRIVE_MOTOR_FRAMES[channel][power_byte & 0xFF]
+
+@lru_cache(maxsize=1024)
+def combined_motor_frame(virtual_port, power_byte_1, power_byte_2):
+	# StartPower2(Power1, Power2) on a virtual port, both drive motors change in one write
+	return create_command(PORT_OUTPUT_COMMAND, virtual_port, FEEDBACK_ACTION_BOTH, PORT_OUTPUT_SUBCOMMAND_START_POWER2, power_byte_1 & 0xFF, power_byte_2 & 0xFF)
+
+def port_input_format_setup_frame(port, mode, delta=1, notify=True):
+	# Port Input Format Setup (Single), delta is the value change that triggers a notification
+	return create_command(PORT_INPUT_COMMAND, port, mode, delta & 0xFF, (delta >> 8) & 0xFF, (delta >> 16) & 0xFF, (delta >> 24) & 0xFF, 0x01 if notify else 0x00)
+
+def port_information_request_frame(port, information_type=PORT_INFORMATION_VALUE):
+	return create_command(PORT_INPUT_INFORMATION_REQUEST, port, information_type)
+
+def port_mode_information_request_frame(port, mode, information_type):
+	return create_command(PORT_MODE_INFORMATION_REQUEST, port, mode, information_type)
+
+def virtual_port_setup_frame(port_a, port_b):
+	return create_command(VIRTUAL_PORT_SETUP, VIRTUAL_PORT_CONNECT, port_a, port_b)
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import time
+from collections import namedtuple
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import *
+from utils.latency_stats import LatencyHistogram
+from utils.input_shaping import build_power_table, INPUT_RANGE
+
+# Macro scripts, one action per line, '#' starts a comment:
+#   power x          drive power -100..100, shaped like the trigger input: scaled by the power limit, deadzone and snapping
+#   steer x          steering -100..100, clamped to the same 88% as the joystick
+#   brake on|off     engine braking, brake lights follow the lights state
+#   lights on|off
+#   cabin on|off
+#   wait s           seconds until the next action
+#   at s             absolute time from the start of the macro
+#   rate hz          step rate of the following ramps (default 20)
+#   ramp power|steer from to s   linear trajectory, one step per 1/rate seconds
+# Everything is compiled into frames with target times before playback starts
+STEERING_LIMIT = 88
+DEFAULT_RAMP_RATE = 20
+START_DELAY = 0.01 # first deadline, leaves time for the first sleep so frame 0 isn't late by construction
+
+MacroStep = namedtuple('MacroStep', ['time', 'frame', 'label'])
+
+def clamp(value, limit):
+	return max(-limit, min(limit, int(round(value))))
+
+def parse_switch(value, line_number):
+	if value not in ("on", "off"):
+		raise ValueError(f"Line {line_number}: expected on or off, got '{value}'")
+	return value == "on"
+
+class MacroCompiler:
+	# Tracks the car state while reading the script, every state change becomes pre-encoded frames at its target time
+	# power_table is the controller's InputShaper.power_table, so a macro drives like the stick at the same power limit
+	# lights is the headlight state when the macro starts, the controller owns it and reads it back with played_lights()
+	def __init__(self, virtual_port=None, power_table=None, lights=False):
+		self.virtual_port = virtual_port
+		self.power_table = power_table if power_table is not None else build_power_table()
+		self.steps = []
+		self.time = 0.0
+		self.rate = DEFAULT_RAMP_RATE
+		self.power = 0
+		self.steering = 0
+		self.brake = False
+		self.lights = lights
+		self.sent = {} # port -> last frame, an action that doesn't change a port's frame adds nothing
+
+	def shaped_power(self, value):
+		return self.power_table[clamp(value, INPUT_RANGE) + INPUT_RANGE]
+
+	def lights_state(self):
+		if self.brake:
+			return PLAYVM_LIGHTS_ON_BRAKING if self.lights else PLAYVM_LIGHTS_OFF_BRAKING
+		return PLAYVM_LIGHTS_ON_ON if self.lights else PLAYVM_LIGHTS_OFF_OFF
+
+	def drive_frames(self):
+		frames = [playvm_drive_frame(self.steering, self.lights_state())]
+		power_byte_1, power_byte_2 = (0x7F, 0x7F) if self.brake else (-self.power & 0xFF, self.power & 0xFF)
+		if self.virtual_port is not None:
+			frames.append(combined_motor_frame(self.virtual_port, power_byte_1, power_byte_2))
+		else:
+			frames.append(drive_motor_frame(PORT_DRIVE_MOTOR_1, power_byte_1))
+			frames.append(drive_motor_frame(PORT_DRIVE_MOTOR_2, power_byte_2))
+		return frames
+
+	def emit(self, frame, label):
+		if self.sent.get(frame[3]) != frame:
+			self.sent[frame[3]] = frame
+			self.steps.append(MacroStep(self.time, frame, label))
+
+	def emit_drive(self, label):
+		for frame in self.drive_frames():
+			self.emit(frame, label)
+
+	def ramp(self, axis, start, end, seconds):
+		count = max(1, int(round(seconds * self.rate)))
+		begin = self.time
+		for index in range(count + 1):
+			value = start + (end - start) * index / count
+			self.time = begin + seconds * index / count
+			if axis == "power":
+				self.power = self.shaped_power(value)
+			else:
+				self.steering = clamp(value, STEERING_LIMIT)
+			self.emit_drive(f"ramp {axis} {value:.0f}")
+
+	def add_line(self, line, line_number):
+		parts = line.split('#', 1)[0].lower().split()
+		if not parts:
+			return
+		action, args = parts[0], parts[1:]
+		try:
+			if action == "power" and len(args) == 1:
+				self.power = self.shaped_power(float(args[0]))
+				self.emit_drive(f"power {self.power}")
+			elif action == "steer" and len(args) == 1:
+				self.steering = clamp(float(args[0]), STEERING_LIMIT)
+				self.emit_drive(f"steer {self.steering}")
+			elif action == "brake" and len(args) == 1:
+				self.brake = parse_switch(args[0], line_number)
+				self.emit_drive(f"brake {args[0]}")
+			elif action == "lights" and len(args) == 1:
+				self.lights = parse_switch(args[0], line_number)
+				self.emit_drive(f"lights {args[0]}")
+			elif action == "cabin" and len(args) == 1:
+				self.emit(CABIN_LIGHTS_FRAMES[parse_switch(args[0], line_number)], f"cabin {args[0]}")
+			elif action == "wait" and len(args) == 1:
+				self.time += max(0.0, float(args[0]))
+			elif action == "at" and len(args) == 1:
+				if float(args[0]) < self.time:
+					raise ValueError(f"Line {line_number}: 'at {args[0]}' is before the current time {self.time:.3f}s")
+				self.time = float(args[0])
+			elif action == "rate" and len(args) == 1 and float(args[0]) > 0:
+				self.rate = float(args[0])
+			elif action == "ramp" and len(args) == 4 and args[0] in ("power", "steer"):
+				self.ramp(args[0], float(args[1]), float(args[2]), max(0.0, float(args[3])))
+			else:
+				raise ValueError(f"Line {line_number}: unknown or incomplete action '{line.strip()}'")
+		except ValueError as e:
+			if str(e).startswith("Line "):
+				raise
+			raise ValueError(f"Line {line_number}: invalid number in '{line.strip()}'")
+
+	def finish(self):
+		# the car always ends stopped, also when the script forgets to
+		if self.power != 0 or self.brake:
+			self.power = 0
+			self.brake = False
+			self.emit_drive("stop")
+		self.steps.sort(key=lambda step: step.time) # stable, frames of one action keep their order
+		return self.steps
+
+def compile_macro(lines, virtual_port=None, power_table=None, lights=False):
+	compiler = MacroCompiler(virtual_port, power_table, lights)
+	for line_number, line in enumerate(lines, 1):
+		compiler.add_line(line, line_number)
+	return compiler.finish()
+
+def load_macro(path, virtual_port=None, power_table=None, lights=False):
+	with open(path) as file:
+		return compile_macro(file, virtual_port, power_table, lights)
+
+def played_lights(steps):
+	# (headlights, cabin lights) as the given steps left them, None for lights they don't switch
+	headlights = cabin = None
+	for step in steps:
+		if step.frame[3] == PORT_PLAYVM:
+			headlights = step.frame[11] in (PLAYVM_LIGHTS_ON_ON, PLAYVM_LIGHTS_ON_BRAKING)
+		elif step.frame in (CABIN_LIGHTS_FRAMES[False], CABIN_LIGHTS_FRAMES[True]):
+			cabin = step.frame == CABIN_LIGHTS_FRAMES[True]
+	return headlights, cabin
+
+class MacroPlayer:
+	# Writes compiled steps at absolute monotonic deadlines (start + step time), a late frame never shifts the ones after it
+	# write(frame, response) is the controller's GATT write, returns False on failure
+	# a stopped or cancelled macro leaves the motors to the caller, results tells how many steps were written
+	def __init__(self, write, response=False, clock=time.monotonic):
+		self.write = write
+		self.response = response
+		self.clock = clock
+		self.results = [] # (target seconds, lateness seconds, write seconds, label, ok)
+		self.lateness = LatencyHistogram()
+		self.write_time = LatencyHistogram()
+		self.duration = None
+
+	async def play(self, steps, stop_event=None):
+		self.results = []
+		self.lateness = LatencyHistogram()
+		self.write_time = LatencyHistogram()
+		start = self.clock() + START_DELAY
+		try:
+			for step in steps:
+				if stop_event is not None and stop_event.is_set():
+					break
+				deadline = start + step.time
+				delay = deadline - self.clock()
+				if delay > 0:
+					await asyncio.sleep(delay)
+				sent = self.clock()
+				ok = await self.write(step.frame, self.response)
+				written = self.clock()
+				lateness = sent - deadline # negative when the timer fires early, recorded as on time
+				self.lateness.record(max(0.0, lateness))
+				self.write_time.record(written - sent)
+				self.results.append((step.time, lateness, written - sent, step.label, ok))
+		finally:
+			self.duration = self.clock() - start
+		return self.results
+
+	def drift(self):
+		# lateness of the first frame at the final deadline, frames sharing a deadline queue behind each other
+		last = self.results[-1][0]
+		return next(lateness for target, lateness, write_time, label, ok in self.results if target == last)
+
+	def rate(self):
+		return len(self.results) / self.duration if self.duration else 0.0
+
+	def print_report(self, frames=False):
+		if not self.results:
+			print("No macro played")
+			return
+		if frames:
+			for target, lateness, write_time, label, ok in self.results:
+				print(f"{target:8.3f}s {lateness * 1000:+7.2f}ms write {write_time * 1000:6.2f}ms {label}{'' if ok else ' FAILED'}")
+		failed = sum(1 for result in self.results if not result[4])
+		print(f"Macro: {len(self.results)} frames in {self.duration:.2f}s ({self.rate():.0f}/s), {failed} failed")
+		print(f"Lateness vs deadline: p50 {self.lateness.milliseconds(50):.2f}ms p95 {self.lateness.milliseconds(95):.2f}ms p99 {self.lateness.milliseconds(99):.2f}ms max {self.lateness.maximum / 1000:.2f}ms, drift at the end {self.drift() * 1000:+.2f}ms")
+		print(f"GATT write time: p50 {self.write_time.milliseconds(50):.2f}ms p95 {self.write_time.milliseconds(95):.2f}ms max {self.write_time.maximum / 1000:.2f}ms")
+
+	def to_dict(self):
+		return {
+			'frames': len(self.results),
+			'duration_s': self.duration,
+			'rate': self.rate(),
+			'drift_ms': self.drift() * 1000 if self.results else None,
+			'lateness': self.lateness.to_dict(),
+			'write_time': self.write_time.to_dict(),
+			'results': [{'target_s': target, 'lateness_ms': lateness * 1000, 'write_ms': write_time * 1000, 'label': label, 'ok': ok} for target, lateness, write_time, label, ok in self.results],
+		}
+
+	def dump(self, path):
+		with open(path, 'w') as file:
+			json.dump(self.to_dict(), file, indent=2)
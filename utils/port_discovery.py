@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import struct
+from collections import namedtuple
+from functools import lru_cache
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import port_information_request_frame, port_mode_information_request_frame
+from utils.response_dispatcher import LWP3Error
+
+PORT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".lego-porsche-controller-ports.json")
+DISCOVERY_PORTS = range(PORT_DRIVE_MOTOR_1, PORT_HUB_LED + 1) # the hub's internal ports 0x32-0x3F
+DISCOVERY_TIMEOUT = 0.5 # s per request, a port that doesn't answer is treated as not attached
+MODE_INFORMATION_TYPES = (MODE_INFORMATION_NAME, MODE_INFORMATION_RAW, MODE_INFORMATION_PCT, MODE_INFORMATION_SI, MODE_INFORMATION_SYMBOL, MODE_INFORMATION_MAPPING, MODE_INFORMATION_VALUE_FORMAT)
+PORT_MODES = struct.Struct('<BBHH') # capabilities, mode count, input modes bitmask, output modes bitmask
+RANGE = struct.Struct('<ff')
+VALUE_FORMAT = struct.Struct('<BBBB')
+COMBINATION = struct.Struct('<H')
+DATASET_CODES = {DATASET_INT8: 'b', DATASET_INT16: 'h', DATASET_INT32: 'i', DATASET_FLOAT: 'f'}
+DATASET_NAMES = {DATASET_INT8: "int8", DATASET_INT16: "int16", DATASET_INT32: "int32", DATASET_FLOAT: "float"}
+
+ValueFormat = namedtuple('ValueFormat', 'datasets dataset_type figures decimals')
+# field order follows MODE_INFORMATION_TYPES, ranges are (min, max), fields the hub didn't answer are None
+ModeInfo = namedtuple('ModeInfo', 'name raw pct si symbol mapping value_format')
+PortInfo = namedtuple('PortInfo', 'capabilities mode_count input_modes output_modes combinations modes') # modes: mode -> ModeInfo
+
+def parse_text(payload):
+	return bytes(payload).split(b'\0', 1)[0].decode('ascii', 'replace')
+
+def parse_mode_information(information_type, payload):
+	if information_type in (MODE_INFORMATION_NAME, MODE_INFORMATION_SYMBOL):
+		return parse_text(payload)
+	if information_type in (MODE_INFORMATION_RAW, MODE_INFORMATION_PCT, MODE_INFORMATION_SI):
+		return RANGE.unpack_from(payload) if len(payload) >= RANGE.size else None
+	if information_type == MODE_INFORMATION_MAPPING:
+		return (payload[0], payload[1]) if len(payload) >= 2 else None
+	if information_type == MODE_INFORMATION_VALUE_FORMAT:
+		return ValueFormat(*VALUE_FORMAT.unpack_from(payload)) if len(payload) >= VALUE_FORMAT.size else None
+	return None
+
+@lru_cache(maxsize=64)
+def value_struct(value_format):
+	# struct for one port value message payload in this format, None for unknown dataset types
+	code = DATASET_CODES.get(value_format.dataset_type)
+	if code is None or value_format.datasets == 0:
+		return None
+	return struct.Struct(f'<{value_format.datasets}{code}')
+
+def si_scale(mode):
+	# (raw min, si min, factor) mapping raw values to SI units, None without usable ranges
+	if mode.raw is None or mode.si is None or mode.raw[1] == mode.raw[0]:
+		return None
+	return mode.raw[0], mode.si[0], (mode.si[1] - mode.si[0]) / (mode.raw[1] - mode.raw[0])
+
+def describe_mode(mode):
+	value_format = mode.value_format
+	layout = f"{value_format.datasets} x {DATASET_NAMES.get(value_format.dataset_type, '?')}" if value_format is not None else "format unknown"
+	unit = f" {mode.symbol}" if mode.symbol else ""
+	si = f" {mode.si[0]:g}..{mode.si[1]:g}{unit}" if mode.si is not None else unit
+	return f"{mode.name or '?'} ({layout}{si})"
+
+class PortCapabilities:
+	# Port -> PortInfo index from discovery or the cache, telemetry and the frame decoder look value formats up here
+	def __init__(self, ports=None):
+		self.ports = ports or {}
+
+	def mode(self, port, mode=PORT_MODE_0):
+		info = self.ports.get(port)
+		return info.modes.get(mode) if info is not None else None
+
+	def value_format(self, port, mode=PORT_MODE_0):
+		info = self.mode(port, mode)
+		return info.value_format if info is not None else None
+
+	def to_dict(self):
+		return {str(port): {
+			'capabilities': info.capabilities,
+			'mode_count': info.mode_count,
+			'input_modes': info.input_modes,
+			'output_modes': info.output_modes,
+			'combinations': list(info.combinations),
+			'modes': {str(mode): mode_info._asdict() for mode, mode_info in info.modes.items()},
+		} for port, info in self.ports.items()}
+
+	@classmethod
+	def from_dict(cls, data):
+		ports = {}
+		for port, info in data.items():
+			modes = {}
+			for mode, fields in info['modes'].items():
+				fields = {name: tuple(value) if isinstance(value, list) else value for name, value in fields.items()}
+				if fields.get('value_format') is not None:
+					fields['value_format'] = ValueFormat(*fields['value_format'])
+				modes[int(mode)] = ModeInfo(**fields)
+			ports[int(port)] = PortInfo(info['capabilities'], info['mode_count'], info['input_modes'], info['output_modes'], tuple(info['combinations']), modes)
+		return cls(ports)
+
+	def print_summary(self):
+		if not self.ports:
+			print("No port capabilities known")
+			return
+		for port, info in sorted(self.ports.items()):
+			kinds = "/".join(name for bit, name in ((PORT_CAPABILITY_INPUT, "input"), (PORT_CAPABILITY_OUTPUT, "output")) if info.capabilities & bit) or "?"
+			combinations = f", combinations {', '.join(f'0x{combination:04x}' for combination in info.combinations)}" if info.combinations else ""
+			modes = ", ".join(f"{mode}: {describe_mode(mode_info)}" for mode, mode_info in sorted(info.modes.items()))
+			print(f"Port 0x{port:02x} {kinds}{combinations}: {modes}")
+
+def decoder_formats(capabilities):
+	# (port, value struct, label) for the port value decoder, mode 0 is what an input port reports until set up otherwise
+	for port, info in sorted(capabilities.ports.items()):
+		mode = info.modes.get(PORT_MODE_0)
+		if not info.capabilities & PORT_CAPABILITY_INPUT or mode is None or mode.value_format is None:
+			continue
+		value_format = value_struct(mode.value_format)
+		if value_format is not None:
+			yield port, value_format, (mode.name, mode.symbol, mode.value_format.decimals, si_scale(mode))
+
+class PortCache:
+	# Discovered capabilities per hub firmware and hardware version, a known version skips discovery
+	def __init__(self, path=PORT_CACHE_PATH):
+		self.path = path
+		self.versions = {} # "fw x hw y" -> PortCapabilities.to_dict()
+		try:
+			with open(path) as file:
+				self.versions = json.load(file)
+		except (OSError, ValueError):
+			pass
+
+	def key(self, firmware, hardware):
+		return f"fw {firmware} hw {hardware}"
+
+	def get(self, firmware, hardware):
+		data = self.versions.get(self.key(firmware, hardware))
+		if data is None:
+			return None
+		try:
+			return PortCapabilities.from_dict(data)
+		except (KeyError, TypeError, ValueError):
+			return None # written by an older version, discovered again
+
+	def store(self, firmware, hardware, capabilities):
+		self.versions[self.key(firmware, hardware)] = capabilities.to_dict()
+		try:
+			with open(self.path, 'w') as file:
+				json.dump(self.versions, file, indent=2)
+		except OSError as e:
+			print(f"Failed to save port cache {self.path}: {e}")
+
+async def request_quietly(request, frame, key):
+	try:
+		return await request(frame, key, DISCOVERY_TIMEOUT)
+	except (asyncio.TimeoutError, LWP3Error):
+		return None
+
+async def discover_port(request, port):
+	reply = await request_quietly(request, port_information_request_frame(port, PORT_INFORMATION_MODE_INFO), (MESSAGE_TYPE_PORT_INFORMATION, port, PORT_INFORMATION_MODE_INFO))
+	if reply is None or len(reply) < 5 + PORT_MODES.size:
+		return None
+	capabilities, mode_count, input_modes, output_modes = PORT_MODES.unpack_from(reply, 5)
+	combinations = ()
+	if capabilities & PORT_CAPABILITY_COMBINABLE:
+		reply = await request_quietly(request, port_information_request_frame(port, PORT_INFORMATION_COMBINATIONS), (MESSAGE_TYPE_PORT_INFORMATION, port, PORT_INFORMATION_COMBINATIONS))
+		if reply is not None:
+			masks = [COMBINATION.unpack_from(reply, offset)[0] for offset in range(5, len(reply) - 1, 2)]
+			combinations = tuple(mask for mask in masks if mask)
+	# all mode requests of the port are in flight at once, replies are matched by port, mode and information type
+	# (the modes were just reported by the hub, so no error replies are expected here)
+	requests = [(mode, information_type) for mode in range(mode_count) for information_type in MODE_INFORMATION_TYPES]
+	replies = await asyncio.gather(*(request_quietly(request, port_mode_information_request_frame(port, mode, information_type), (MESSAGE_TYPE_PORT_MODE_INFORMATION, port, mode, information_type)) for mode, information_type in requests))
+	fields = {mode: {} for mode in range(mode_count)}
+	for (mode, information_type), reply in zip(requests, replies):
+		if reply is not None:
+			fields[mode][information_type] = parse_mode_information(information_type, reply[6:])
+	modes = {mode: ModeInfo(*(values.get(information_type) for information_type in MODE_INFORMATION_TYPES)) for mode, values in fields.items()}
+	return PortInfo(capabilities, mode_count, input_modes, output_modes, combinations, modes)
+
+async def discover_ports(request, ports=DISCOVERY_PORTS):
+	# request(frame, key, timeout) sends a request and returns the reply, e.g. partial(dispatcher.request, queue_command)
+	# ports are asked one after the other: error replies carry no port, an error for a port that isn't attached
+	# could otherwise fail another port's request
+	found = {}
+	for port in ports:
+		info = await discover_port(request, port)
+		if info is not None:
+			found[port] = info
+	return PortCapabilities(found)
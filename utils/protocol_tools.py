@@ -0,0 +1,121 @@
+import sys
+from utils.lwp3_frames import create_command, get_led_mask
+from utils.lwp3_decoder import decode_frame, format_record
+
+# Protocol helpers that need no car, pygame or bleak
+# Usage: python lego-porsche-controller.py tool <command> [args], or "tool -" to run one command per stdin line
+
+def normalize_angle(angle):
+	if angle >= 180:
+		return angle - (360 * ((angle + 180) // 360))
+	elif angle < -180:
+		return angle + (360 * ((180 - angle) // 360))
+	return angle
+
+def angle_to_bytes(angle):
+	a0 = angle & 0xff
+	a1 = (angle >> 8) & 0xff
+	a2 = (angle >> 16) & 0xff
+	a3 = (angle >> 24) & 0xff
+	return bytes([a0, a1, a2, a3])
+
+def bytes_to_angle(byte_array):
+	if len(byte_array) != 4:
+		raise ValueError("Byte array must be exactly 4 bytes long.")
+	angle = (byte_array[3] << 24) | (byte_array[2] << 16) | (byte_array[1] << 8) | byte_array[0]
+
+	# Handle negative values (32-bit signed integer)
+	if angle >= 0x80000000:
+		angle -= 0x100000000
+	return angle
+
+def is_integer(s):
+	if s[0] == '-':
+		return s[1:].isdigit()
+	return s.isdigit()
+
+def tool_angletobytes(parts):
+	if len(parts) == 2 and is_integer(parts[1]):
+		angle = int(parts[1])
+		anglebytes = angle_to_bytes(angle)
+		print(f"Angle {angle} bytes representation: {anglebytes.hex()}")
+	else:
+		print("Invalid angletobytes command. Usage: angletobytes angle (int)")
+
+def tool_bytestoangle(parts):
+	if len(parts) == 2:
+		try:
+			anglebytes = parts[1]
+			angle = bytes_to_angle(bytes.fromhex(anglebytes))
+			print(f"Angle bytes {anglebytes} int representation: {angle}")
+		except ValueError:
+			print("Invalid hex data format.")
+			print("Invalid bytestoangle command. Usage: bytestoangle angle (hex)")
+	else:
+		print("Invalid bytestoangle command. Usage: bytestoangle angle (hex)")
+
+def tool_getledmask(parts):
+	if len(parts) == 7 and all(part.isdigit() for part in parts[1:]):
+		led_states = [bool(int(arg)) for arg in parts[1:]]
+		mask = get_led_mask(led_states)
+		print(f"Generated LED mask: {mask:02x}")
+	else:
+		print("Invalid getledmask command. Usage example: getledmask 0 0 1 0 0 0")
+
+def tool_frame(parts):
+	# message type and payload bytes in hex, length and header are added like create_command does
+	try:
+		args = [int(part, 16) for part in parts[1:]]
+		print(create_command(*args).hex())
+	except ValueError:
+		print("Invalid frame command. Usage example: frame 81 36 11 51 00 03 00 00 00 04 00")
+
+def tool_decode(parts):
+	if len(parts) < 2:
+		print("Invalid decode command. Usage: decode frame (hex) [frame ...]")
+		return
+	for frame in parts[1:]:
+		try:
+			data = bytes.fromhex(frame)
+		except ValueError:
+			print(f"Invalid hex data format: {frame}")
+			continue
+		record = decode_frame(data)
+		if hasattr(record, 'payload'):
+			record = record._replace(payload=bytes(record.payload)) # a memoryview prints as <memory at ...>
+		print(f"{frame} {format_record(record) if record is not None else ''} {record!r}")
+
+TOOL_COMMANDS = {
+	"angletobytes": tool_angletobytes,
+	"bytestoangle": tool_bytestoangle,
+	"getledmask": tool_getledmask,
+	"frame": tool_frame,
+	"decode": tool_decode,
+}
+
+def run_tool_command(parts):
+	# parts: command and arguments, returns False for unknown commands
+	tool = TOOL_COMMANDS.get(parts[0]) if parts else None
+	if tool is None:
+		return False
+	tool(parts)
+	return True
+
+def main(argv):
+	if not argv or argv[0] in ("-h", "help"):
+		print(f"Tool commands: {', '.join(TOOL_COMMANDS)}, '-' reads one command per line from stdin")
+		return 0
+	if argv[0] == "-":
+		# one process for any number of commands, so tooling doesn't pay interpreter startup per call
+		for line in sys.stdin:
+			parts = line.lower().split()
+			if parts and not run_tool_command(parts):
+				print(f"Unknown tool command: {parts[0]}")
+		return 0
+	if not run_tool_command([part.lower() for part in argv]):
+		print(f"Unknown tool command: {argv[0]}")
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,257 @@
+import asyncio
+import struct
+import sys
+import time
+from utils.latency_stats import LatencyHistogram
+
+# UDP control packets from operators on other machines, the newest state wins and goes through the normal input path
+# control: magic, type, sequence, power -100..100, steering -100..100, buttons bitmask, sender clock (echoed back)
+# ack: magic, type, sequence, echoed sender clock, gateway receive->queued in us, link up, battery % (255 unknown)
+PACKET_MAGIC = b'LP'
+PACKET_CONTROL = 1
+PACKET_ACK = 2
+CONTROL_PACKET = struct.Struct('<2sBIbbHd')
+ACK_PACKET = struct.Struct('<2sBIdIBB')
+DEFAULT_PORT = 7777
+STALE_AFTER = 0.25 # a state that waited this long before the gateway got to it is dropped, the car gets the next one
+FAILSAFE_TIMEOUT = 0.5 # operators send continuously, this long without packets stops the car
+SEQUENCE_HALF_RANGE = 1 << 31
+RELEASED = -1.0 # trigger axis at rest
+BATTERY_UNKNOWN = 255
+
+def sequence_newer(sequence, last):
+	# 32 bit sequence numbers with wraparound, a restarted operator (sequence far behind) is accepted again
+	return last is None or 0 < (sequence - last) & 0xFFFFFFFF < SEQUENCE_HALF_RANGE
+
+def control_packet(sequence, power, steering, buttons=0, sent=None):
+	return CONTROL_PACKET.pack(PACKET_MAGIC, PACKET_CONTROL, sequence & 0xFFFFFFFF, power, steering, buttons, time.monotonic() if sent is None else sent)
+
+def axis_value(percentage):
+	# nudged half a percent away from zero so the controller's int() truncation gives back the exact percentage
+	return (percentage + (0.5 if percentage > 0 else -0.5 if percentage < 0 else 0)) / 100
+
+def joystick_percentages(joystick):
+	# same formulas as the controller input handling
+	return int(((joystick.get_axis(5) - joystick.get_axis(4)) * 100) / 2), int(joystick.get_axis(0) * 100)
+
+def joystick_buttons(joystick):
+	return sum(1 << button for button in range(min(16, joystick.get_numbuttons())) if joystick.get_button(button))
+
+class RemoteJoystick:
+	# Looks like a pygame joystick to the controller, axes 0 steering, 4 left trigger, 5 right trigger
+	def __init__(self):
+		self.axes = [0.0, 0.0, 0.0, 0.0, RELEASED, RELEASED]
+		self.buttons = 0
+
+	def apply(self, power, steering, buttons):
+		# returns (pressed, released) button numbers since the previous state
+		self.axes[0] = axis_value(steering)
+		self.axes[4] = RELEASED + 2 * axis_value(-power) if power < 0 else RELEASED
+		self.axes[5] = RELEASED + 2 * axis_value(power) if power > 0 else RELEASED
+		changed = self.buttons ^ buttons
+		pressed = {button for button in range(16) if changed & buttons & (1 << button)}
+		released = {button for button in range(16) if changed & self.buttons & (1 << button)}
+		self.buttons = buttons
+		return pressed, released
+
+	def get_axis(self, axis):
+		return self.axes[axis]
+
+	def get_button(self, button):
+		return (self.buttons >> button) & 1
+
+	def get_name(self):
+		return "Remote joystick"
+
+	def get_instance_id(self):
+		return -1
+
+class RemoteControlGateway(asyncio.DatagramProtocol):
+	# Packets only update the latest state in the receive callback, run() hands the newest one to handle()
+	# handle(joystick, pressed, released, stamp) is the controller's input path, status() returns (link up, battery %)
+	def __init__(self, handle, status=None, stale_after=STALE_AFTER, failsafe_timeout=FAILSAFE_TIMEOUT):
+		self.handle = handle
+		self.status = status
+		self.stale_after = stale_after
+		self.failsafe_timeout = failsafe_timeout
+		self.joystick = RemoteJoystick()
+		self.transport = None
+		self.address = None
+		self.ready = asyncio.Event()
+		self.latest = None # (sequence, power, steering, buttons, sender clock, received, address)
+		self.sequences = {} # operator address -> last accepted sequence
+		self.last_received = None
+		self.driving = False
+		self.received = 0
+		self.processed = 0
+		self.coalesced = 0 # replaced by a newer packet before the gateway got to it
+		self.out_of_order = 0
+		self.stale = 0
+		self.invalid = 0
+		self.failsafe_stops = 0
+		self.gateway_time = LatencyHistogram() # receive -> frames queued
+
+	async def start(self, host="0.0.0.0", port=DEFAULT_PORT):
+		await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, local_addr=(host, port))
+		self.address = self.transport.get_extra_info('sockname')
+		return self.address
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def datagram_received(self, data, address):
+		received = time.monotonic()
+		if len(data) != CONTROL_PACKET.size:
+			self.invalid += 1
+			return
+		magic, packet_type, sequence, power, steering, buttons, sent = CONTROL_PACKET.unpack(data)
+		if magic != PACKET_MAGIC or packet_type != PACKET_CONTROL or not -100 <= power <= 100 or not -100 <= steering <= 100:
+			self.invalid += 1
+			return
+		self.received += 1
+		if not sequence_newer(sequence, self.sequences.get(address)):
+			self.out_of_order += 1
+			return
+		self.sequences[address] = sequence
+		if self.latest is not None:
+			self.coalesced += 1
+		self.latest = (sequence, power, steering, buttons, sent, received, address)
+		self.last_received = received
+		self.ready.set()
+
+	def send_ack(self, sequence, sent, received, queued, address):
+		link_up, battery = self.status() if self.status is not None else (True, None)
+		gateway_us = min(0xFFFFFFFF, int((queued - received) * 1000000))
+		self.transport.sendto(ACK_PACKET.pack(PACKET_MAGIC, PACKET_ACK, sequence, sent, gateway_us, 1 if link_up else 0, BATTERY_UNKNOWN if battery is None else battery), address)
+
+	async def run(self, stop_event):
+		while not stop_event.is_set():
+			try:
+				await asyncio.wait_for(self.ready.wait(), 0.05) # timeout to notice stop_event and silent operators
+			except asyncio.TimeoutError:
+				if self.driving and time.monotonic() - self.last_received > self.failsafe_timeout:
+					# operator gone or link to it broken, don't keep driving on the last state
+					self.driving = False
+					self.failsafe_stops += 1
+					pressed, released = self.joystick.apply(0, 0, 0)
+					await self.handle(self.joystick, pressed, released, None)
+					print(f"No remote control packets for {self.failsafe_timeout}s, car stopped")
+				continue
+			self.ready.clear()
+			sequence, power, steering, buttons, sent, received, address = self.latest
+			self.latest = None
+			if time.monotonic() - received > self.stale_after:
+				self.stale += 1
+				continue
+			pressed, released = self.joystick.apply(power, steering, buttons)
+			await self.handle(self.joystick, pressed, released, received)
+			queued = time.monotonic()
+			self.processed += 1
+			self.driving = True
+			self.gateway_time.record(queued - received)
+			self.send_ack(sequence, sent, received, queued, address)
+
+	def close(self):
+		if self.transport is not None:
+			self.transport.close()
+
+	def print_stats(self):
+		host, port = self.address[:2] if self.address else ("-", "-")
+		print(f"Remote gateway {host}:{port}: {self.received} packets, {self.processed} processed, {self.coalesced} coalesced, {self.out_of_order} out of order, {self.stale} stale, {self.invalid} invalid, {self.failsafe_stops} failsafe stops")
+		if self.gateway_time.total:
+			print(f"  receive->queued p50 {self.gateway_time.milliseconds(50):.2f}ms p95 {self.gateway_time.milliseconds(95):.2f}ms max {self.gateway_time.maximum / 1000:.2f}ms")
+
+class RemoteControlClient(asyncio.DatagramProtocol):
+	# Operator side, send() once per sample, acks give round trip and gateway time plus the car's link and battery
+	def __init__(self):
+		self.transport = None
+		self.sequence = 0
+		self.sent = 0
+		self.acks = 0
+		self.round_trip = LatencyHistogram()
+		self.gateway_time = LatencyHistogram()
+		self.link_up = None
+		self.battery = None
+
+	async def connect(self, host, port=DEFAULT_PORT):
+		await asyncio.get_running_loop().create_datagram_endpoint(lambda: self, remote_addr=(host, port))
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def send(self, power, steering, buttons=0):
+		self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+		self.transport.sendto(control_packet(self.sequence, power, steering, buttons))
+		self.sent += 1
+
+	def datagram_received(self, data, address):
+		if len(data) != ACK_PACKET.size:
+			return
+		magic, packet_type, sequence, sent, gateway_us, link_up, battery = ACK_PACKET.unpack(data)
+		if magic != PACKET_MAGIC or packet_type != PACKET_ACK:
+			return
+		self.acks += 1
+		self.round_trip.record(time.monotonic() - sent)
+		self.gateway_time.record(gateway_us / 1000000)
+		self.link_up = bool(link_up)
+		self.battery = None if battery == BATTERY_UNKNOWN else battery
+
+	def error_received(self, error):
+		pass # gateway not running yet, ICMP port unreachable shows up here
+
+	def close(self):
+		if self.transport is not None:
+			self.transport.close()
+
+	def print_stats(self):
+		print(f"Sent {self.sent} packets, {self.acks} acks, car link {'up' if self.link_up else 'down' if self.link_up is not None else 'unknown'}, battery {self.battery if self.battery is not None else '?'}%")
+		if self.round_trip.total:
+			print(f"  round trip p50 {self.round_trip.milliseconds(50):.2f}ms p95 {self.round_trip.milliseconds(95):.2f}ms, gateway receive->queued p50 {self.gateway_time.milliseconds(50):.2f}ms p95 {self.gateway_time.milliseconds(95):.2f}ms")
+
+async def operate(host, port, rate):
+	# Drives a remote car with the local joystick, pygame is only needed on the operator machine
+	import os
+	os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+	import pygame
+	pygame.init()
+	pygame.joystick.init()
+	if pygame.joystick.get_count() == 0:
+		print("No joystick found.")
+		return 1
+	joystick = pygame.joystick.Joystick(0)
+	joystick.init()
+	client = RemoteControlClient()
+	await client.connect(host, port)
+	print(f"Sending {joystick.get_name()} to {host}:{port} at {rate} Hz, Ctrl+C to stop")
+	interval = 1 / rate
+	next_sample = time.monotonic()
+	last_report = next_sample
+	try:
+		while True:
+			pygame.event.pump()
+			power, steering = joystick_percentages(joystick)
+			buttons = joystick_buttons(joystick)
+			client.send(max(-100, min(100, power)), max(-100, min(100, steering)), buttons)
+			if next_sample - last_report >= 5.0:
+				client.print_stats()
+				last_report = next_sample
+			next_sample = max(next_sample + interval, time.monotonic())
+			await asyncio.sleep(next_sample - time.monotonic())
+	except (KeyboardInterrupt, asyncio.CancelledError):
+		pass
+	finally:
+		client.send(0, 0, 0)
+		client.print_stats()
+		client.close()
+	return 0
+
+if __name__ == "__main__":
+	# python -m utils.remote_gateway host[:port] [rate]
+	if len(sys.argv) < 2:
+		print("Usage: python -m utils.remote_gateway host[:port] [rate Hz]")
+		sys.exit(1)
+	host, _, port = sys.argv[1].partition(':')
+	try:
+		sys.exit(asyncio.run(operate(host, int(port) if port else DEFAULT_PORT, int(sys.argv[2]) if len(sys.argv) > 2 else 100)))
+	except KeyboardInterrupt:
+		pass
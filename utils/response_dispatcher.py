@@ -0,0 +1,142 @@
+import asyncio
+from collections import deque
+from utils.lwp3_definitions import *
+
+class LWP3Error(Exception):
+	def __init__(self, command_type, error_code):
+		super().__init__(f"Hub returned error 0x{error_code:02x} for command 0x{command_type:02x}")
+		self.command_type = command_type
+		self.error_code = error_code
+
+def response_key(data):
+	# Key used to match a notification with the request waiting for it
+	if len(data) < 4:
+		return None
+	message_type = data[2]
+	if message_type == HUB_PROPERTY:
+		return (HUB_PROPERTY, data[3])
+	if message_type == MESSAGE_TYPE_PORT_INFORMATION and len(data) >= 5:
+		return (MESSAGE_TYPE_PORT_INFORMATION, data[3], data[4])
+	if message_type == MESSAGE_TYPE_PORT_MODE_INFORMATION and len(data) >= 6:
+		return (MESSAGE_TYPE_PORT_MODE_INFORMATION, data[3], data[4], data[5])
+	if message_type == MESSAGE_TYPE_HUB_ATTACHED_IO and len(data) >= 9 and data[4] == HUB_ATTACHED_IO_ATTACHED_VIRTUAL:
+		return (MESSAGE_TYPE_HUB_ATTACHED_IO, data[7], data[8]) # virtual port is matched by the ports it combines
+	if message_type == MESSAGE_TYPE_ERROR:
+		return None # errors carry no port, they are matched by command type
+	return (message_type, data[3])
+
+def feedback_replies(data):
+	# Port output command feedback (0x82) can carry several (port, status) pairs, each port gets its own one-pair reply
+	for index in range(3, len(data) - 1, 2):
+		yield (MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK, data[index]), bytes((5, data[1], MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK, data[index], data[index + 1]))
+
+class ResponseDispatcher:
+	def __init__(self, timeout=2.0):
+		self.timeout = timeout
+		self.waiting = {} # response key -> [(future, request message type, accept)]
+		self.subscribers = [] # (callback, message types or None for all)
+		self.recent = deque(maxlen=32) # last frames, for the 'read' command
+		self.client = None
+
+	async def start(self, client):
+		self.client = client
+		await client.start_notify(CHARACTERISTIC_UUID, self.handle_notification)
+
+	async def stop(self):
+		if self.client is not None and self.client.is_connected:
+			try:
+				await self.client.stop_notify(CHARACTERISTIC_UUID)
+			except Exception:
+				pass
+		self.cancel_all()
+
+	def subscribe(self, callback, message_types=None):
+		# callback(data) is called for every notification with a matching message type
+		entry = (callback, message_types)
+		self.subscribers.append(entry)
+		return entry
+
+	def unsubscribe(self, entry):
+		if entry in self.subscribers:
+			self.subscribers.remove(entry)
+
+	def expect(self, key, request_type=None, accept=None):
+		# accept(data) can reject intermediate replies, e.g. 'in progress' feedback before 'completed'
+		future = asyncio.get_running_loop().create_future()
+		self.waiting.setdefault(key, []).append((future, request_type, accept))
+		return future
+
+	def forget(self, key, future):
+		waiters = self.waiting.get(key)
+		if waiters:
+			self.waiting[key] = [waiter for waiter in waiters if waiter[0] is not future]
+			if not self.waiting[key]:
+				del self.waiting[key]
+
+	async def request(self, write, frame, key, timeout=None, accept=None):
+		# write(frame) sends the request, the future is registered first so a fast reply can't be missed
+		future = self.expect(key, frame[2], accept)
+		try:
+			await write(frame)
+			return await asyncio.wait_for(future, timeout or self.timeout)
+		finally:
+			self.forget(key, future)
+
+	async def wait_for(self, key, timeout=None, accept=None):
+		future = self.expect(key, None, accept)
+		try:
+			return await asyncio.wait_for(future, timeout or self.timeout)
+		finally:
+			self.forget(key, future)
+
+	def handle_notification(self, sender, data):
+		data = bytes(data)
+		self.recent.append(data)
+		if len(data) < 3:
+			return
+		if len(data) >= 5 and data[2] == MESSAGE_TYPE_ERROR:
+			self.resolve_error(data[3], data[4])
+		elif data[2] == MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK and len(data) > 5:
+			for key, reply in feedback_replies(data):
+				self.resolve(key, reply)
+		else:
+			self.resolve(response_key(data), data)
+		for callback, message_types in list(self.subscribers):
+			if message_types is None or data[2] in message_types:
+				try:
+					callback(data)
+				except Exception as e:
+					print(f"Notification subscriber failed: {e}")
+
+	def resolve(self, key, data):
+		# one reply answers everybody waiting for the same key (e.g. a coalesced repeated request)
+		waiters = self.waiting.get(key)
+		if not waiters:
+			return
+		remaining = []
+		for future, request_type, accept in waiters:
+			if future.done():
+				continue
+			if accept is None or accept(data):
+				future.set_result(data)
+			else:
+				remaining.append((future, request_type, accept))
+		if remaining:
+			self.waiting[key] = remaining
+		else:
+			del self.waiting[key]
+
+	def resolve_error(self, command_type, error_code):
+		for key, waiters in self.waiting.items():
+			for index, (future, request_type, accept) in enumerate(waiters):
+				if request_type == command_type and not future.done():
+					future.set_exception(LWP3Error(command_type, error_code))
+					del waiters[index]
+					return
+
+	def cancel_all(self):
+		for waiters in self.waiting.values():
+			for future, request_type, accept in waiters:
+				if not future.done():
+					future.cancel()
+		self.waiting.clear()
@@ -0,0 +1,128 @@
+import mmap
+import os
+import struct
+import time
+
+# Session log: magic + version, then length-prefixed records (type, monotonic timestamp, payload length, payload)
+SESSION_MAGIC = b'LPSR'
+SESSION_VERSION = 1
+SESSION_HEADER = struct.Struct('<4sB')
+RECORD_HEADER = struct.Struct('<BdH')
+
+RECORD_FRAME_OUT = 1 # frame written to the LWP3 characteristic
+RECORD_NOTIFICATION = 2 # notification received from the hub
+RECORD_JOYSTICK = 3 # joystick snapshot
+
+# steering axis, left trigger, right trigger, button bits (1 brake, 2 lights, 4 cabin lights)
+JOYSTICK_SNAPSHOT = struct.Struct('<fffB')
+JOYSTICK_BRAKE = 0x01
+JOYSTICK_LIGHTS = 0x02
+JOYSTICK_CABIN_LIGHTS = 0x04
+
+RECORD_NAMES = {RECORD_FRAME_OUT: "out", RECORD_NOTIFICATION: "in", RECORD_JOYSTICK: "joystick"}
+
+class SessionRecorder:
+	# Appends records through a memory-mapped file that grows in chunks, so recording never blocks on file writes
+	def __init__(self, path, chunk_size=1 << 22):
+		self.path = path
+		self.chunk_size = chunk_size
+		self.file = open(path, 'w+b')
+		self.size = chunk_size
+		self.file.truncate(self.size)
+		self.map = mmap.mmap(self.file.fileno(), self.size)
+		SESSION_HEADER.pack_into(self.map, 0, SESSION_MAGIC, SESSION_VERSION)
+		self.offset = SESSION_HEADER.size
+		self.records = 0
+
+	def grow(self, needed):
+		while self.offset + needed > self.size:
+			self.size += self.chunk_size
+		self.map.flush()
+		self.map.close()
+		self.file.truncate(self.size)
+		self.map = mmap.mmap(self.file.fileno(), self.size)
+
+	def record(self, record_type, payload, timestamp=None):
+		if self.map is None:
+			return
+		length = len(payload)
+		needed = RECORD_HEADER.size + length
+		if self.offset + needed > self.size:
+			self.grow(needed)
+		RECORD_HEADER.pack_into(self.map, self.offset, record_type, time.monotonic() if timestamp is None else timestamp, length)
+		start = self.offset + RECORD_HEADER.size
+		self.map[start:start + length] = payload
+		self.offset = start + length
+		self.records += 1
+
+	def record_frame_out(self, data):
+		self.record(RECORD_FRAME_OUT, data)
+
+	def record_notification(self, data):
+		self.record(RECORD_NOTIFICATION, data)
+
+	def record_joystick(self, steering_axis, left_trigger, right_trigger, brake=False, lights=False, cabin_lights=False):
+		buttons = (JOYSTICK_BRAKE if brake else 0) | (JOYSTICK_LIGHTS if lights else 0) | (JOYSTICK_CABIN_LIGHTS if cabin_lights else 0)
+		self.record(RECORD_JOYSTICK, JOYSTICK_SNAPSHOT.pack(steering_axis, left_trigger, right_trigger, buttons))
+
+	def close(self):
+		if self.map is None:
+			return
+		self.map.flush()
+		self.map.close()
+		self.map = None
+		self.file.truncate(self.offset) # drop unused preallocated space
+		self.file.close()
+
+def read_session(path):
+	# Yields (record type, timestamp, payload bytes), records are parsed in place from the mapped file
+	with open(path, 'rb') as file:
+		if os.fstat(file.fileno()).st_size < SESSION_HEADER.size:
+			raise ValueError(f"{path} is not a session log")
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			view = memoryview(data)
+			try:
+				magic, version = SESSION_HEADER.unpack_from(view, 0)
+				if magic != SESSION_MAGIC or version != SESSION_VERSION:
+					raise ValueError(f"{path} is not a session log (or unsupported version)")
+				offset = SESSION_HEADER.size
+				end = len(view)
+				while offset + RECORD_HEADER.size <= end:
+					record_type, timestamp, length = RECORD_HEADER.unpack_from(view, offset)
+					if record_type == 0:
+						break # unused tail of a log that was not closed cleanly
+					offset += RECORD_HEADER.size
+					yield record_type, timestamp, view[offset:offset + length].tobytes()
+					offset += length
+			finally:
+				view.release()
+
+def session_to_arrays(path):
+	# Columnar export for offline analysis, numpy is only needed here
+	import numpy as np
+	frames = {RECORD_FRAME_OUT: ([], [], [], []), RECORD_NOTIFICATION: ([], [], [], [])}
+	joystick = ([], [], [], [], [])
+	for record_type, timestamp, payload in read_session(path):
+		if record_type in frames:
+			times, message_types, ports, values = frames[record_type]
+			times.append(timestamp)
+			message_types.append(payload[2] if len(payload) > 2 else 0)
+			ports.append(payload[3] if len(payload) > 3 else 0)
+			values.append(payload[-1] if len(payload) > 4 else 0) # last byte: power/lights/status depending on the frame
+		elif record_type == RECORD_JOYSTICK:
+			steering, left, right, buttons = JOYSTICK_SNAPSHOT.unpack(payload)
+			for column, value in zip(joystick, (timestamp, steering, left, right, buttons)):
+				column.append(value)
+	arrays = {}
+	for record_type, (times, message_types, ports, values) in frames.items():
+		name = RECORD_NAMES[record_type]
+		arrays[f"{name}_time"] = np.array(times, dtype=np.float64)
+		arrays[f"{name}_message_type"] = np.array(message_types, dtype=np.uint8)
+		arrays[f"{name}_port"] = np.array(ports, dtype=np.uint8)
+		arrays[f"{name}_last_byte"] = np.array(values, dtype=np.uint8)
+	arrays["joystick_time"] = np.array(joystick[0], dtype=np.float64)
+	arrays["joystick_steering"] = np.array(joystick[1], dtype=np.float32)
+	arrays["joystick_left_trigger"] = np.array(joystick[2], dtype=np.float32)
+	arrays["joystick_right_trigger"] = np.array(joystick[3], dtype=np.float32)
+	arrays["joystick_buttons"] = np.array(joystick[4], dtype=np.uint8)
+	return arrays
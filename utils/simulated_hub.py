@@ -0,0 +1,438 @@
+import asyncio
+import math
+import random
+import struct
+import time
+from collections import namedtuple
+from utils.lwp3_definitions import *
+
+# Values reported by the simulated hub, encoded the way the Technic Move hub sends them
+SIMULATED_PROPERTIES = {
+	HUB_PROPERTY_FW: bytes([0x00, 0x00, 0x01, 0x17]), # 1.7.1.0
+	HUB_PROPERTY_HW: bytes([0x00, 0x00, 0x00, 0x01]), # 0.1.0.0
+	HUB_PROPERTY_LWP: bytes([0x00, 0x03]),
+	HUB_PROPERTY_BATTERY_LEVEL: bytes([88]),
+}
+SIMULATED_VOLTAGE = 7820 # mV
+SIMULATED_TEMPERATURE = 254 # 0.1C
+FEEDBACK_COMPLETED_IDLE = FEEDBACK_STATUS_COMPLETED | FEEDBACK_STATUS_IDLE # 0x0a, what the hub sends after write direct commands
+# Steering motor model: first order speed response, hard mechanical end stops, angle notifications at the sensor rate
+SIMULATED_STEERING_RANGE = 75 # degrees from center to each end stop
+SIMULATED_STEERING_SPEED = 900 # deg/s at full power
+SIMULATED_STEERING_TIME_CONSTANT = 0.04 # s, motor and linkage inertia
+SIMULATED_SAMPLE_INTERVAL = 0.01 # s between sensor samples
+# Vehicle model behind the accelerometer and gyro: the drive motors spin the wheels, the tyres pass at most grip g to the car,
+# the rest is wheel slip; spinning wheels lose side grip and the car yaws more than the steering asks for (power oversteer)
+SIMULATED_TOP_SPEED = 3.0 # m/s wheel speed at full power
+SIMULATED_DRIVE_TIME_CONSTANT = 0.25 # s, wheel speed response to drive power
+SIMULATED_BRAKE_TIME_CONSTANT = 0.05 # s, wheels stopping with 0x7F
+SIMULATED_WHEEL_REACTION = 0.5 # share of the tyre force slowing the wheels down
+SIMULATED_GRIP = 1.0 # g, lower values simulate a slippery floor
+SIMULATED_TYRE_STIFFNESS = 40.0 # m/s2 per m/s of speed difference between wheels and car
+SIMULATED_CURVATURE = 2.0 # 1/m at full steering
+SIMULATED_YAW_TIME_CONSTANT = 0.08 # s
+SIMULATED_SPIN_GAIN = 1.8 # yaw rate multiplier once the driven wheels slip in a corner
+SIMULATED_SPIN_SLIP = 0.2 # slip ratio above which the driven wheels lose side grip
+GRAVITY = 9.81
+ACCEL_COUNTS_PER_G = 32768 / 8 # GRV mode, +-8000 mG
+GYRO_COUNTS_PER_DPS = 28571 / 2000 # ROT mode, +-2000 deg/s
+# Port and mode information: port -> (capabilities, mode combinations, modes), PORT_UNKNOWN_1 isn't attached
+# mode: name, input (else output), raw range, SI range, symbol, datasets, dataset type, figures, decimals
+SimulatedMode = namedtuple('SimulatedMode', 'name input raw si symbol datasets dataset_type figures decimals')
+MOTOR_POWER_MODE = SimulatedMode("POWER", False, (-100, 100), (-100, 100), "PCT", 1, DATASET_INT8, 4, 0)
+SIMULATED_PORT_MODES = {
+	PORT_DRIVE_MOTOR_1: (PORT_CAPABILITY_OUTPUT, (), (MOTOR_POWER_MODE,)),
+	PORT_DRIVE_MOTOR_2: (PORT_CAPABILITY_OUTPUT, (), (MOTOR_POWER_MODE,)),
+	PORT_STEERING_MOTOR: (PORT_CAPABILITY_OUTPUT | PORT_CAPABILITY_INPUT | PORT_CAPABILITY_COMBINABLE | PORT_CAPABILITY_SYNCHRONIZABLE, (0x000E,), (
+		MOTOR_POWER_MODE,
+		SimulatedMode("SPEED", True, (-100, 100), (-100, 100), "PCT", 1, DATASET_INT8, 4, 0),
+		SimulatedMode("POS", True, (-360, 360), (-360, 360), "DEG", 1, DATASET_INT32, 11, 0),
+		SimulatedMode("APOS", True, (-180, 180), (-180, 180), "DEG", 1, DATASET_INT16, 3, 0),
+	)),
+	PORT_6LEDS: (PORT_CAPABILITY_OUTPUT, (), (SimulatedMode("PIX 0", False, (0, 100), (0, 100), "PCT", 2, DATASET_INT8, 3, 0),)),
+	PORT_PLAYVM: (PORT_CAPABILITY_OUTPUT, (), (SimulatedMode("PLAYVM", False, (-100, 100), (-100, 100), "", 8, DATASET_INT8, 4, 0),)),
+	PORT_TEMPERATURE: (PORT_CAPABILITY_INPUT, (), (SimulatedMode("TEMP", True, (-900, 900), (-90, 90), "DEG", 1, DATASET_INT16, 5, 1),)),
+	PORT_ACCELEROMETER: (PORT_CAPABILITY_INPUT, (), (SimulatedMode("GRV", True, (-32768, 32767), (-8000, 8000), "mG", 3, DATASET_INT16, 5, 0),)),
+	PORT_GYRO: (PORT_CAPABILITY_INPUT, (), (SimulatedMode("ROT", True, (-28571, 28571), (-2000, 2000), "DPS", 3, DATASET_INT16, 5, 0),)),
+	PORT_TILT: (PORT_CAPABILITY_INPUT, (), (
+		SimulatedMode("POS", True, (-180, 180), (-180, 180), "DEG", 3, DATASET_INT16, 3, 0),
+		SimulatedMode("IMP", True, (0, 100), (0, 100), "CNT", 1, DATASET_INT32, 4, 0),
+	)),
+	PORT_ORIENTATION: (PORT_CAPABILITY_INPUT, (), (SimulatedMode("SIDE", True, (0, 5), (0, 5), "", 1, DATASET_INT16, 1, 0),)),
+	PORT_VOLTAGE: (PORT_CAPABILITY_INPUT, (), (
+		SimulatedMode("VLT L", True, (0, 9600), (0, 9600), "mV", 1, DATASET_INT16, 4, 0),
+		SimulatedMode("VLT S", True, (0, 9600), (0, 9600), "mV", 1, DATASET_INT16, 4, 0),
+	)),
+	PORT_GEST: (PORT_CAPABILITY_INPUT, (), (SimulatedMode("GEST", True, (0, 4), (0, 4), "", 1, DATASET_INT8, 1, 0),)),
+	PORT_HUB_LED: (PORT_CAPABILITY_OUTPUT, (), (
+		SimulatedMode("COL O", False, (0, 10), (0, 10), "", 1, DATASET_INT8, 1, 0),
+		SimulatedMode("RGB O", False, (0, 255), (0, 255), "", 3, DATASET_INT8, 3, 0),
+	)),
+}
+RANGE = struct.Struct('<ff')
+OUTPUT_PORTS = (PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2, PORT_STEERING_MOTOR, PORT_6LEDS, PORT_PLAYVM, PORT_HUB_LED)
+INPUT_PORTS = (PORT_STEERING_MOTOR, PORT_TEMPERATURE, PORT_ACCELEROMETER, PORT_GYRO, PORT_TILT, PORT_ORIENTATION, PORT_VOLTAGE)
+
+class SimulatedAdapter:
+	# The host's one BLE radio shared by several SimulatedClients, a write occupies it for airtime seconds
+	# so writes to different hubs queue behind each other like they do on a real adapter
+	def __init__(self, airtime=0.001):
+		self.airtime = airtime
+		self.lock = asyncio.Lock()
+		self.writes = 0
+
+	async def transmit(self):
+		async with self.lock:
+			await asyncio.sleep(self.airtime)
+			self.writes += 1
+
+# Stand-in for BleakClient, so scheduler and controller code can run without the car
+class SimulatedClient:
+	def __init__(self, write_latency=0.0, response_latency=None, virtual_ports=True, start_power2=True, jitter=0.0, loss=0.0, calibration_time=0.05, seed=None, address="00:00:00:00:00:00", disconnected_callback=None, steering_center=0, steering_range=SIMULATED_STEERING_RANGE, adapter=None):
+		self.write_latency = write_latency # seconds per write without response
+		self.response_latency = response_latency if response_latency is not None else write_latency * 2 # write with response waits for ATT confirmation
+		self.jitter = jitter # up to this many seconds added to every write
+		self.loss = loss # probability that a frame (either direction) never arrives
+		self.calibration_time = calibration_time # PLAYVM steering calibration reports completion after this time
+		self.random = random.Random(seed)
+		self.adapter = adapter # SimulatedAdapter shared with other clients, None: a radio of its own
+		self.is_connected = True
+		self.address = address
+		self.disconnected_callback = disconnected_callback
+		self.writes = [] # (monotonic timestamp, frame, response)
+		self.lost = [] # frames dropped on the way to the hub
+		self.notifications = [] # (monotonic timestamp, frame) delivered to the notify callback
+		self.notify_callback = None
+		self.virtual_ports_supported = virtual_ports
+		self.start_power2_supported = start_power2 # False: virtual ports attach but their StartPower2 frames are rejected
+		self.virtual_ports = {} # virtual port id -> (port a, port b)
+		self.next_virtual_port = 0x10
+		self.motor_updates = {PORT_DRIVE_MOTOR_1: [], PORT_DRIVE_MOTOR_2: []} # monotonic time each drive motor got new power
+		self.port_formats = {} # port -> (mode, delta, notify) from port input format setup
+		self.steering_center = steering_center # encoder angle of straight ahead, real hubs aren't zeroed at center
+		self.steering_range = steering_range
+		self.steering_angle = float(steering_center)
+		self.steering_velocity = 0.0
+		self.steering_power = 0
+		self.steering_stall_time = 0.0 # seconds the motor pushed against an end stop
+		self.steering_task = None
+		self.grip = SIMULATED_GRIP
+		self.drive_power = 0 # -100..100, motor 2 forward
+		self.drive_braking = False
+		self.playvm_steering = 0
+		self.wheel_speed = 0.0 # m/s
+		self.vehicle_speed = 0.0
+		self.acceleration = 0.0 # m/s2 along the car
+		self.yaw_rate = 0.0 # deg/s, positive to the right like positive steering
+		self.motion_task = None
+		self.voltage = SIMULATED_VOLTAGE # mV, can be changed to simulate a sagging battery
+		self.temperature = SIMULATED_TEMPERATURE # 0.1C
+
+	async def connect(self, timeout=None):
+		self.is_connected = True
+		return True
+
+	async def disconnect(self):
+		self.is_connected = False
+		for task in (self.steering_task, self.motion_task):
+			if task is not None:
+				task.cancel()
+		self.steering_task = None
+		self.motion_task = None
+		return True
+
+	async def pair(self, protection_level=None):
+		return True
+
+	def drop_link(self):
+		# link loss as bleak reports it: writes fail and the disconnected callback runs
+		self.is_connected = False
+		if self.disconnected_callback is not None:
+			self.disconnected_callback(self)
+
+	async def write_gatt_char(self, char_specifier, data, response=None):
+		if not self.is_connected:
+			raise OSError("Not connected")
+		latency = self.response_latency if response else self.write_latency
+		if self.jitter:
+			latency += self.random.uniform(0, self.jitter)
+		if latency:
+			await asyncio.sleep(latency)
+		if self.adapter is not None:
+			await self.adapter.transmit()
+		now = time.monotonic()
+		if self.loss and self.random.random() < self.loss:
+			self.lost.append((now, bytes(data), bool(response)))
+			return
+		self.writes.append((now, bytes(data), bool(response)))
+		self.handle_frame(bytes(data), now)
+
+	def handle_frame(self, data, now):
+		if len(data) < 3 or data[0] != len(data):
+			self.send_error(data[2] if len(data) > 2 else ERROR_GENERIC, ERROR_GENERIC)
+			return
+		message_type = data[2]
+		if message_type == HUB_PROPERTY:
+			self.handle_hub_property(data)
+		elif message_type == PORT_INPUT_INFORMATION_REQUEST:
+			self.handle_port_information_request(data)
+		elif message_type == PORT_MODE_INFORMATION_REQUEST:
+			self.handle_port_mode_information_request(data)
+		elif message_type == PORT_INPUT_COMMAND:
+			self.handle_port_input_format_setup(data)
+		elif message_type == VIRTUAL_PORT_SETUP:
+			self.handle_virtual_port_setup(data)
+		elif message_type == PORT_OUTPUT_COMMAND:
+			self.handle_output_command(data, now)
+		else:
+			self.send_error(message_type, ERROR_COMMAND_NOT_RECOGNIZED)
+
+	def handle_hub_property(self, data):
+		value = SIMULATED_PROPERTIES.get(data[3]) if len(data) >= 5 else None
+		if value is None or data[4] != HUB_PROPERTY_OPERATION_REQUEST_UPDATE:
+			self.send_error(HUB_PROPERTY, ERROR_INVALID_USE)
+			return
+		self.notify_frame(HUB_PROPERTY, data[3], HUB_PROPERTY_OPERATION_UPDATE, *value)
+
+	def handle_port_information_request(self, data):
+		if len(data) >= 5 and data[4] in (PORT_INFORMATION_MODE_INFO, PORT_INFORMATION_COMBINATIONS) and data[3] in SIMULATED_PORT_MODES:
+			port = data[3]
+			capabilities, combinations, modes = SIMULATED_PORT_MODES[port]
+			if data[4] == PORT_INFORMATION_MODE_INFO:
+				input_modes = sum(1 << mode for mode, info in enumerate(modes) if info.input)
+				output_modes = sum(1 << mode for mode, info in enumerate(modes) if not info.input)
+				self.notify_frame(MESSAGE_TYPE_PORT_INFORMATION, port, PORT_INFORMATION_MODE_INFO, capabilities, len(modes), *input_modes.to_bytes(2, 'little'), *output_modes.to_bytes(2, 'little'))
+			elif combinations:
+				self.notify_frame(MESSAGE_TYPE_PORT_INFORMATION, port, PORT_INFORMATION_COMBINATIONS, *b''.join(mask.to_bytes(2, 'little') for mask in combinations))
+			else:
+				self.send_error(PORT_INPUT_INFORMATION_REQUEST, ERROR_INVALID_USE)
+			return
+		if len(data) < 5 or data[3] not in INPUT_PORTS or data[4] != PORT_INFORMATION_VALUE:
+			self.send_error(PORT_INPUT_INFORMATION_REQUEST, ERROR_INVALID_USE)
+			return
+		port = data[3]
+		if port == PORT_VOLTAGE:
+			value = self.voltage
+		elif port == PORT_TEMPERATURE:
+			value = self.temperature
+		else:
+			value = 0
+		self.notify_frame(MESSAGE_TYPE_PORT_VALUE, port, value & 0xFF, (value >> 8) & 0xFF)
+
+	def handle_port_mode_information_request(self, data):
+		modes = SIMULATED_PORT_MODES[data[3]][2] if len(data) >= 6 and data[3] in SIMULATED_PORT_MODES else ()
+		if len(data) < 6 or data[4] >= len(modes):
+			self.send_error(PORT_MODE_INFORMATION_REQUEST, ERROR_INVALID_USE)
+			return
+		mode = modes[data[4]]
+		information_type = data[5]
+		if information_type == MODE_INFORMATION_NAME:
+			payload = mode.name.encode('ascii')
+		elif information_type == MODE_INFORMATION_RAW:
+			payload = RANGE.pack(*mode.raw)
+		elif information_type == MODE_INFORMATION_PCT:
+			payload = RANGE.pack(-100, 100) if mode.raw[0] < 0 else RANGE.pack(0, 100)
+		elif information_type == MODE_INFORMATION_SI:
+			payload = RANGE.pack(*mode.si)
+		elif information_type == MODE_INFORMATION_SYMBOL:
+			payload = mode.symbol.encode('ascii')
+		elif information_type == MODE_INFORMATION_MAPPING:
+			payload = bytes([0x10, 0x00] if mode.input else [0x00, 0x10]) # absolute value
+		elif information_type == MODE_INFORMATION_VALUE_FORMAT:
+			payload = bytes([mode.datasets, mode.dataset_type, mode.figures, mode.decimals])
+		else:
+			self.send_error(PORT_MODE_INFORMATION_REQUEST, ERROR_INVALID_USE)
+			return
+		self.notify_frame(MESSAGE_TYPE_PORT_MODE_INFORMATION, data[3], data[4], information_type, *payload)
+
+	def handle_port_input_format_setup(self, data):
+		if len(data) < 10 or data[3] not in INPUT_PORTS:
+			self.send_error(PORT_INPUT_COMMAND, ERROR_INVALID_USE)
+			return
+		self.port_formats[data[3]] = (data[4], int.from_bytes(data[5:9], 'little'), data[9])
+		self.notify_frame(MESSAGE_TYPE_PORT_INPUT_FORMAT, *data[3:10])
+		if data[3] == PORT_STEERING_MOTOR and data[9] and self.steering_task is None:
+			self.steering_task = asyncio.get_running_loop().create_task(self.simulate_steering())
+		if data[3] in (PORT_ACCELEROMETER, PORT_GYRO) and data[9] and self.motion_task is None:
+			self.motion_task = asyncio.get_running_loop().create_task(self.simulate_motion())
+
+	def update_steering(self, dt):
+		target_velocity = self.steering_power / 100 * SIMULATED_STEERING_SPEED
+		self.steering_velocity += (target_velocity - self.steering_velocity) * min(1.0, dt / SIMULATED_STEERING_TIME_CONSTANT)
+		angle = self.steering_angle + self.steering_velocity * dt
+		low, high = self.steering_center - self.steering_range, self.steering_center + self.steering_range
+		if angle <= low or angle >= high:
+			angle = max(low, min(high, angle))
+			self.steering_velocity = 0.0
+			if (angle == low and self.steering_power < 0) or (angle == high and self.steering_power > 0):
+				self.steering_stall_time += dt
+		self.steering_angle = angle
+
+	async def simulate_steering(self):
+		reported = None
+		last = time.monotonic()
+		while self.is_connected:
+			await asyncio.sleep(SIMULATED_SAMPLE_INTERVAL)
+			now = time.monotonic()
+			self.update_steering(now - last)
+			last = now
+			mode, delta, notify = self.port_formats[PORT_STEERING_MOTOR]
+			angle = round(self.steering_angle)
+			if notify and (reported is None or abs(angle - reported) >= max(1, delta)):
+				reported = angle
+				self.notify_frame(MESSAGE_TYPE_PORT_VALUE, PORT_STEERING_MOTOR, *(angle & 0xFFFFFFFF).to_bytes(4, 'little'))
+
+	def slip(self):
+		# (wheel speed - car speed) / speed, positive while the wheels spin, negative while they lock or turn the other way
+		return (self.wheel_speed - self.vehicle_speed) / max(abs(self.wheel_speed), abs(self.vehicle_speed), 0.1)
+
+	def update_motion(self, dt):
+		if self.drive_braking:
+			self.wheel_speed -= self.wheel_speed * min(1.0, dt / SIMULATED_BRAKE_TIME_CONSTANT)
+		else:
+			self.wheel_speed += (self.drive_power / 100 * SIMULATED_TOP_SPEED - self.wheel_speed) * min(1.0, dt / SIMULATED_DRIVE_TIME_CONSTANT)
+		limit = self.grip * GRAVITY
+		self.acceleration = max(-limit, min(limit, (self.wheel_speed - self.vehicle_speed) * SIMULATED_TYRE_STIFFNESS))
+		self.vehicle_speed += self.acceleration * dt
+		self.wheel_speed -= self.acceleration * SIMULATED_WHEEL_REACTION * dt
+		# the path the steering asks for, cut to the side grip left next to the drive force
+		yaw = self.vehicle_speed * self.playvm_steering / 100 * SIMULATED_CURVATURE
+		side_grip = limit * math.sqrt(max(0.0, 1 - (self.acceleration / limit) ** 2))
+		if abs(self.slip()) > SIMULATED_SPIN_SLIP and self.playvm_steering:
+			yaw *= SIMULATED_SPIN_GAIN
+		elif abs(yaw * self.vehicle_speed) > side_grip:
+			yaw = math.copysign(side_grip / abs(self.vehicle_speed), yaw) # understeer
+		self.yaw_rate += (math.degrees(yaw) - self.yaw_rate) * min(1.0, dt / SIMULATED_YAW_TIME_CONSTANT)
+
+	async def simulate_motion(self):
+		# accelerometer x along the car, y across, z up; gyro z is the yaw rate
+		reported = {}
+		last = time.monotonic()
+		while self.is_connected:
+			await asyncio.sleep(SIMULATED_SAMPLE_INTERVAL)
+			now = time.monotonic()
+			self.update_motion(now - last)
+			last = now
+			lateral = self.vehicle_speed * math.radians(self.yaw_rate)
+			values = {
+				PORT_ACCELEROMETER: (self.acceleration / GRAVITY * ACCEL_COUNTS_PER_G, lateral / GRAVITY * ACCEL_COUNTS_PER_G, ACCEL_COUNTS_PER_G),
+				PORT_GYRO: (0.0, 0.0, self.yaw_rate * GYRO_COUNTS_PER_DPS),
+			}
+			for port, value in values.items():
+				mode, delta, notify = self.port_formats.get(port, (None, 0, False))
+				counts = tuple(max(-32768, min(32767, round(axis))) for axis in value)
+				if notify and mode == PORT_MODE_0 and (port not in reported or max(abs(a - b) for a, b in zip(counts, reported[port])) >= max(1, delta)):
+					reported[port] = counts
+					self.notify_frame(MESSAGE_TYPE_PORT_VALUE, port, *struct.pack('<3h', *counts))
+
+	def handle_virtual_port_setup(self, data):
+		if len(data) < 6 or data[3] != VIRTUAL_PORT_CONNECT or not self.virtual_ports_supported:
+			self.send_error(VIRTUAL_PORT_SETUP, ERROR_COMMAND_NOT_RECOGNIZED)
+			return
+		port = self.next_virtual_port
+		self.next_virtual_port += 1
+		self.virtual_ports[port] = (data[4], data[5])
+		self.notify_frame(MESSAGE_TYPE_HUB_ATTACHED_IO, port, HUB_ATTACHED_IO_ATTACHED_VIRTUAL, 0x00, 0x00, data[4], data[5])
+
+	def handle_output_command(self, data, now):
+		port = data[3] if len(data) >= 4 else None
+		if port not in OUTPUT_PORTS and port not in self.virtual_ports:
+			self.send_error(PORT_OUTPUT_COMMAND, ERROR_INVALID_USE)
+			return
+		if port in self.virtual_ports and not (len(data) == 8 and data[5] == PORT_OUTPUT_SUBCOMMAND_START_POWER2 and self.start_power2_supported):
+			self.send_error(PORT_OUTPUT_COMMAND, ERROR_INVALID_USE) # a virtual port only takes StartPower2
+			return
+		for motor in self.virtual_ports.get(port, (port,)):
+			if motor in self.motor_updates:
+				self.motor_updates[motor].append(now)
+		if port == PORT_STEERING_MOTOR and len(data) == 8 and data[5] == PORT_OUTPUT_SUBCOMMAND_WRITE_DIRECT and data[6] == PORT_MODE_0:
+			power = data[7] - 256 if data[7] > 127 else data[7]
+			self.steering_power = 0 if power == 0x7F else power # 127 is brake
+		self.track_drive(port, data)
+		if len(data) < 5 or not data[4] & FEEDBACK_ACTION_ACTION_COMPLETION:
+			return
+		if port == PORT_PLAYVM and len(data) >= 12 and data[11] == PLAYVM_CALIBRATE_STEERING and self.calibration_time:
+			# calibration runs on the hub, completion is reported when the steering motor is done
+			self.notify_frame(MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK, port, FEEDBACK_STATUS_IN_PROGRESS)
+			asyncio.get_running_loop().call_later(self.calibration_time, self.notify_frame, MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK, port, FEEDBACK_COMPLETED_IDLE)
+		else:
+			self.notify_frame(MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK, port, FEEDBACK_COMPLETED_IDLE)
+
+	def track_drive(self, port, data):
+		# motor 2 power (the last power byte on the virtual port) drives the vehicle model, PLAYVM carries its steering
+		if port == PORT_DRIVE_MOTOR_2 and len(data) == 8:
+			power = data[7]
+		elif self.virtual_ports.get(port) == (PORT_DRIVE_MOTOR_1, PORT_DRIVE_MOTOR_2):
+			power = data[7]
+		else:
+			if port == PORT_PLAYVM and len(data) >= 12 and data[11] in (PLAYVM_LIGHTS_ON_ON, PLAYVM_LIGHTS_ON_BRAKING, PLAYVM_LIGHTS_OFF_OFF, PLAYVM_LIGHTS_OFF_BRAKING):
+				self.playvm_steering = data[10] - 256 if data[10] > 127 else data[10]
+			return
+		self.drive_braking = power == 0x7F
+		self.drive_power = 0 if self.drive_braking else (power - 256 if power > 127 else power)
+
+	def send_error(self, command_type, error_code):
+		self.notify_frame(MESSAGE_TYPE_ERROR, command_type, error_code)
+
+	def notify_frame(self, *args):
+		self.notify(bytes([len(args) + 2, MESSAGE_HEADER] + list(args)))
+
+	def motor_skew(self):
+		# time between the two drive motors receiving the same control update
+		return [abs(t2 - t1) for t1, t2 in zip(self.motor_updates[PORT_DRIVE_MOTOR_1], self.motor_updates[PORT_DRIVE_MOTOR_2])]
+
+	async def read_gatt_char(self, char_specifier):
+		return bytearray()
+
+	async def start_notify(self, char_specifier, callback):
+		self.notify_callback = callback
+
+	async def stop_notify(self, char_specifier):
+		self.notify_callback = None
+
+	def notify(self, data):
+		if self.loss and self.random.random() < self.loss:
+			return
+		if self.notify_callback is not None:
+			self.notifications.append((time.monotonic(), bytes(data)))
+			self.notify_callback(CHARACTERISTIC_UUID, bytearray(data))
+
+SimulatedDevice = namedtuple('SimulatedDevice', 'address name')
+SimulatedAdvertisement = namedtuple('SimulatedAdvertisement', 'local_name service_uuids rssi')
+
+class SimulatedScanner:
+	# Stand-in for BleakScanner, hubs are (address, name, seconds until the first advertisement) and advertise every interval
+	def __init__(self, detection_callback=None, hubs=(), interval=0.1):
+		self.detection_callback = detection_callback
+		self.hubs = hubs
+		self.interval = interval
+		self.task = None
+
+	async def advertise(self):
+		start = time.monotonic()
+		while True:
+			elapsed = time.monotonic() - start
+			for address, name, delay in self.hubs:
+				if elapsed >= delay and self.detection_callback is not None:
+					self.detection_callback(SimulatedDevice(address, name), SimulatedAdvertisement(name, [SERVICE_UUID], -60))
+			await asyncio.sleep(self.interval)
+
+	async def start(self):
+		self.task = asyncio.create_task(self.advertise())
+
+	async def stop(self):
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+
+	async def __aenter__(self):
+		await self.start()
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.stop()
+
+	async def discover(self, timeout=5.0):
+		# like BleakScanner.discover: always scans for the whole timeout
+		await asyncio.sleep(timeout)
+		return [SimulatedDevice(address, name) for address, name, delay in self.hubs if delay <= timeout]
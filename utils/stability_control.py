@@ -0,0 +1,203 @@
+import asyncio
+import math
+import time
+import numpy as np
+from utils.lwp3_definitions import *
+from utils.latency_stats import LatencyHistogram
+from utils.port_discovery import si_scale
+from utils.telemetry import TelemetryStream, telemetry_formats
+
+# Traction and stability control on the hub's IMU, run on absolute deadlines at CONTROL_RATE or faster
+# wheel slip: the measured acceleration integrated to the car's speed against a model of the wheel speed the drive power gives
+# yaw: the gyro's yaw rate against the rate the steering asks for at that speed
+CONTROL_RATE = 100 # Hz, lowest allowed rate
+COMPUTE_BUDGET = 0.5 # share of the control interval one iteration may use, the rest belongs to the event loop
+RECOVERY_ITERATIONS = 20 # on-time iterations after a missed deadline before corrections resume
+WINDOW = 0.05 # s of IMU samples filtered every iteration
+WINDOW_SAMPLES = 32 # upper bound, bunched notifications don't make an iteration slower
+FILTER_TIME_CONSTANT = 0.015 # s, exponential weights over the window
+# hub mounting: axis of forward acceleration and of yaw, positive to the right like positive steering
+LONGITUDINAL_AXIS = 0
+YAW_AXIS = 2
+ACCEL_SCALE = 8000 / 32768 # mG per count in GRV mode, used when no SI range was discovered
+GYRO_SCALE = 2000 / 28571 # deg/s per count in ROT mode
+GRAVITY = 9.81
+# vehicle: wheel speed at full power and its response to power changes, path curvature at full steering
+TOP_SPEED = 3.0 # m/s
+DRIVE_TIME_CONSTANT = 0.25 # s
+WHEEL_REACTION = 0.5 # share of the car's acceleration that holds the wheels back
+CURVATURE = 2.0 # 1/m
+MIN_SPEED = 0.1 # m/s, slip ratios below this speed are meaningless
+SPEED_LEAK = 2.0 # 1/s, the integrated speed is pulled towards the wheel speed so accelerometer bias can't build up
+SLIP_SPEED_LEAK = 0.5 # 1/s, the same while the wheels slip and their speed says less about the car's
+SLIP_LIMIT = 0.2 # slip ratio above which traction control limits power
+TRACTION_MARGIN = 20 # % power the wheels may be driven ahead of or behind the car's speed while slipping
+TRACTION_HOLD = 0.15 # s the limit stays after the slip ended
+YAW_MARGIN = 20.0 # deg/s tolerated above or below the requested yaw rate
+COUNTER_STEER_GAIN = 0.4 # steering % per deg/s of oversteer
+POWER_GAIN = 0.006 # power reduction per deg/s of yaw error
+MIN_POWER_FACTOR = 0.4
+
+def port_scale(capabilities, port, default):
+	# SI units per count from the discovered ranges, the GRV/ROT defaults otherwise
+	mode = capabilities.mode(port) if capabilities is not None else None
+	scale = si_scale(mode) if mode is not None else None
+	return scale[2] if scale is not None else default
+
+def filtered(times, values):
+	# exponentially weighted mean of the window, the newest samples count most
+	# notifications only come on changes, so the newest sample stands for the value however old it is
+	weights = np.exp((times - times[-1]) / FILTER_TIME_CONSTANT)
+	return float(np.dot(weights, values) / weights.sum())
+
+class StabilityController:
+	# Corrects drive power and steering percentage between input shaping and the frames, adjust() is called on every joystick
+	# update that is sent, run() recomputes the correction every 1/rate s and hands changed outputs to send(power, steering)
+	# A missed deadline (an iteration finishing after the next one was due, or using more than its compute budget) switches
+	# to pass-through: the driver's inputs go out unchanged until RECOVERY_ITERATIONS iterations were on time again
+	def __init__(self, send, rate=CONTROL_RATE, capabilities=None, clock=time.monotonic):
+		self.send = send
+		self.rate = max(CONTROL_RATE, rate)
+		self.clock = clock
+		ports = [PORT_ACCELEROMETER, PORT_GYRO]
+		self.stream = TelemetryStream(ports, capacity=256, formats=telemetry_formats(capabilities, ports))
+		self.accel_scale = port_scale(capabilities, PORT_ACCELEROMETER, ACCEL_SCALE) / 1000 * GRAVITY # m/s2 per count
+		self.gyro_scale = port_scale(capabilities, PORT_GYRO, GYRO_SCALE)
+		self.requested = (0, 0) # power, steering from input shaping
+		self.braking = False
+		self.sent = (0, 0) # last outputs that went to the car
+		self.estimating = False
+		self.speed = 0.0 # m/s, car
+		self.wheel_speed = 0.0 # m/s, model
+		self.slip = 0.0
+		self.yaw_rate = 0.0 # deg/s
+		self.acceleration = 0.0 # m/s2
+		self.traction_until = 0.0
+		self.power_factor = 1.0
+		self.steering_offset = 0.0
+		self.pass_through = False
+		self.on_time = 0
+		self.last_update = None
+		self.iterations = 0
+		self.missed = 0
+		self.pass_through_iterations = 0
+		self.traction_iterations = 0
+		self.yaw_iterations = 0
+		self.corrections_sent = 0
+		self.compute = LatencyHistogram()
+		self.lateness = LatencyHistogram()
+
+	def setup_frames(self, delta=1):
+		return self.stream.setup_frames(delta)
+
+	def attach(self, dispatcher):
+		self.stream.attach(dispatcher)
+
+	def detach(self, dispatcher):
+		self.stream.detach(dispatcher)
+
+	def traction_limited(self, now):
+		return now < self.traction_until
+
+	def active(self):
+		return self.estimating and not self.pass_through and not self.braking
+
+	def apply(self, power, steering):
+		if not self.active():
+			return power, steering
+		corrected = power * self.power_factor
+		if self.traction_limited(self.last_update):
+			# the wheels may only run TRACTION_MARGIN ahead of or behind the car: full reverse while rolling forward
+			# brakes at the grip limit instead of spinning the wheels backwards until the car stops
+			speed = self.speed / TOP_SPEED * 100
+			corrected = max(speed - TRACTION_MARGIN, min(speed + TRACTION_MARGIN, corrected))
+		steering = max(-100, min(100, steering + self.steering_offset))
+		return int(round(corrected)), int(round(steering))
+
+	def adjust(self, power, steering, braking=False):
+		# called where process_controller_input sends power and PLAYVM frames, returns what to send instead
+		self.requested = (power, steering)
+		self.braking = braking
+		self.sent = self.apply(power, steering)
+		return self.sent
+
+	def estimate(self, now, dt):
+		gyro_times, gyro = self.stream.window(PORT_GYRO, WINDOW_SAMPLES, WINDOW)
+		accel_times, accel = self.stream.window(PORT_ACCELEROMETER, WINDOW_SAMPLES, WINDOW)
+		if not len(gyro_times) or not len(accel_times):
+			return False
+		self.yaw_rate = filtered(gyro_times, gyro[:, YAW_AXIS]) * self.gyro_scale
+		self.acceleration = filtered(accel_times, accel[:, LONGITUDINAL_AXIS]) * self.accel_scale
+		power = 0 if self.braking else self.sent[0]
+		self.wheel_speed += (power / 100 * TOP_SPEED - self.wheel_speed) * min(1.0, dt / DRIVE_TIME_CONSTANT) - self.acceleration * WHEEL_REACTION * dt
+		self.speed += self.acceleration * dt
+		self.speed += (self.wheel_speed - self.speed) * min(1.0, dt * (SPEED_LEAK if abs(self.slip) < SLIP_LIMIT else SLIP_SPEED_LEAK))
+		self.slip = (self.wheel_speed - self.speed) / max(abs(self.wheel_speed), abs(self.speed), MIN_SPEED)
+		return True
+
+	def correct(self, now):
+		if abs(self.slip) > SLIP_LIMIT:
+			self.traction_until = now + TRACTION_HOLD
+		if self.traction_limited(now):
+			self.traction_iterations += 1
+		requested_yaw = math.degrees(self.requested[1] / 100 * CURVATURE * self.speed)
+		excess = abs(self.yaw_rate) - abs(requested_yaw)
+		if excess > YAW_MARGIN:
+			# oversteer: steer against the yaw and take power away
+			self.steering_offset = -math.copysign(COUNTER_STEER_GAIN * (excess - YAW_MARGIN), self.yaw_rate)
+			self.power_factor = max(MIN_POWER_FACTOR, 1 - POWER_GAIN * (excess - YAW_MARGIN))
+			self.yaw_iterations += 1
+		elif excess < -YAW_MARGIN:
+			# understeer: more steering doesn't help, less power does
+			self.steering_offset = 0.0
+			self.power_factor = max(MIN_POWER_FACTOR, 1 + POWER_GAIN * (excess + YAW_MARGIN))
+			self.yaw_iterations += 1
+		else:
+			self.steering_offset = 0.0
+			self.power_factor = 1.0
+
+	def update(self, now):
+		dt = now - self.last_update if self.last_update is not None else 1 / self.rate
+		self.last_update = now
+		self.estimating = self.estimate(now, dt)
+		if self.estimating:
+			self.correct(now)
+
+	async def run(self, stop_event):
+		interval = 1 / self.rate
+		budget = interval * COMPUTE_BUDGET
+		next_iteration = self.clock()
+		while not stop_event.is_set():
+			start = self.clock()
+			compute_start = time.perf_counter()
+			self.update(start)
+			output = self.apply(*self.requested)
+			compute = time.perf_counter() - compute_start
+			self.compute.record(compute)
+			self.lateness.record(max(0.0, start - next_iteration))
+			self.iterations += 1
+			if start + compute > next_iteration + interval or compute > budget:
+				self.missed += 1
+				self.on_time = 0
+				self.pass_through = True
+				output = self.requested
+			elif self.pass_through:
+				self.on_time += 1
+				if self.on_time >= RECOVERY_ITERATIONS:
+					self.pass_through = False
+			if self.pass_through:
+				self.pass_through_iterations += 1
+			if output != self.sent and not self.braking:
+				self.sent = output
+				self.corrections_sent += 1
+				await self.send(*output)
+			next_iteration = max(next_iteration + interval, self.clock())
+			await asyncio.sleep(next_iteration - self.clock())
+
+	def print_status(self):
+		state = "pass-through" if self.pass_through else "correcting" if self.active() else "waiting for IMU samples" if not self.estimating else "braking"
+		print(f"Stability control at {self.rate} Hz ({state}): speed {self.speed:.2f} m/s, slip {self.slip:.2f}, yaw {self.yaw_rate:.0f} deg/s, power x{self.power_factor:.2f}, steering {self.steering_offset:+.0f}%")
+		if self.compute.total:
+			budget = 1000000 / self.rate * COMPUTE_BUDGET
+			print(f"  {self.iterations} iterations, compute p50 {self.compute.percentile(50) * 1000000:.0f}us p95 {self.compute.percentile(95) * 1000000:.0f}us max {self.compute.maximum}us (budget {budget:.0f}us), lateness p95 {self.lateness.milliseconds(95):.2f}ms")
+			print(f"  {self.missed} missed deadlines, {self.pass_through_iterations} iterations in pass-through, traction limited {self.traction_iterations}, yaw corrected {self.yaw_iterations}, {self.corrections_sent} corrections sent")
@@ -0,0 +1,155 @@
+import asyncio
+import struct
+import time
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import drive_motor_frame, port_input_format_setup_frame
+
+STEERING_ANGLE_MODE = PORT_MODE_2 # POS, int32 degrees, the mode reset_encoder writes
+ANGLE = struct.Struct('<i')
+END_STOP_MARGIN = 4 # degrees kept away from an observed end stop
+STALL_POWER = 25 # pushing at least this hard...
+STALL_SPEED = 15 # ...while moving slower than this (deg/s)...
+STALL_TIME = 0.06 # ...for this long means the motor is against an end stop
+SWEEP_POWER = 30 # just above STALL_POWER, the end stops take as little force as the sweep can get away with
+SWEEP_SPIN_UP = 0.05 # s before a motor standing still counts as being at the stop
+SWEEP_TIMEOUT = 1.0 # per direction
+STILL_TIME = 0.03 # notifications only come on angle changes, none for this long means the motor stands still
+CONTROL_INTERVAL = 0.01 # control also runs without notifications, so a motor stuck at a stop is noticed
+
+class SteeringController:
+	# PD position control of the steering motor, run on every angle notification
+	# end stops come from a sweep at start and from stalls while driving, targets stay inside them by END_STOP_MARGIN
+	# submit(frame) hands power frames to the scheduler without awaiting, it is called from the notification callback
+	def __init__(self, submit, kp=5.0, kd=0.15, max_power=100, deadband=1, learn_stops=True, clock=time.monotonic):
+		self.submit = submit
+		self.kp = kp
+		self.kd = kd
+		self.max_power = max_power
+		self.deadband = deadband
+		self.learn_stops = learn_stops
+		self.clock = clock
+		self.angle = None
+		self.velocity = 0.0 # deg/s, filtered
+		self.sample_time = None
+		self.samples = 0
+		self.left_stop = None
+		self.right_stop = None
+		self.target_percent = 0
+		self.power = 0 # last power sent
+		self.override = None # fixed power during the sweep
+		self.stall_since = None
+		self.stalls = 0
+		self.subscription = None
+
+	def setup_frame(self, delta=1):
+		return port_input_format_setup_frame(PORT_STEERING_MOTOR, STEERING_ANGLE_MODE, delta)
+
+	def attach(self, dispatcher):
+		self.subscription = dispatcher.subscribe(self.handle_port_value, (MESSAGE_TYPE_PORT_VALUE,))
+
+	def detach(self, dispatcher):
+		if self.subscription is not None:
+			dispatcher.unsubscribe(self.subscription)
+			self.subscription = None
+
+	def ready(self):
+		return self.left_stop is not None and self.right_stop is not None
+
+	def target_angle(self):
+		center = (self.left_stop + self.right_stop) / 2
+		half = max(0.0, (self.right_stop - self.left_stop) / 2 - END_STOP_MARGIN)
+		return center + self.target_percent / 100 * half
+
+	def current_velocity(self, now):
+		return self.velocity if now - self.sample_time < STILL_TIME else 0.0
+
+	def handle_port_value(self, data):
+		if data[3] != PORT_STEERING_MOTOR or len(data) < 4 + ANGLE.size:
+			return
+		angle = ANGLE.unpack_from(data, 4)[0]
+		now = self.clock()
+		if self.angle is not None and now > self.sample_time:
+			self.velocity = 0.5 * self.velocity + 0.5 * (angle - self.angle) / (now - self.sample_time)
+		self.angle = angle
+		self.sample_time = now
+		self.samples += 1
+		self.control(now)
+
+	def set_target(self, percent):
+		# steering percentage -100..100 from the input shaping, the whole learned range is used
+		self.target_percent = max(-100, min(100, percent))
+		self.control(self.clock())
+
+	def send(self, power):
+		power = int(max(-self.max_power, min(self.max_power, power)))
+		if power != self.power:
+			self.power = power
+			self.submit(drive_motor_frame(PORT_STEERING_MOTOR, power & 0xFF))
+
+	def stalled(self, power, velocity, now):
+		if abs(power) < STALL_POWER or abs(velocity) > STALL_SPEED:
+			self.stall_since = None
+			return False
+		if self.stall_since is None:
+			self.stall_since = now
+		return now - self.stall_since >= STALL_TIME
+
+	def control(self, now):
+		if self.angle is None:
+			return
+		if self.override is not None:
+			self.send(self.override)
+			return
+		if not self.ready():
+			return
+		velocity = self.current_velocity(now)
+		error = self.target_angle() - self.angle
+		power = 0 if abs(error) <= self.deadband else self.kp * error - self.kd * velocity
+		if self.learn_stops and self.stalled(power, velocity, now):
+			# target is past the real end stop: the stop moves to where the motor got stuck, power is released
+			if power > 0:
+				self.right_stop = min(self.right_stop, self.angle)
+			else:
+				self.left_stop = max(self.left_stop, self.angle)
+			self.stalls += 1
+			self.stall_since = None
+			power = 0
+		self.send(power)
+
+	async def sweep(self, power):
+		# drive towards one end stop until the angle stops changing and release the motor right there, returns the angle
+		self.override = power
+		self.control(self.clock())
+		start = self.clock()
+		while self.clock() - start < SWEEP_TIMEOUT:
+			await asyncio.sleep(CONTROL_INTERVAL)
+			now = self.clock()
+			if self.angle is not None and now - start > SWEEP_SPIN_UP and abs(self.current_velocity(now)) < STALL_SPEED:
+				break
+		self.override = None
+		self.send(0)
+		return self.angle
+
+	async def calibrate(self):
+		# observed end stops instead of the fixed 88% clamp, True when both were found
+		left = await self.sweep(-SWEEP_POWER)
+		right = await self.sweep(SWEEP_POWER)
+		if left is None or right is None or right - left < 2 * END_STOP_MARGIN + 10:
+			self.send(0)
+			return False
+		self.left_stop, self.right_stop = left, right
+		self.target_percent = 0
+		self.control(self.clock())
+		return True
+
+	async def run(self, stop_event):
+		while not stop_event.is_set():
+			await asyncio.sleep(CONTROL_INTERVAL)
+			self.control(self.clock())
+		self.send(0)
+
+	def print_status(self):
+		stops = f"end stops {self.left_stop}..{self.right_stop} deg" if self.ready() else "end stops unknown"
+		angle = f"angle {self.angle} deg" if self.angle is not None else "no angle yet"
+		target = f", target {self.target_angle():.0f} deg" if self.ready() else ""
+		print(f"Closed-loop steering: {stops}, {angle}{target}, power {self.power}, {self.samples} samples, {self.stalls} stalls released")
@@ -0,0 +1,144 @@
+import time
+import numpy as np
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import port_input_format_setup_frame
+
+# port -> (mode, values per sample, value type), mode 0 of the motion sensors is assumed to be 3 x int16 like on the Technic hub
+TELEMETRY_FORMATS = {
+	PORT_ACCELEROMETER: (PORT_MODE_0, 3, np.int16),
+	PORT_GYRO: (PORT_MODE_0, 3, np.int16),
+	PORT_TILT: (PORT_MODE_0, 3, np.int16),
+	PORT_ORIENTATION: (PORT_MODE_0, 1, np.int16),
+}
+
+NUMPY_DATASET_TYPES = {DATASET_INT8: np.int8, DATASET_INT16: np.int16, DATASET_INT32: np.int32, DATASET_FLOAT: np.float32}
+
+def telemetry_formats(capabilities, ports):
+	# value formats reported by the hub (port discovery) replace the assumed ones
+	formats = dict(TELEMETRY_FORMATS)
+	for port in ports:
+		mode = formats[port][0]
+		value_format = capabilities.value_format(port, mode) if capabilities is not None else None
+		if value_format is not None and value_format.datasets and value_format.dataset_type in NUMPY_DATASET_TYPES:
+			formats[port] = (mode, value_format.datasets, NUMPY_DATASET_TYPES[value_format.dataset_type])
+	return formats
+
+TELEMETRY_PORT_NAMES = {
+	"accel": PORT_ACCELEROMETER,
+	"gyro": PORT_GYRO,
+	"tilt": PORT_TILT,
+	"orientation": PORT_ORIENTATION,
+}
+
+class PortRing:
+	# Fixed size ring of timestamped samples, notifications are staged as raw bytes and decoded in bulk
+	def __init__(self, port, mode, values, dtype, capacity=4096, staging=256):
+		self.port = port
+		self.mode = mode
+		self.dtype = np.dtype(dtype).newbyteorder('<')
+		self.sample_size = self.dtype.itemsize * values
+		self.capacity = capacity
+		self.times = np.zeros(capacity, dtype=np.float64)
+		self.values = np.zeros((capacity, values), dtype=self.dtype)
+		self.head = 0 # next write position
+		self.count = 0
+		self.total = 0
+		self.stage_bytes = bytearray(self.sample_size * staging)
+		self.stage_view = memoryview(self.stage_bytes)
+		self.stage_times = np.zeros(staging, dtype=np.float64)
+		self.staged = 0
+
+	def stage(self, data, timestamp):
+		# called from the notification callback, the sample bytes are copied straight from the frame into preallocated staging
+		offset = self.staged * self.sample_size
+		self.stage_view[offset:offset + self.sample_size] = memoryview(data)[4:4 + self.sample_size]
+		self.stage_times[self.staged] = timestamp
+		self.staged += 1
+		if self.staged == len(self.stage_times):
+			self.flush()
+
+	def flush(self):
+		staged = self.staged
+		if staged == 0:
+			return
+		samples = np.frombuffer(self.stage_bytes, dtype=self.dtype, count=staged * self.values.shape[1]).reshape(staged, -1)
+		skip = max(0, staged - self.capacity) # staging larger than the ring: only the newest samples fit
+		kept = staged - skip
+		first = min(kept, self.capacity - self.head)
+		self.values[self.head:self.head + first] = samples[skip:skip + first]
+		self.times[self.head:self.head + first] = self.stage_times[skip:skip + first]
+		if kept > first:
+			self.values[:kept - first] = samples[skip + first:]
+			self.times[:kept - first] = self.stage_times[skip + first:staged]
+		self.head = (self.head + kept) % self.capacity
+		self.count = min(self.capacity, self.count + kept)
+		self.total += staged
+		self.staged = 0
+
+	def latest(self):
+		self.flush()
+		if self.count == 0:
+			return None, None
+		index = (self.head - 1) % self.capacity
+		return self.times[index], self.values[index].copy()
+
+	def window(self, samples=None, seconds=None):
+		# chronological copy of the newest samples, limited by count and/or age
+		self.flush()
+		samples = self.count if samples is None else min(samples, self.count)
+		indexes = (np.arange(self.head - samples, self.head)) % self.capacity
+		times = self.times[indexes]
+		values = self.values[indexes]
+		if seconds is not None and samples:
+			keep = times >= times[-1] - seconds
+			times = times[keep]
+			values = values[keep]
+		return times, values
+
+	def rate(self, seconds=1.0):
+		times, values = self.window(seconds=seconds)
+		if len(times) < 2 or times[-1] == times[0]:
+			return 0.0
+		return (len(times) - 1) / (times[-1] - times[0])
+
+class TelemetryStream:
+	def __init__(self, ports, capacity=4096, formats=TELEMETRY_FORMATS):
+		self.rings = {}
+		for port in ports:
+			mode, values, dtype = formats[port]
+			self.rings[port] = PortRing(port, mode, values, dtype, capacity)
+		self.subscription = None
+
+	def setup_frames(self, delta=1):
+		return [port_input_format_setup_frame(port, ring.mode, delta) for port, ring in self.rings.items()]
+
+	def attach(self, dispatcher):
+		self.subscription = dispatcher.subscribe(self.handle_port_value, (MESSAGE_TYPE_PORT_VALUE,))
+
+	def detach(self, dispatcher):
+		if self.subscription is not None:
+			dispatcher.unsubscribe(self.subscription)
+			self.subscription = None
+
+	def handle_port_value(self, data):
+		ring = self.rings.get(data[3])
+		if ring is not None and len(data) >= 4 + ring.sample_size:
+			ring.stage(data, time.monotonic())
+
+	def flush(self):
+		for ring in self.rings.values():
+			ring.flush()
+
+	def latest(self, port):
+		return self.rings[port].latest()
+
+	def window(self, port, samples=None, seconds=None):
+		return self.rings[port].window(samples, seconds)
+
+	def print_status(self):
+		for port, ring in self.rings.items():
+			timestamp, values = ring.latest()
+			if timestamp is None:
+				print(f"Port 0x{port:02x}: no samples")
+			else:
+				print(f"Port 0x{port:02x}: {values.tolist()} ({ring.rate():.0f} samples/s, {ring.total} total)")
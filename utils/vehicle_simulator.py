@@ -0,0 +1,210 @@
+import numpy as np
+from utils.input_shaping import InputShaper, INPUT_RANGE, MAX_SLEW_DT
+
+# Kinematic model of the 42176 for tuning input shaping: drive power -> speed (first order, stalls below STALL_POWER and
+# when reversing at speed), PLAYVM steering percentage -> wheel angle (rate limited, stalls pushing past the 88% the
+# steering calibration allows). Every joystick trace x shaper configuration runs in one batch, one numpy step per sample.
+TOP_SPEED = 3.0 # m/s at full power
+DRIVE_TIME_CONSTANT = 0.25 # s
+COAST_TIME_CONSTANT = 0.6 # s, motors off or stalled
+BRAKE_TIME_CONSTANT = 0.08 # s, 0x7F
+STALL_POWER = 30 # % drive power below which the motors stall (as in session-replay)
+REVERSE_STALL_SPEED = 0.5 # m/s, power against the direction of travel above this speed stalls the motors
+MAX_WHEEL_ANGLE = 28.0 # degrees at 100% PLAYVM steering
+STEERING_RATE = 150.0 # deg/s of wheel angle
+STEERING_STALL_PERCENT = 88 # PLAYVM steering beyond this pushes the steering motor against its end stop
+# score: tracking error in % of the speed at the power limit and of full wheel angle, plus penalties per stall per minute and per write per second
+STALL_PENALTY = 2.0
+WRITE_PENALTY = 0.2
+
+# shaper options as in InputShaper(**config)
+DEFAULT_CONFIG = {'powerlimit': 100, 'power_slew': 0, 'steering_slew': 0, 'power_curve': 1.0, 'steering_curve': 1.0, 'steering_scale': False, 'power_deadzone': 15, 'steering_limit': 88}
+
+def compile_configs(configs):
+	# lookup tables, thresholds and slew rates of InputShaper for every configuration, shape (configs, ...)
+	shapers = [InputShaper(**{**DEFAULT_CONFIG, **config}) for config in configs]
+	return {
+		'power_table': np.array([shaper.power_table for shaper in shapers], dtype=np.int32),
+		'steering_table': np.array([shaper.steering_table for shaper in shapers], dtype=np.int32),
+		'power_threshold': np.array([shaper.power_threshold for shaper in shapers], dtype=np.int32),
+		'steering_threshold': np.array([shaper.steering_threshold for shaper in shapers], dtype=np.int32),
+		'power_slew': np.array([shaper.power_slew for shaper in shapers], dtype=np.float64),
+		'steering_slew': np.array([shaper.steering_slew for shaper in shapers], dtype=np.float64),
+		'power_floor': np.array([shaper.power_deadzone + 1 for shaper in shapers], dtype=np.int32),
+		'powerlimit': np.array([shaper.powerlimit for shaper in shapers], dtype=np.float64),
+	}
+
+def slew(value, target, rate, dt, floor=None):
+	# InputShaper.slew for whole arrays, floor (drive power) passes direction changes through zero and skips the deadzone
+	step = np.maximum(1, np.trunc(rate * dt)).astype(np.int32)
+	if floor is not None:
+		target_through_zero = np.where(value * target < 0, 0, target)
+	else:
+		target_through_zero = target
+	moved = np.where(target_through_zero > value, value + step, value - step)
+	if floor is not None:
+		inside = (np.abs(moved) > 0) & (np.abs(moved) < floor)
+		moved = np.where(inside, np.where(target_through_zero == 0, 0, np.where(target_through_zero > 0, floor, -floor)), moved)
+	moved = np.where(np.abs(target_through_zero - value) <= step, target_through_zero, moved)
+	return np.where((rate == 0) | (value == target), target, moved)
+
+def random_traces(count, duration, rate=100, seed=None):
+	# joystick traces like a driver's: held positions with short ramps between them, some braking
+	# (count, samples) arrays of steering axis, left and right trigger (-1 released .. 1) and brake button
+	generator = np.random.default_rng(seed)
+	samples = int(duration * rate)
+	steering = np.zeros((count, samples))
+	left = np.full((count, samples), -1.0)
+	right = np.full((count, samples), -1.0)
+	brake = np.zeros((count, samples), dtype=bool)
+	for trace in range(count):
+		start = 0
+		previous = (0.0, -1.0, -1.0)
+		while start < samples:
+			length = int(generator.uniform(0.4, 2.0) * rate)
+			end = min(samples, start + length)
+			throttle = generator.choice((0.0, 0.3, 0.6, 1.0, -0.5, -1.0), p=(0.15, 0.15, 0.2, 0.3, 0.1, 0.1))
+			target = (
+				generator.choice((0.0, generator.uniform(-1, 1), generator.choice((-1.0, 1.0)))),
+				max(0.0, -throttle) * 2 - 1,
+				max(0.0, throttle) * 2 - 1,
+			)
+			ramp = max(1, min(end - start, int(generator.uniform(0.02, 0.3) * rate)))
+			for column, begin, value in zip((steering, left, right), previous, target):
+				column[trace, start:start + ramp] = np.linspace(begin, value, ramp + 1)[1:]
+				column[trace, start + ramp:end] = value
+			brake[trace, start:end] = generator.random() < 0.05
+			previous = target
+			start = end
+	# pygame reports axes in steps of 1/32767
+	quantize = lambda values: np.round(values * 32767) / 32767
+	return {'steering': quantize(steering), 'left': quantize(left), 'right': quantize(right), 'brake': brake}
+
+def session_traces(paths, rate=100):
+	# joystick snapshots of recorded sessions (-record) resampled to rate, the last snapshot holds until the next one
+	# and shorter sessions end with the stick released
+	from utils.session_recorder import session_to_arrays, JOYSTICK_BRAKE
+	sessions = [session_to_arrays(path) for path in paths]
+	sessions = [arrays for arrays in sessions if len(arrays['joystick_time'])]
+	if not sessions:
+		return None
+	samples = max(int((arrays['joystick_time'][-1] - arrays['joystick_time'][0]) * rate) + 1 for arrays in sessions)
+	traces = {'steering': np.zeros((len(sessions), samples)), 'left': np.full((len(sessions), samples), -1.0), 'right': np.full((len(sessions), samples), -1.0), 'brake': np.zeros((len(sessions), samples), dtype=bool)}
+	for trace, arrays in enumerate(sessions):
+		times = arrays['joystick_time'] - arrays['joystick_time'][0]
+		indexes = np.searchsorted(times, np.arange(samples) / rate, side='right') - 1
+		for name, column in (('steering', 'joystick_steering'), ('left', 'joystick_left_trigger'), ('right', 'joystick_right_trigger')):
+			traces[name][trace] = arrays[column].astype(np.float64)[indexes]
+		traces['brake'][trace] = (arrays['joystick_buttons'][indexes] & JOYSTICK_BRAKE) != 0
+	return traces
+
+def simulate(traces, configs, rate=100, latency=0.0075, drive_frames=1, record=False):
+	# Runs every trace with every configuration like -input event at rate Hz: a sample with joystick changes (or a slew
+	# ramp still moving) goes through the shaper, and power/PLAYVM frames are sent when process_controller_input would send
+	# them; the car gets them latency s later. Results are (traces, configs) arrays, record=True adds the sent values
+	# per sample, shape (samples, traces, configs)
+	compiled = compile_configs(configs)
+	count, samples = traces['steering'].shape
+	shape = (count, len(configs))
+	interval = 1 / rate
+	delay = max(0, int(round(latency * rate)))
+	power_table, steering_table = compiled['power_table'], compiled['steering_table']
+	config_index = np.arange(len(configs))[None, :]
+	zeros = lambda dtype=np.int32: np.zeros(shape, dtype=dtype)
+	# shaper and controller state
+	power, steering, power_target, steering_target = zeros(), zeros(), zeros(), zeros()
+	last_power, last_steering = zeros(), zeros()
+	last_update = np.full(shape, np.nan)
+	braking = zeros(bool)
+	previous_inputs = (np.zeros(count), np.full(count, -1.0), np.full(count, -1.0), np.zeros(count, dtype=bool))
+	# what the car received, latency steps ago
+	sent = [(zeros(), zeros(), zeros(bool)) for slot in range(delay + 1)]
+	speed, wheel_angle = zeros(np.float64), zeros(np.float64)
+	drive_stalled, steering_stalled = zeros(bool), zeros(bool)
+	writes, stalls, stall_samples = zeros(), zeros(), zeros()
+	speed_error, angle_error = zeros(np.float64), zeros(np.float64)
+	if record:
+		recorded = {'sent': np.zeros((samples,) + shape, dtype=bool), 'power': np.zeros((samples,) + shape, dtype=np.int8), 'steering': np.zeros((samples,) + shape, dtype=np.int8), 'brake': np.zeros((samples,) + shape, dtype=bool)}
+	for sample in range(samples):
+		now = sample / rate
+		inputs = tuple(traces[name][:, sample] for name in ('steering', 'left', 'right', 'brake'))
+		event = np.zeros(count, dtype=bool)
+		for value, previous in zip(inputs, previous_inputs):
+			event |= value != previous
+		previous_inputs = inputs
+		# handle_controller_events(batch=True): joystick events, or no events while a slew ramp is still moving
+		settling = (power != power_target) | (steering != steering_target)
+		processed = event[:, None] | settling
+		raw_power = np.trunc(((inputs[2] - inputs[1]) * 100) / 2).astype(np.int32)
+		raw_steering = np.trunc(inputs[0] * 100).astype(np.int32)
+		brake = np.broadcast_to(inputs[3][:, None], shape)
+		# InputShaper.shape and update
+		new_power_target = power_table[config_index, np.clip(raw_power, -INPUT_RANGE, INPUT_RANGE)[:, None] + INPUT_RANGE]
+		new_steering_target = steering_table[config_index, np.clip(raw_steering, -INPUT_RANGE, INPUT_RANGE)[:, None] + INPUT_RANGE]
+		dt = np.where(np.isnan(last_update), 0.0, np.minimum(now - last_update, MAX_SLEW_DT))
+		new_power = slew(power, new_power_target, compiled['power_slew'], dt, compiled['power_floor'])
+		new_steering = slew(steering, new_steering_target, compiled['steering_slew'], dt)
+		was_settling = (power != new_power_target) | (steering != new_steering_target)
+		ramp_finished = was_settling & (new_power == new_power_target) & (new_steering == new_steering_target)
+		power = np.where(processed, new_power, power)
+		steering = np.where(processed, new_steering, steering)
+		power_target = np.where(processed, new_power_target, power_target)
+		steering_target = np.where(processed, new_steering_target, steering_target)
+		last_update = np.where(processed, now, last_update)
+		# InputShaper.power_changed and steering_changed against the last sent values
+		power_changed = processed & ((np.abs(power - last_power) >= compiled['power_threshold']) | ((power != last_power) & ((power == 0) | (np.abs(power) == 100) | ramp_finished)))
+		steering_changed = processed & ((np.abs(steering - last_steering) >= compiled['steering_threshold']) | ((steering != last_steering) & ((steering == 0) | ramp_finished)))
+		brake_changed = processed & (brake != braking)
+		braking = np.where(processed, brake, braking)
+		last_power = np.where(power_changed, power, last_power)
+		last_steering = np.where(steering_changed, steering, last_steering)
+		send = power_changed | steering_changed | brake_changed
+		writes += send * (1 + drive_frames)
+		current_power, current_steering, current_brake = sent[-1]
+		sent.append((np.where(send, power, current_power), np.where(send, steering, current_steering), np.where(send, brake, current_brake)))
+		if record:
+			recorded['sent'][sample] = send
+			recorded['power'][sample] = np.where(send, power, 0)
+			recorded['steering'][sample] = np.where(send, steering, 0)
+			recorded['brake'][sample] = send & brake
+		car_power, car_steering, car_brake = sent.pop(0)
+
+		# drive: stalls below STALL_POWER and pushing against the direction of travel at speed, coasting meanwhile
+		stalled = ~car_brake & (((car_power != 0) & (np.abs(car_power) < STALL_POWER)) | ((car_power * speed < 0) & (np.abs(speed) > REVERSE_STALL_SPEED)))
+		driving = ~car_brake & ~stalled & (car_power != 0)
+		time_constant = np.where(car_brake, BRAKE_TIME_CONSTANT, np.where(driving, DRIVE_TIME_CONSTANT, COAST_TIME_CONSTANT))
+		speed += (np.where(driving, car_power / 100 * TOP_SPEED, 0.0) - speed) * np.minimum(1.0, interval / time_constant)
+		# steering: the wheels follow the PLAYVM percentage at STEERING_RATE
+		angle_step = STEERING_RATE * interval
+		wheel_angle += np.clip(car_steering / 100 * MAX_WHEEL_ANGLE - wheel_angle, -angle_step, angle_step)
+		pushing = np.abs(car_steering) > STEERING_STALL_PERCENT
+		stalls += (stalled & ~drive_stalled) + (pushing & ~steering_stalled)
+		stall_samples += stalled | pushing
+		drive_stalled, steering_stalled = stalled, pushing
+		# responsiveness: distance from what the stick asks for at the configured power limit
+		intended_speed = np.clip(raw_power, -INPUT_RANGE, INPUT_RANGE)[:, None] / 100 * (compiled['powerlimit'] / 100) * TOP_SPEED * ~brake
+		speed_error += np.abs(intended_speed - speed) / (compiled['powerlimit'] / 100)
+		angle_error += np.abs(np.clip(raw_steering, -INPUT_RANGE, INPUT_RANGE)[:, None] / 100 * MAX_WHEEL_ANGLE - wheel_angle)
+	duration = samples * interval
+	result = {
+		'writes': writes,
+		'writes_per_s': writes / duration,
+		'stalls': stalls,
+		'stall_time': stall_samples * interval,
+		'speed_error': speed_error / samples,
+		'angle_error': angle_error / samples,
+		'duration': duration,
+	}
+	result['score'] = score(result)
+	if record:
+		result.update(recorded)
+	return result
+
+def score(result):
+	# lower is better: mean tracking error in % plus stall and write penalties
+	tracking = result['speed_error'] / TOP_SPEED * 100 + result['angle_error'] / MAX_WHEEL_ANGLE * 100
+	return tracking + STALL_PENALTY * result['stalls'] / (result['duration'] / 60) + WRITE_PENALTY * result['writes_per_s']
+
+def rank(configs, result):
+	# (mean score, config index) over all traces, best first
+	return sorted((float(result['score'][:, index].mean()), index) for index in range(len(configs)))
@@ -0,0 +1,23 @@
+import asyncio
+from utils.lwp3_definitions import *
+from utils.lwp3_frames import virtual_port_setup_frame, combined_motor_frame
+from utils.response_dispatcher import LWP3Error
+
+async def virtual_port_accepts(dispatcher, write, frame, timeout=1.0):
+	# True when the hub confirms a StartPower2 frame on the virtual port, False on an error reply or no feedback
+	try:
+		await dispatcher.request(write, frame, (MESSAGE_TYPE_PORT_OUTPUT_COMMAND_FEEDBACK, frame[3]), timeout)
+		return True
+	except (asyncio.TimeoutError, LWP3Error):
+		return False
+
+async def connect_virtual_port(dispatcher, write, port_a, port_b, timeout=1.0):
+	# Returns the port id the hub assigned to the combined port, None when virtual port setup or its power command is rejected
+	try:
+		data = await dispatcher.request(write, virtual_port_setup_frame(port_a, port_b), (MESSAGE_TYPE_HUB_ATTACHED_IO, port_a, port_b), timeout)
+	except (asyncio.TimeoutError, LWP3Error):
+		return None
+	port = data[3]
+	if not await virtual_port_accepts(dispatcher, write, combined_motor_frame(port, 0x00, 0x00), timeout):
+		return None
+	return port